@@ -1,29 +1,139 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template_string, session as flask_session
+from flask import Blueprint, Flask, current_app, g, request, jsonify, send_from_directory, render_template_string, session as flask_session, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session as ReportSession
+from sqlalchemy.pool import NullPool
 from flask_cors import CORS
 from dotenv import load_dotenv
+import atexit
+import base64
+import bisect
 import os
-import qrcode
 import secrets
-import csv
-from io import StringIO
-from functools import wraps
-from datetime import datetime, timedelta
-import bcrypt
+import sys
+from collections import deque
+from contextlib import ExitStack, contextmanager, nullcontext
+from functools import lru_cache, wraps
+from datetime import date, datetime, timedelta
 import json
+import hashlib
+import inspect
+import re
+import gzip
+import math
+from pathlib import Path
+import threading
+import time
+import unicodedata
+import zlib
+
+# qrcode/Pillow, bcrypt and csv are imported where they are used, keeping
+# worker start-up fast; they are only needed by a few handlers.
+
+try:
+    import orjson  # Optional: faster JSON serialization
+except ImportError:
+    orjson = None
 
 load_dotenv()
 
-app = Flask(__name__, static_folder='../frontend', static_url_path='')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attendance.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.secret_key = os.environ.get('SECRET_KEY', 'dev_secret_key_change_in_production')
+class AttendanceJSONProvider(DefaultJSONProvider):
+    """Writes datetimes as ISO 8601 and uses orjson for encoding when it is installed"""
+    
+    fast = orjson is not None and os.environ.get('JSON_FAST_SERIALIZER', '1') == '1'
+    
+    @staticmethod
+    def default(o):
+        if isinstance(o, (datetime, date)):
+            return o.isoformat()
+        return DefaultJSONProvider.default(o)
+    
+    def dumps(self, obj, **kwargs):
+        if not self.fast:
+            return super().dumps(obj, **kwargs)
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode('utf-8')
+
+db = SQLAlchemy()
+bp = Blueprint('attendance', __name__, cli_group=None)
 
-db = SQLAlchemy(app)
-CORS(app)
+DEFAULT_QR_CODES_DIR = os.path.join(os.path.dirname(__file__), '../qr_codes')
+FRONTEND_DIR = os.path.join(os.path.dirname(__file__), '../frontend')
 
-QR_CODES_DIR = os.path.join(os.path.dirname(__file__), '../qr_codes')
-os.makedirs(QR_CODES_DIR, exist_ok=True)
+def load_config(app):
+    """Default settings, each overridable from the environment or .env"""
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///attendance.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.secret_key = os.environ.get('SECRET_KEY', 'dev_secret_key_change_in_production')
+    
+    # JSON responses larger than this many bytes are gzip-compressed
+    app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+    
+    # Create or upgrade the schema when the app is built (0 leaves it to init_db())
+    app.config['DB_INIT_ON_START'] = os.environ.get('DB_INIT_ON_START', '1') == '1'
+    
+    # Directory for session QR images; empty means qr_codes/ next to the backend.
+    # qr_sweep deletes images the database does not know, so it only runs on a directory set here
+    app.config['QR_CODES_DIR'] = os.environ.get('QR_CODES_DIR', '')
+    
+    # Background maintenance settings (intervals in seconds, 0 disables a job)
+    app.config['MAINTENANCE_ENABLED'] = os.environ.get('MAINTENANCE_ENABLED', '1') == '1'
+    app.config['QR_SWEEP_INTERVAL'] = int(os.environ.get('QR_SWEEP_INTERVAL', 3600))
+    app.config['QR_SWEEP_BATCH_SIZE'] = int(os.environ.get('QR_SWEEP_BATCH_SIZE', 200))
+    app.config['QR_SWEEP_MIN_AGE'] = int(os.environ.get('QR_SWEEP_MIN_AGE', 300))
+    app.config['DB_OPTIMIZE_INTERVAL'] = int(os.environ.get('DB_OPTIMIZE_INTERVAL', 86400))
+    app.config['DB_VACUUM_PAGES'] = int(os.environ.get('DB_VACUUM_PAGES', 500))
+    app.config['SESSION_EXPIRY_INTERVAL'] = int(os.environ.get('SESSION_EXPIRY_INTERVAL', 60))
+    
+    # Admission control for /attend (bucket sizes in requests, rates in requests per second)
+    app.config['ADMISSION_IP_BURST'] = float(os.environ.get('ADMISSION_IP_BURST', 20))
+    app.config['ADMISSION_IP_RATE'] = float(os.environ.get('ADMISSION_IP_RATE', 1))
+    app.config['ADMISSION_SESSION_BURST'] = float(os.environ.get('ADMISSION_SESSION_BURST', 300))
+    app.config['ADMISSION_SESSION_RATE'] = float(os.environ.get('ADMISSION_SESSION_RATE', 50))
+    app.config['ADMISSION_RESERVE'] = float(os.environ.get('ADMISSION_RESERVE', 0.2))
+    
+    # Proxy attendance: distinct students on one device / one IP that flag a session (0 disables).
+    # The IP rule is off by default: behind campus NAT every student shares one address
+    app.config['PROXY_DEVICE_THRESHOLD'] = int(os.environ.get('PROXY_DEVICE_THRESHOLD', 2))
+    app.config['PROXY_IP_THRESHOLD'] = int(os.environ.get('PROXY_IP_THRESHOLD', 0))
+    # Reverse proxies in front of the app whose X-Forwarded-For is trusted for the client address
+    app.config['TRUSTED_PROXY_COUNT'] = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+    
+    # Printable QR sheets: processes drawing pages (0 draws them in the request thread)
+    app.config['QR_SHEET_WORKERS'] = int(os.environ.get('QR_SHEET_WORKERS', min(4, os.cpu_count() or 1)))
+    
+    # Cache coherence: expire cached data when other worker processes write to the same database
+    app.config['CACHE_COHERENCE_ENABLED'] = os.environ.get('CACHE_COHERENCE_ENABLED', '1') == '1'
+    
+    # Sampling profiler: longest profile an admin can request, in seconds
+    app.config['PROFILER_MAX_SECONDS'] = float(os.environ.get('PROFILER_MAX_SECONDS', 60))
+    
+    # Check-in form autocomplete: seconds before a course's roster index is reloaded from the database
+    app.config['ROSTER_INDEX_MAX_AGE'] = int(os.environ.get('ROSTER_INDEX_MAX_AGE', 60))
+    
+    # Reporting mode: analytics and exports read a periodically refreshed copy of the database
+    app.config['REPORT_SNAPSHOT_ENABLED'] = os.environ.get('REPORT_SNAPSHOT_ENABLED', '0') == '1'
+    app.config['REPORT_SNAPSHOT_INTERVAL'] = int(os.environ.get('REPORT_SNAPSHOT_INTERVAL', 60))
+    app.config['REPORT_SNAPSHOT_MAX_AGE'] = int(os.environ.get('REPORT_SNAPSHOT_MAX_AGE', 300))
+    
+    # Online backups (BACKUP_DIR defaults to a backups folder next to the database)
+    app.config['BACKUP_INTERVAL'] = int(os.environ.get('BACKUP_INTERVAL', 86400))
+    app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', '')
+    app.config['BACKUP_PAGES_PER_STEP'] = int(os.environ.get('BACKUP_PAGES_PER_STEP', 25))
+    app.config['BACKUP_STEP_SLEEP'] = float(os.environ.get('BACKUP_STEP_SLEEP', 0.01))
+    app.config['BACKUP_COMPRESS'] = os.environ.get('BACKUP_COMPRESS', '1') == '1'
+    app.config['BACKUP_RETAIN'] = int(os.environ.get('BACKUP_RETAIN', 7))
+    
+    # Change feed: longest long-poll in seconds, and how long logged changes are kept
+    app.config['CHANGE_FEED_MAX_WAIT'] = float(os.environ.get('CHANGE_FEED_MAX_WAIT', 30))
+    app.config['CHANGE_FEED_RETENTION_DAYS'] = int(os.environ.get('CHANGE_FEED_RETENTION_DAYS', 90))
+    app.config['CHANGE_FEED_PRUNE_INTERVAL'] = int(os.environ.get('CHANGE_FEED_PRUNE_INTERVAL', 86400))
 
 # Enhanced Models with additional fields
 class User(db.Model):
@@ -41,10 +151,12 @@ class User(db.Model):
     
     def set_password(self, password):
         """Hash and set password"""
+        import bcrypt
         self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
     
     def check_password(self, password):
         """Check if provided password matches hash"""
+        import bcrypt
         return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
 
 class Course(db.Model):
@@ -52,17 +164,19 @@ class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    instructor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    instructor_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.now)
     is_active = db.Column(db.Boolean, default=True)  # Course status
     course_code = db.Column(db.String(20), nullable=True)  # Course code like "CS101"
     max_students = db.Column(db.Integer, nullable=True)  # Max enrollment
+    late_grace_minutes = db.Column(db.Integer, default=10)  # Check-ins after start + grace are late
+    early_leave_minutes = db.Column(db.Integer, default=10)  # Check-outs before end - this are early
     sessions = db.relationship('Session', backref='course', lazy=True)
 
 class Session(db.Model):
     __tablename__ = 'sessions'
     id = db.Column(db.Integer, primary_key=True)
-    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False, index=True)
     entry_token = db.Column(db.String(64), unique=True, nullable=False)  # Entry QR code token
     exit_token = db.Column(db.String(64), unique=True, nullable=False)   # Exit QR code token
     session_name = db.Column(db.String(120), nullable=True)
@@ -86,29 +200,278 @@ class Attendance(db.Model):
     exit_time = db.Column(db.DateTime, nullable=True)     # When exited
     course_name = db.Column(db.String(120), nullable=True)
     user_agent = db.Column(db.String(500), nullable=True) # Browser info
-    status = db.Column(db.String(20), default='present')  # present, late, excused
+    status = db.Column(db.String(20), default='present')  # present, late, left_early, absent, excused
     duration_minutes = db.Column(db.Integer, nullable=True)  # Auto-calculated duration
+    student_key = db.Column(db.String(200), nullable=True, index=True)  # Normalized identity, see normalize_student_key
+    # One row per student per session; check-in upserts conflict on this
+    __table_args__ = (db.Index('uq_attendance_session_student', 'session_id', 'student_key', unique=True),)
+
+class RosterEntry(db.Model):
+    __tablename__ = 'course_roster'
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('courses.id'), nullable=False, index=True)
+    name = db.Column(db.String(120), nullable=False)
+    surname = db.Column(db.String(120), nullable=False)
+    student_id = db.Column(db.String(50), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    __table_args__ = (db.UniqueConstraint('course_id', 'name', 'surname', name='uq_roster_course_student'),)
+
+class AttendanceChange(db.Model):
+    """Append-only log of attendance writes, filled by triggers; seq orders the change feed"""
+    __tablename__ = 'attendance_changes'
+    seq = db.Column(db.Integer, primary_key=True)
+    attendance_id = db.Column(db.Integer, nullable=False)
+    session_id = db.Column(db.Integer, nullable=True)
+    course_id = db.Column(db.Integer, nullable=True)
+    op = db.Column(db.String(10), nullable=False)  # insert, update, delete
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+    # AUTOINCREMENT: sequence numbers are never reused, even after pruning
+    __table_args__ = {'sqlite_autoincrement': True}
+
+# Triggers catch every write, including the set-based UPDATEs run when sessions close.
+# SQLite runs one writer at a time, so seq order is commit order and readers see no gaps.
+ATTENDANCE_CHANGE_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS attendance_changes_{op} AFTER {op.upper()} ON attendances BEGIN
+        INSERT INTO attendance_changes (attendance_id, session_id, course_id, op, changed_at)
+        VALUES ({row}.id, {row}.session_id, (SELECT course_id FROM sessions WHERE id = {row}.session_id),
+                '{op}', datetime('now', 'localtime'));
+    END'''
+    for op, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD'))
+]
+AttendanceChange.__table__.add_is_dependent_on(Attendance.__table__)
+for trigger in ATTENDANCE_CHANGE_TRIGGERS:
+    event.listen(AttendanceChange.__table__, 'after_create', db.DDL(trigger).execute_if(dialect='sqlite'))
+# Rows that predate the log enter it once as inserts, so a feed read from the start is complete
+event.listen(AttendanceChange.__table__, 'after_create', db.DDL('''
+    INSERT INTO attendance_changes (attendance_id, session_id, course_id, op, changed_at)
+    SELECT a.id, a.session_id, s.course_id, 'insert', datetime('now', 'localtime')
+    FROM attendances a LEFT JOIN sessions s ON s.id = a.session_id ORDER BY a.id
+''').execute_if(dialect='sqlite'))
+
+class CacheInvalidation(db.Model):
+    """Log of session, course and roster writes, filled by triggers; workers replay it to expire their caches"""
+    __tablename__ = 'cache_invalidations'
+    seq = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(10), nullable=False)  # session, course, roster
+    op = db.Column(db.String(10), nullable=False)      # insert, update, close, delete
+    course_id = db.Column(db.Integer, nullable=True)
+    session_id = db.Column(db.Integer, nullable=True)
+    instructor_id = db.Column(db.Integer, nullable=True)
+    changed_at = db.Column(db.DateTime, nullable=False, index=True)
+    __table_args__ = {'sqlite_autoincrement': True}
+
+# Attendance writes are already in attendance_changes; these cover the other tables that
+# cached analytics, roster indexes and the proxy detector depend on. A session update
+# leaving it inactive is logged as a close, and a course handed to another instructor
+# is logged under both instructors.
+CACHE_INVALIDATION_SESSION = "(SELECT instructor_id FROM courses WHERE id = {row}.course_id)"
+CACHE_INVALIDATION_TRIGGERS = [
+    f'''CREATE TRIGGER IF NOT EXISTS cache_invalidations_{table}_{op} AFTER {op.upper()} ON {table} BEGIN
+        INSERT INTO cache_invalidations (source, op, course_id, session_id, instructor_id, changed_at)
+        {select.format(now="datetime('now', 'localtime')")};
+    END'''
+    for table, op, select in (
+        ('sessions', 'insert', "SELECT 'session', 'insert', NEW.course_id, NEW.id, "
+                               f"{CACHE_INVALIDATION_SESSION.format(row='NEW')}, {{now}}"),
+        ('sessions', 'update', "SELECT 'session', CASE WHEN NEW.is_active THEN 'update' ELSE 'close' END, "
+                               f"NEW.course_id, NEW.id, {CACHE_INVALIDATION_SESSION.format(row='NEW')}, {{now}}"),
+        ('sessions', 'delete', "SELECT 'session', 'delete', OLD.course_id, OLD.id, "
+                               f"{CACHE_INVALIDATION_SESSION.format(row='OLD')}, {{now}}"),
+        ('courses', 'insert', "SELECT 'course', 'insert', NEW.id, NULL, NEW.instructor_id, {now}"),
+        ('courses', 'update', "SELECT 'course', 'update', NEW.id, NULL, NEW.instructor_id, {now} "
+                              "UNION ALL SELECT 'course', 'update', OLD.id, NULL, OLD.instructor_id, {now} "
+                              "WHERE OLD.instructor_id IS NOT NEW.instructor_id"),
+        ('courses', 'delete', "SELECT 'course', 'delete', OLD.id, NULL, OLD.instructor_id, {now}"),
+        ('course_roster', 'insert', "SELECT 'roster', 'insert', NEW.course_id, NULL, NULL, {now}"),
+        ('course_roster', 'update', "SELECT 'roster', 'update', NEW.course_id, NULL, NULL, {now}"),
+        ('course_roster', 'delete', "SELECT 'roster', 'delete', OLD.course_id, NULL, NULL, {now}")
+    )
+]
+for table in (Session.__table__, Course.__table__, RosterEntry.__table__):
+    CacheInvalidation.__table__.add_is_dependent_on(table)
+for trigger in CACHE_INVALIDATION_TRIGGERS:
+    event.listen(CacheInvalidation.__table__, 'after_create', db.DDL(trigger).execute_if(dialect='sqlite'))
+
+# Full-text search over attendance rows. rowid is the attendance id; course_scope holds
+# a 'c<course_id>' token so an instructor's course filter is part of the MATCH itself.
+ATTENDANCE_SEARCH_COLUMNS = ('name', 'surname', 'student_id', 'course_name', 'session_name')
+ATTENDANCE_SEARCH_ROW = """
+    {row}.id, {row}.name, {row}.surname, {row}.student_id, {row}.course_name,
+    (SELECT session_name FROM sessions WHERE id = {row}.session_id),
+    'c' || (SELECT course_id FROM sessions WHERE id = {row}.session_id)
+"""
+ATTENDANCE_SEARCH_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS attendance_search USING fts5(
+        {', '.join(ATTENDANCE_SEARCH_COLUMNS)}, course_scope,
+        tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS attendance_search_insert AFTER INSERT ON attendances BEGIN
+        INSERT INTO attendance_search (rowid, {', '.join(ATTENDANCE_SEARCH_COLUMNS)}, course_scope)
+        VALUES ({ATTENDANCE_SEARCH_ROW.format(row='NEW')});
+    END""",
+    # Check-outs and status changes leave the searchable columns alone and skip this trigger
+    f"""CREATE TRIGGER IF NOT EXISTS attendance_search_update
+    AFTER UPDATE OF name, surname, student_id, course_name, session_id ON attendances BEGIN
+        DELETE FROM attendance_search WHERE rowid = OLD.id;
+        INSERT INTO attendance_search (rowid, {', '.join(ATTENDANCE_SEARCH_COLUMNS)}, course_scope)
+        VALUES ({ATTENDANCE_SEARCH_ROW.format(row='NEW')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS attendance_search_delete AFTER DELETE ON attendances BEGIN
+        DELETE FROM attendance_search WHERE rowid = OLD.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS attendance_search_session_rename AFTER UPDATE OF session_name ON sessions BEGIN
+        UPDATE attendance_search SET session_name = NEW.session_name
+        WHERE rowid IN (SELECT id FROM attendances WHERE session_id = NEW.id);
+    END"""
+]
+
+def create_attendance_search(conn):
+    """Create the search table and its triggers; a new table is filled from existing rows in one statement"""
+    exists = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attendance_search'"
+    ).first()
+    for ddl in ATTENDANCE_SEARCH_SCHEMA:
+        conn.exec_driver_sql(ddl)
+    if not exists:
+        conn.exec_driver_sql(f"""
+            INSERT INTO attendance_search (rowid, {', '.join(ATTENDANCE_SEARCH_COLUMNS)}, course_scope)
+            SELECT a.id, a.name, a.surname, a.student_id, a.course_name, s.session_name, 'c' || s.course_id
+            FROM attendances a LEFT JOIN sessions s ON s.id = a.session_id
+        """)
+
+def normalize_student_key(name, surname, student_id=None):
+    """Stable cross-course identity: the student ID when given, otherwise the full name"""
+    student_id = ''.join((student_id or '').split()).casefold()
+    if student_id and student_id != 'n/a':
+        return f'id:{student_id}'
+    name = ' '.join((name or '').split()).casefold()
+    surname = ' '.join((surname or '').split()).casefold()
+    return f'name:{name}|{surname}'
+
+def same_name(name, surname):
+    """SQL condition: an attendance row under this name and surname, whatever its key.
+    
+    Case and surrounding spaces are ignored (ASCII case only, as SQLite's lower()).
+    """
+    fold = lambda column: db.func.lower(db.func.trim(column))
+    return db.and_(fold(Attendance.name) == fold(db.literal(' '.join(name.split()))),
+                   fold(Attendance.surname) == fold(db.literal(' '.join(surname.split()))))
+
+def backfill_student_keys(session_id=None, batch_size=1000):
+    """Fill student_key for rows written before it existed or by bulk SQL inserts"""
+    updated = 0
+    while True:
+        query = db.session.query(
+            Attendance.id, Attendance.name, Attendance.surname, Attendance.student_id
+        ).filter(Attendance.student_key.is_(None))
+        if session_id is not None:
+            query = query.filter(Attendance.session_id == session_id)
+        rows = query.limit(batch_size).all()
+        if not rows:
+            return updated
+        db.session.execute(db.update(Attendance), [
+            {'id': row.id, 'student_key': normalize_student_key(row.name, row.surname, row.student_id)}
+            for row in rows
+        ])
+        updated += len(rows)
+        if session_id is None:
+            db.session.commit()
+
+def sql_literal(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+def merge_duplicate_attendance():
+    """Merge rows of one student in one session into the first, as the unique index requires.
+    
+    The kept row takes the earliest check-in and the latest check-out, with
+    the duration recomputed between them, the status of the row whose
+    check-in it kept (an excused row stays excused), and any details only
+    the other rows had. Returns {kept id: [merged ids]}.
+    """
+    groups = db.session.query(Attendance.session_id, Attendance.student_key).filter(
+        Attendance.student_key.isnot(None)
+    ).group_by(Attendance.session_id, Attendance.student_key).having(db.func.count(Attendance.id) > 1).all()
+    merged = {}
+    for session_id, student_key in groups:
+        rows = Attendance.query.filter_by(session_id=session_id, student_key=student_key).order_by(Attendance.id).all()
+        kept, others = rows[0], rows[1:]
+        checked_in = [row for row in rows if row.entry_time is not None]
+        first_in = min(checked_in, key=lambda row: row.entry_time) if checked_in else kept
+        kept.entry_time = first_in.entry_time
+        kept.exit_time = max((row.exit_time for row in rows if row.exit_time is not None), default=None)
+        if kept.entry_time is not None and kept.exit_time is not None:
+            kept.duration_minutes = round((kept.exit_time - kept.entry_time).total_seconds()) // 60
+        else:
+            kept.duration_minutes = max((row.duration_minutes for row in rows if row.duration_minutes is not None), default=None)
+        kept.status = 'excused' if any(row.status == 'excused' for row in rows) else first_in.status
+        for column in ('student_id', 'ip_address', 'user_agent', 'course_name'):
+            if not getattr(kept, column):
+                setattr(kept, column, next((getattr(row, column) for row in others if getattr(row, column)), getattr(kept, column)))
+        for row in others:
+            db.session.delete(row)
+        merged[kept.id] = [row.id for row in others]
+    db.session.commit()
+    return merged
+
+def upgrade_schema():
+    """Add columns, indexes and the search table introduced after a table was first created.
+    
+    Derived columns are filled in and duplicate check-ins merged before the
+    indexes are built, since a unique index cannot be created over duplicates.
+    """
+    inspector = db.inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=conn.dialect)}'
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f' DEFAULT {sql_literal(column.default.arg)}'
+                conn.exec_driver_sql(ddl)
+                print(f"Added column {table.name}.{column.name}")
+    backfill_student_keys()
+    for kept, removed in merge_duplicate_attendance().items():
+        print(f"Merged duplicate attendance rows {removed} into row {kept}")
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        create_attendance_search(conn)
 
 # Database initialization with existing data preservation
-def init_db():
+def schema_fingerprint():
+    """Checksum of the models' tables, columns and indexes plus the search schema, kept in PRAGMA user_version"""
+    signature = ';'.join(
+        f"{t.name}:{','.join(c.name for c in t.columns)}:{','.join(sorted(i.name for i in t.indexes))}"
+        for t in db.metadata.sorted_tables
+    ) + ';'.join(ATTENDANCE_SEARCH_SCHEMA)
+    return zlib.crc32(signature.encode('utf-8')) & 0x7fffffff
+
+def init_db(app=None):
+    app = app or current_app._get_current_object()
     with app.app_context():
-        # Create tables only if they don't exist
-        db.create_all()
-        print("Database tables checked/created!")
+        # Schema work is skipped entirely when the file already matches the models
+        fingerprint = schema_fingerprint()
+        with db.engine.connect() as conn:
+            schema_current = conn.exec_driver_sql('PRAGMA user_version').scalar() == fingerprint
+        if not schema_current:
+            # Create tables only if they don't exist
+            db.create_all()
+            upgrade_schema()
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(f'PRAGMA user_version = {fingerprint}')
+            print("Database tables checked/created!")
         
         # Check if admin user already exists
         existing_admin = User.query.filter_by(username='admin').first()
         if existing_admin:
             print("Database already initialized - preserving existing data!")
-            print("Database status - ENHANCED ATTENDANCE SYSTEM:")
-            print("👨‍💼 Admin: username=admin")
-            print("👨‍🏫 Instructor: username=instructor")
-            print("📱 Students: NO LOGIN - Only QR Code Access")
-            print("🔒 Password Security: ENABLED")
-            print("📊 Analytics: ENABLED")
-            print(f"Total users: {User.query.count()}")
-            print(f"Total courses: {Course.query.count()}")
-            print(f"Total sessions: {Session.query.count()}")
             return
         
         # Create default admin and instructor users (only if they don't exist)
@@ -173,9 +536,6 @@ def init_db():
         print("📱 Students: NO LOGIN - Only QR Code Access")
         print("🔒 Password Security: ENABLED")
         print("📊 Analytics: ENABLED")
-        print(f"Total users: {User.query.count()}")
-        print(f"Total courses: {Course.query.count()}")
-        print(f"Total sessions: {Session.query.count()}")
 
 # Auth decorator
 def login_required(role=None):
@@ -191,6 +551,7 @@ def login_required(role=None):
     return decorator
 
 # Utility functions
+@lru_cache(maxsize=1)
 def get_lan_ip():
     import socket
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -203,12 +564,126 @@ def get_lan_ip():
         s.close()
     return ip
 
+def qr_codes_dir():
+    """Where session QR images are written and served from"""
+    return current_app.config['QR_CODES_DIR'] or DEFAULT_QR_CODES_DIR
+
+def qr_code_filenames(session_obj):
+    """Return the entry and exit QR image filenames for a session"""
+    return [f'{session_obj.entry_token}_entry.png', f'{session_obj.exit_token}_exit.png']
+
+def remove_session_qr_files(session_obj):
+    """Delete a session's QR images, returning the number of bytes freed"""
+    freed = 0
+    for filename in qr_code_filenames(session_obj):
+        path = os.path.join(qr_codes_dir(), filename)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            freed += size
+        except OSError:
+            pass
+    return freed
+
+# Static assets: fingerprinted, precompressed and cached forever by browsers
+FINGERPRINTED_ASSETS = {'style.css': 'text/css', 'main.js': 'application/javascript'}
+static_assets = {'built_from': None, 'files': {}}
+static_assets_lock = threading.Lock()
+
+def compress_variants(body):
+    """Precompress an asset body with every available encoding"""
+    variants = {'gzip': gzip.compress(body, compresslevel=9)}
+    try:
+        import brotli  # Optional: enables precompressed .br assets
+    except ImportError:
+        return variants
+    variants['br'] = brotli.compress(body, quality=11)
+    return variants
+
+def build_static_assets():
+    """Fingerprint and precompress frontend assets, rewriting index.html to use them"""
+    files = {}
+    html = open(os.path.join(FRONTEND_DIR, 'index.html'), encoding='utf-8').read()
+    for name, mimetype in FINGERPRINTED_ASSETS.items():
+        with open(os.path.join(FRONTEND_DIR, name), 'rb') as f:
+            body = f.read()
+        digest = hashlib.sha256(body).hexdigest()[:12]
+        base, ext = os.path.splitext(name)
+        hashed_name = f'{base}.{digest}{ext}'
+        files[hashed_name] = {'body': body, 'mimetype': mimetype, 'etag': digest, 'encodings': compress_variants(body)}
+        html = html.replace(f'href="{name}"', f'href="/assets/{hashed_name}"')
+        html = html.replace(f'src="{name}"', f'src="/assets/{hashed_name}"')
+    body = html.encode('utf-8')
+    files['index.html'] = {
+        'body': body,
+        'mimetype': 'text/html',
+        'etag': hashlib.sha256(body).hexdigest()[:12],
+        'encodings': compress_variants(body)
+    }
+    return files
+
+def frontend_mtimes():
+    names = ['index.html'] + list(FINGERPRINTED_ASSETS)
+    return tuple(os.path.getmtime(os.path.join(FRONTEND_DIR, name)) for name in names)
+
+def get_static_assets():
+    """Build assets on first use; in debug mode rebuild whenever a file changes"""
+    built_from = static_assets['built_from']
+    if built_from is not None and not current_app.debug:
+        return static_assets['files']
+    mtimes = frontend_mtimes()
+    if built_from != mtimes:
+        with static_assets_lock:
+            if static_assets['built_from'] != mtimes:
+                static_assets['files'] = build_static_assets()
+                static_assets['built_from'] = mtimes
+    return static_assets['files']
+
+def serve_asset(asset, cache_control):
+    if request.if_none_match.contains(asset['etag']):
+        response = current_app.response_class(status=304)
+    else:
+        encoding = request.accept_encodings.best_match(list(asset['encodings']))
+        body = asset['encodings'][encoding] if encoding else asset['body']
+        response = current_app.response_class(body, mimetype=asset['mimetype'])
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(asset['etag'])
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+@bp.after_app_request
+def compress_json_response(response):
+    """Gzip dynamic JSON bodies above COMPRESS_MIN_SIZE when the client accepts it"""
+    if (response.mimetype != 'application/json'
+            or response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is None or response.content_length < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    if not request.accept_encodings['gzip']:
+        return response
+    response.set_data(gzip.compress(response.get_data(), compresslevel=6))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 # Routes
-@app.route('/')
+@bp.route('/')
 def index():
-    return app.send_static_file('index.html')
+    return serve_asset(get_static_assets()['index.html'], 'no-cache')
+
+@bp.route('/assets/<filename>')
+def serve_fingerprinted_asset(filename):
+    asset = get_static_assets().get(filename)
+    if asset is None or filename == 'index.html':
+        return 'Not found', 404
+    return serve_asset(asset, 'public, max-age=31536000, immutable')
 
-@app.route('/api/init_db')
+@bp.route('/api/init_db')
 def init_database():
     try:
         init_db()
@@ -216,7 +691,7 @@ def init_database():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/login', methods=['POST'])
+@bp.route('/api/login', methods=['POST'])
 def login():
     data = request.json
     username = data.get('username')
@@ -237,30 +712,103 @@ def login():
         'full_name': user.full_name
     })
 
-@app.route('/api/logout', methods=['POST'])
+@bp.route('/api/logout', methods=['POST'])
 def logout():
     flask_session.clear()
     return jsonify({'result': 'logged out'})
 
 # User Management API
-@app.route('/api/users', methods=['GET'])
+USER_FIELDS = ['id', 'username', 'role', 'full_name', 'email', 'created_at', 'last_login', 'is_active']
+USER_SEARCH_FIELDS = ['username', 'full_name', 'email', 'role']
+USERS_PAGE_SIZE = 100
+USERS_MAX_PAGE_SIZE = 500
+
+def stream_json_array(items, batch_size=500):
+    """Yield a JSON array in chunks, serializing batch_size dicts at a time"""
+    yield '['
+    batch = []
+    separator = ''
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield separator + current_app.json.dumps(batch, separators=(',', ':'))[1:-1]
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + current_app.json.dumps(batch, separators=(',', ':'))[1:-1]
+    yield ']'
+
+def stream_query_json(statement, batch_size=500):
+    """Stream the rows of a select() as a JSON array of objects keyed by column label"""
+    rows = db.session.execute(statement.execution_options(yield_per=batch_size))
+    items = (dict(row._mapping) for row in rows)
+    return current_app.response_class(
+        stream_with_context(stream_json_array(items, batch_size)),
+        mimetype='application/json'
+    )
+
+def etag_for_rows(*parts):
+    """ETag value over the raw rows of a response, computed before serializing"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+@bp.route('/api/users', methods=['GET'])
 @login_required(role='admin')
 def get_users():
-    users = User.query.all()
-    return jsonify([
-        {
-            'id': u.id, 
-            'username': u.username, 
-            'role': u.role,
-            'full_name': u.full_name,
-            'email': u.email,
-            'created_at': u.created_at.isoformat() if u.created_at else None,
-            'last_login': u.last_login.isoformat() if u.last_login else None,
-            'is_active': u.is_active
-        } for u in users
-    ])
+    """List users one keyset page at a time.
+    
+    Query parameters: after (last id of the previous page), limit, q (search
+    across username/full_name/email/role), role, and fields (comma separated).
+    The next page cursor is returned in the X-Next-Cursor header.
+    """
+    after = request.args.get('after', type=int)
+    limit = min(max(request.args.get('limit', USERS_PAGE_SIZE, type=int), 1), USERS_MAX_PAGE_SIZE)
+    
+    fields = USER_FIELDS
+    if request.args.get('fields'):
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in USER_FIELDS]
+        if unknown:
+            return jsonify({'error': f'Unknown fields: {", ".join(unknown)}'}), 400
+        # id always comes first: it is the page cursor
+        fields = ['id'] + [f for f in fields if f != 'id']
+    
+    query = db.session.query(*[getattr(User, f) for f in fields])
+    search = request.args.get('q', '').strip()
+    if search:
+        # Typed % and _ match themselves, not any characters
+        pattern = '%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        query = query.filter(db.or_(*[getattr(User, f).ilike(pattern, escape='\\') for f in USER_SEARCH_FIELDS]))
+    role = request.args.get('role')
+    if role:
+        query = query.filter(User.role == role)
+    if after is not None:
+        query = query.filter(User.id > after)
+    
+    # Fetch one extra row to know whether another page exists
+    rows = query.order_by(User.id).limit(limit + 1).all()
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    rows = rows[:limit]
+    
+    etag = etag_for_rows(fields, rows, next_cursor)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify([dict(zip(fields, row)) for row in rows])
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    if next_cursor is not None:
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+@bp.route('/api/users/<int:user_id>', methods=['GET'])
+@login_required(role='admin')
+def get_user(user_id):
+    row = db.session.query(*[getattr(User, f) for f in USER_FIELDS]).filter(User.id == user_id).first()
+    if not row:
+        return jsonify({'error': 'User not found'}), 404
+    return jsonify(dict(zip(USER_FIELDS, row)))
 
-@app.route('/api/users', methods=['POST'])
+@bp.route('/api/users', methods=['POST'])
 @login_required(role='admin')
 def add_user():
     data = request.json
@@ -295,7 +843,7 @@ def add_user():
         'full_name': user.full_name
     })
 
-@app.route('/api/users/<int:user_id>', methods=['DELETE'])
+@bp.route('/api/users/<int:user_id>', methods=['DELETE'])
 @login_required(role='admin')
 def delete_user(user_id):
     # Admin cannot delete themselves
@@ -314,7 +862,7 @@ def delete_user(user_id):
     db.session.commit()
     return jsonify({'result': 'User deleted successfully'})
 
-@app.route('/api/users/<int:user_id>/bulk-delete', methods=['DELETE'])
+@bp.route('/api/users/<int:user_id>/bulk-delete', methods=['DELETE'])
 @login_required(role='admin')
 def bulk_delete_user(user_id):
     # Admin cannot delete themselves
@@ -327,14 +875,17 @@ def bulk_delete_user(user_id):
     
     try:
         # Count what will be deleted for reporting
-        courses_count = len(user.courses)
+        courses = list(user.courses)
+        courses_count = len(courses)
         sessions_count = 0
         attendances_count = 0
+        deleted_sessions = []
         
         # Delete all courses and their related data for this user
         for course in user.courses:
             course_sessions = Session.query.filter_by(course_id=course.id).all()
             sessions_count += len(course_sessions)
+            deleted_sessions.extend(course_sessions)
             
             for session in course_sessions:
                 # Delete all attendances for each session
@@ -347,6 +898,8 @@ def bulk_delete_user(user_id):
                 # Delete the session
                 db.session.delete(session)
             
+            RosterEntry.query.filter_by(course_id=course.id).delete()
+            
             # Delete the course
             db.session.delete(course)
         
@@ -354,6 +907,10 @@ def bulk_delete_user(user_id):
         user_name = user.full_name or user.username
         db.session.delete(user)
         db.session.commit()
+        invalidate_course_analytics(*courses)
+        
+        for session in deleted_sessions:
+            remove_session_qr_files(session)
         
         return jsonify({
             'result': 'User and all associated data deleted successfully',
@@ -370,9 +927,11 @@ def bulk_delete_user(user_id):
         print(f"Error in bulk delete for user {user_id}: {str(e)}")
         return jsonify({'error': f'Failed to delete user and data: {str(e)}'}), 500
 
-@app.route('/api/users/bulk-import', methods=['POST'])
+@bp.route('/api/users/bulk-import', methods=['POST'])
 @login_required(role='admin')
 def bulk_import_users():
+    import csv
+    from io import StringIO
     try:
         # Check if file was uploaded
         if 'file' not in request.files:
@@ -466,10 +1025,12 @@ def bulk_import_users():
         db.session.rollback()
         return jsonify({'error': f'Failed to process CSV file: {str(e)}'}), 500
 
-@app.route('/api/users/bulk-import/template', methods=['GET'])
+@bp.route('/api/users/bulk-import/template', methods=['GET'])
 @login_required(role='admin')
 def download_bulk_import_template():
     """Download a CSV template for bulk user import"""
+    import csv
+    from io import StringIO
     try:
         si = StringIO()
         writer = csv.writer(si)
@@ -494,7 +1055,7 @@ def download_bulk_import_template():
     except Exception as e:
         return jsonify({'error': f'Failed to generate template: {str(e)}'}), 500
 
-@app.route('/api/create_session', methods=['POST'])
+@bp.route('/api/create_session', methods=['POST'])
 @login_required()
 def create_session():
     data = request.json
@@ -521,20 +1082,22 @@ def create_session():
     )
     db.session.add(session)
     db.session.commit()
+    invalidate_course_analytics(course)
+    current_app.extensions['presence'].start(session.id, complete='coherence' in current_app.extensions)
     
     # Generate QR codes for both entry and exit
-    lan_ip = get_lan_ip()
+    import qrcode
     
     # Entry QR code
-    entry_url = f"http://{lan_ip}:5000/attend/entry/{entry_token}"
+    entry_url = attend_url('entry', entry_token)
     entry_qr_img = qrcode.make(entry_url)
-    entry_qr_path = os.path.join(QR_CODES_DIR, f'{entry_token}_entry.png')
+    entry_qr_path = os.path.join(qr_codes_dir(), f'{entry_token}_entry.png')
     entry_qr_img.save(entry_qr_path)
     
     # Exit QR code
-    exit_url = f"http://{lan_ip}:5000/attend/exit/{exit_token}"
+    exit_url = attend_url('exit', exit_token)
     exit_qr_img = qrcode.make(exit_url)
-    exit_qr_path = os.path.join(QR_CODES_DIR, f'{exit_token}_exit.png')
+    exit_qr_path = os.path.join(qr_codes_dir(), f'{exit_token}_exit.png')
     exit_qr_img.save(exit_qr_path)
     
     return jsonify({
@@ -549,9 +1112,606 @@ def create_session():
         'course_name': course.name
     })
 
-@app.route('/qr_codes/<filename>')
+@bp.route('/qr_codes/<filename>')
 def serve_qr(filename):
-    return send_from_directory(QR_CODES_DIR, filename)
+    return send_from_directory(qr_codes_dir(), filename)
+
+# Printable QR sheets
+QR_SHEET_PAGE_SIZE = (595, 842)  # A4 in points
+QR_SHEET_CODE_SIZE = 230
+QR_SHEET_FONTS = b'/Font << /F1 3 0 R /F2 4 0 R >>'
+PDF_TEXT_FALLBACKS = str.maketrans({'ı': 'i', 'İ': 'I', '’': "'", '“': '"', '”': '"'})
+
+def attend_url(kind, token):
+    """Check-in or check-out URL encoded in a session's QR code"""
+    return f"http://{get_lan_ip()}:5000/attend/{kind}/{token}"
+
+def pdf_text(text):
+    """A PDF string literal in WinAnsi, the encoding of the standard Helvetica fonts.
+    
+    Characters outside it lose their accents (ş -> s) or become '?'.
+    """
+    out = []
+    for char in (text or '').translate(PDF_TEXT_FALLBACKS):
+        try:
+            out.append(char.encode('cp1252'))
+        except UnicodeEncodeError:
+            base = unicodedata.normalize('NFKD', char)[:1]
+            out.append(base.encode('cp1252', 'replace') if base != char else b'?')
+    escaped = b''.join(out).replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    return b'(' + escaped + b')'
+
+def qr_code_path(url, x, y, size):
+    """Vector drawing of a QR code, one filled rectangle per run of dark modules"""
+    import qrcode
+    qr = qrcode.QRCode(border=0, error_correction=qrcode.constants.ERROR_CORRECT_M)
+    qr.add_data(url)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    module = size / len(matrix)
+    ops = []
+    for row, modules in enumerate(matrix):
+        top = y + size - (row + 1) * module
+        column = 0
+        while column < len(modules):
+            if not modules[column]:
+                column += 1
+                continue
+            start = column
+            while column < len(modules) and modules[column]:
+                column += 1
+            ops.append(f'{x + start * module:.2f} {top:.2f} {(column - start) * module:.2f} {module:.2f} re')
+    return ('\n'.join(ops) + '\nf\n').encode('ascii')
+
+def render_qr_sheet_page(page):
+    """Compressed PDF content stream for one session's page.
+    
+    Runs in the QR sheet worker processes, so it takes and returns plain data.
+    """
+    width, height = QR_SHEET_PAGE_SIZE
+    size = QR_SHEET_CODE_SIZE
+    left, right = 50, width - 50 - size
+    codes_y = 380
+
+    def text(font, points, x, y, value):
+        return b'BT /%s %d Tf %d %d Td %s Tj ET\n' % (font, points, x, y, pdf_text(value))
+
+    parts = [
+        text(b'F2', 22, 50, height - 70, page['course']),
+        text(b'F1', 15, 50, height - 98, page['session']),
+        text(b'F1', 12, 50, height - 122, page['date']),
+        text(b'F1', 12, 50, height - 142, page['location']),
+        text(b'F2', 18, left, codes_y + size + 40, 'ENTRY'),
+        text(b'F1', 10, left, codes_y + size + 22, 'Scan when you arrive'),
+        text(b'F2', 18, right, codes_y + size + 40, 'EXIT'),
+        text(b'F1', 10, right, codes_y + size + 22, 'Scan when you leave'),
+        text(b'F1', 7, left, codes_y - 16, page['entry_url']),
+        text(b'F1', 7, right, codes_y - 16, page['exit_url']),
+        text(b'F1', 9, 50, 40, page['footer']),
+        b'0 g\n',
+        qr_code_path(page['entry_url'], left, codes_y, size),
+        qr_code_path(page['exit_url'], right, codes_y, size)
+    ]
+    return zlib.compress(b''.join(parts))
+
+class QRSheetRenderer:
+    """Renders QR sheet pages in a pool of worker processes.
+    
+    The pool starts on first use and is shared by all requests of the app.
+    Pages come back in session order as soon as each one is ready, so the
+    document can be streamed while later pages are still being drawn. With
+    workers=0 pages are rendered in the request thread instead.
+    """
+    
+    def __init__(self, workers):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+    
+    def pages(self, pages):
+        if not self.workers:
+            return map(render_qr_sheet_page, pages)
+        with self.lock:
+            if self.executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn everywhere: forking a process that runs threads and holds
+                # database connections is unsafe, and Windows only has spawn anyway
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            executor = self.executor
+        return executor.map(render_qr_sheet_page, pages, chunksize=4)
+    
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                # Pages still queued are dropped rather than drawn; cancel_futures is Python 3.9+
+                if sys.version_info >= (3, 9):
+                    self.executor.shutdown(cancel_futures=True)
+                else:
+                    self.executor.shutdown()
+                self.executor = None
+
+def stream_qr_sheet_pdf(contents, page_count):
+    """Write a PDF incrementally from per-page content streams.
+    
+    The catalog and fonts go first and each page is written as soon as its
+    content arrives. The page tree (object 2) is written last, once every page
+    object number is known, followed by the cross-reference table.
+    """
+    width, height = QR_SHEET_PAGE_SIZE
+    offsets = {}
+    position = 0
+
+    def obj(number, body):
+        nonlocal position
+        offsets[number] = position
+        chunk = b'%d 0 obj\n%s\nendobj\n' % (number, body)
+        position += len(chunk)
+        return chunk
+
+    header = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+    position = len(header)
+    yield header + b''.join([
+        obj(1, b'<< /Type /Catalog /Pages 2 0 R >>'),
+        obj(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'),
+        obj(4, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>')
+    ])
+    kids = []
+    for number, content in enumerate(contents):
+        content_id = 5 + 2 * number
+        kids.append(b'%d 0 R' % (content_id + 1))
+        yield obj(content_id, b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(content), content)) + obj(
+            content_id + 1,
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << %s >> /Contents %d 0 R >>'
+            % (width, height, QR_SHEET_FONTS, content_id)
+        )
+    tail = obj(2, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), len(kids)))
+    xref_at = position
+    count = 5 + 2 * page_count
+    yield tail + b''.join([
+        b'xref\n0 %d\n0000000000 65535 f \n' % count,
+        *(b'%010d 00000 n \n' % offsets[number] for number in range(1, count)),
+        b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (count, xref_at)
+    ])
+
+def qr_sheet_page(course, session):
+    when = session.start_time or session.session_date
+    date_line = when.strftime('%A, %d %B %Y  %H:%M') if when else 'Date not set'
+    if session.start_time and session.end_time:
+        date_line += session.end_time.strftime(' - %H:%M')
+    return {
+        'course': f'{course.name} ({course.course_code})' if course.course_code else course.name,
+        'session': session.session_name or f'Session {session.id}',
+        'date': date_line,
+        'location': f'Location: {session.location}' if session.location else 'Location: -',
+        'entry_url': attend_url('entry', session.entry_token),
+        'exit_url': attend_url('exit', session.exit_token),
+        'footer': f'Session #{session.id}'
+    }
+
+@bp.route('/api/courses/<int:course_id>/qr_sheet', methods=['GET'])
+@login_required()
+def course_qr_sheet(course_id):
+    """Printable PDF with one page of entry and exit QR codes per session.
+    
+    Optional from/to (ISO dates) limit it to sessions in that range; a
+    date-only `to` includes that whole day.
+    """
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({'error': 'Course not found'}), 404
+    if flask_session['role'] != 'admin' and course.instructor_id != flask_session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    dates, invalid = date_range_filters(Session.session_date)
+    if invalid:
+        return jsonify({'error': f'Invalid {invalid} date'}), 400
+    query = Session.query.filter_by(course_id=course_id).filter(*dates)
+    pages = [qr_sheet_page(course, session) for session in query.order_by(Session.session_date, Session.id)]
+    if not pages:
+        return jsonify({'error': 'No sessions to print'}), 404
+    
+    from flask import Response
+    contents = current_app.extensions['qr_sheets'].pages(pages)
+    return Response(
+        stream_qr_sheet_pdf(contents, len(pages)),
+        mimetype='application/pdf',
+        headers={
+            'Content-Disposition': f'attachment;filename=course_{course.id}_qr_codes.pdf'
+        }
+    )
+
+# Admission control for the public attendance endpoints
+class AdmissionController:
+    """Token buckets per client IP and per session token.
+    
+    Each bucket is a [tokens, last_refill] pair refilled lazily on access. A
+    client whose IP bucket is still full (first scan, or idle for a while) may
+    drain the session bucket completely, while repeat requests must leave
+    `reserve` tokens behind, so refresh loops are throttled before newcomers.
+    """
+    
+    def __init__(self, ip_burst, ip_rate, session_burst, session_rate, reserve, max_keys=10000):
+        self.ip_burst = ip_burst
+        self.ip_rate = ip_rate
+        self.session_burst = session_burst
+        self.session_rate = session_rate
+        self.reserve = session_burst * reserve
+        self.max_keys = max_keys
+        self.ip_buckets = {}
+        self.session_buckets = {}
+        self.lock = threading.Lock()
+        self.counters = {'admitted': 0, 'admitted_first_time': 0, 'rejected_ip': 0, 'rejected_session': 0}
+    
+    @staticmethod
+    def _refill(bucket, burst, rate, now):
+        tokens = bucket[0] + (now - bucket[1]) * rate
+        bucket[0] = burst if tokens > burst else tokens
+        bucket[1] = now
+    
+    def admit(self, ip, session_key):
+        """Return 0 when admitted, otherwise the seconds to wait before retrying"""
+        now = time.monotonic()
+        with self.lock:
+            ip_bucket = self.ip_buckets.get(ip)
+            if ip_bucket is None:
+                if len(self.ip_buckets) >= self.max_keys:
+                    self._prune(self.ip_buckets, self.ip_burst, self.ip_rate, now)
+                ip_bucket = self.ip_buckets[ip] = [self.ip_burst, now]
+            else:
+                self._refill(ip_bucket, self.ip_burst, self.ip_rate, now)
+            if ip_bucket[0] < 1:
+                self.counters['rejected_ip'] += 1
+                return (1 - ip_bucket[0]) / self.ip_rate
+            
+            session_bucket = self.session_buckets.get(session_key)
+            if session_bucket is None:
+                if len(self.session_buckets) >= self.max_keys:
+                    self._prune(self.session_buckets, self.session_burst, self.session_rate, now)
+                session_bucket = self.session_buckets[session_key] = [self.session_burst, now]
+            else:
+                self._refill(session_bucket, self.session_burst, self.session_rate, now)
+            first_time = ip_bucket[0] >= self.ip_burst
+            floor = 1 if first_time else 1 + self.reserve
+            if session_bucket[0] < floor:
+                self.counters['rejected_session'] += 1
+                return (floor - session_bucket[0]) / self.session_rate
+            
+            ip_bucket[0] -= 1
+            session_bucket[0] -= 1
+            self.counters['admitted'] += 1
+            if first_time:
+                self.counters['admitted_first_time'] += 1
+            return 0
+    
+    def _prune(self, buckets, burst, rate, now):
+        """Forget buckets that have refilled completely; they hold no state"""
+        full_after = burst / rate
+        for key in [k for k, b in buckets.items() if now - b[1] >= full_after]:
+            del buckets[key]
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, tracked_ips=len(self.ip_buckets), tracked_sessions=len(self.session_buckets))
+
+def admission_controlled(f):
+    """Reject over-limit requests with 429 before any database work"""
+    @wraps(f)
+    def decorated_function(token, *args, **kwargs):
+        wait = current_app.extensions['admission'].admit(request.remote_addr, token)
+        if wait:
+            return 'Too many requests. Please wait a moment and try again.', 429, {'Retry-After': str(math.ceil(wait))}
+        return f(token, *args, **kwargs)
+    return decorated_function
+
+@bp.route('/api/admission', methods=['GET'])
+@login_required(role='admin')
+def admission_stats():
+    return jsonify(current_app.extensions['admission'].stats())
+
+# Proxy attendance detection
+def device_fingerprint(ip_address, user_agent):
+    """Same address and same browser build: in practice the same phone"""
+    if not ip_address:
+        return None
+    return hashlib.sha1(f'{ip_address}|{user_agent or ""}'.encode('utf-8')).hexdigest()[:16]
+
+def student_label(name, surname, student_id=None):
+    label = f'{name} {surname}'
+    return f'{label} ({student_id})' if student_id else label
+
+class ProxyDetector:
+    """Per-session indexes of which students checked in from each device and each IP.
+
+    observe() costs one dict lookup and one insert per index. A cluster is
+    flagged once `device_threshold` distinct students share a device
+    fingerprint, or `ip_threshold` share an IP (0 disables that index).
+    Every later student joining a flagged cluster raises an alert as they
+    arrive. Batch scans replay stored rows through a fresh detector, so live
+    alerts and stored-data flags follow the same rules. Check-ins observed
+    without alerts (loaded from the database or taken by other workers) still
+    let the worker that took them raise their alert. Sessions are evicted
+    when they close, or oldest first beyond max_sessions.
+    """
+
+    def __init__(self, device_threshold, ip_threshold, max_sessions=1000, max_alerts=500):
+        self.thresholds = {'shared_device': device_threshold, 'shared_ip': ip_threshold}
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.alerts = deque(maxlen=max_alerts)
+        self.lock = threading.Lock()
+
+    def tracking(self, session_id):
+        with self.lock:
+            return session_id in self.sessions
+
+    def observe(self, session_id, student_key, label, ip_address, user_agent, alert=True):
+        """Index one check-in; returns the alerts it raised"""
+        raised = []
+        with self.lock:
+            index = self.sessions.get(session_id)
+            if index is None:
+                if self.max_sessions and len(self.sessions) >= self.max_sessions:
+                    del self.sessions[next(iter(self.sessions))]
+                index = self.sessions[session_id] = {reason: {} for reason in self.thresholds}
+            for reason, key in (('shared_device', device_fingerprint(ip_address, user_agent)),
+                                ('shared_ip', ip_address or None)):
+                threshold = self.thresholds[reason]
+                if not threshold or key is None:
+                    continue
+                cluster = index[reason].get(key)
+                if cluster is None:
+                    cluster = index[reason][key] = {
+                        'reason': reason,
+                        'ip_address': ip_address,
+                        'user_agent': user_agent if reason == 'shared_device' else None,
+                        'students': {},
+                        'alerted': set()
+                    }
+                students = cluster['students']
+                students[student_key] = label
+                if alert and len(students) >= threshold and student_key not in cluster['alerted']:
+                    cluster['alerted'].add(student_key)
+                    raised.append({
+                        'session_id': session_id,
+                        'reason': reason,
+                        'ip_address': ip_address,
+                        'student': label,
+                        'cluster_size': len(students),
+                        'at': datetime.now().isoformat(timespec='seconds')
+                    })
+            self.alerts.extend(raised)
+        return raised
+
+    def clusters(self, session_id):
+        """Flagged clusters of one session"""
+        with self.lock:
+            index = self.sessions.get(session_id, {})
+            return [
+                {
+                    'reason': cluster['reason'],
+                    'ip_address': cluster['ip_address'],
+                    'user_agent': cluster['user_agent'],
+                    'students': list(cluster['students'].values())
+                }
+                for reason, clusters in index.items()
+                for cluster in clusters.values()
+                if len(cluster['students']) >= self.thresholds[reason]
+            ]
+
+    def student_flags(self, session_id):
+        """student_key -> reasons it was flagged for, in one session"""
+        flags = {}
+        with self.lock:
+            for reason, clusters in self.sessions.get(session_id, {}).items():
+                for cluster in clusters.values():
+                    if len(cluster['students']) >= self.thresholds[reason]:
+                        for key in cluster['students']:
+                            flags.setdefault(key, []).append(reason)
+        return flags
+
+    def forget(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+    
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+def scan_proxy_attendance(rows):
+    """Batch mode: one pass over stored check-ins with a throwaway detector"""
+    detector = ProxyDetector(
+        current_app.config['PROXY_DEVICE_THRESHOLD'], current_app.config['PROXY_IP_THRESHOLD'],
+        max_sessions=None, max_alerts=0
+    )
+    for row in rows:
+        if row.entry_time is None:
+            continue
+        detector.observe(
+            row.session_id,
+            row.student_key or normalize_student_key(row.name, row.surname, row.student_id),
+            student_label(row.name, row.surname, row.student_id),
+            row.ip_address,
+            row.user_agent,
+            alert=False
+        )
+    return detector
+
+def detect_proxy_check_in(session_obj, attendance_id, student_key, label, ip_address, user_agent):
+    """Feed a successful check-in to the live detector.
+
+    A session this worker has not seen yet (first scan or a restart) is first
+    loaded from the database without alerts; after that, sync_caches() adds
+    the check-ins other workers take.
+    """
+    detector = current_app.extensions['proxy_detector']
+    sync_caches()
+    if not detector.tracking(session_obj.id):
+        for row in db.session.query(
+            Attendance.session_id, Attendance.student_key, Attendance.name, Attendance.surname,
+            Attendance.student_id, Attendance.ip_address, Attendance.user_agent
+        ).filter(
+            Attendance.session_id == session_obj.id,
+            Attendance.entry_time.isnot(None),
+            Attendance.id != attendance_id
+        ):
+            detector.observe(row.session_id, row.student_key, student_label(row.name, row.surname, row.student_id),
+                             row.ip_address, row.user_agent, alert=False)
+    # Alerts are read from GET /api/proxy_alerts rather than logged one per check-in
+    detector.observe(session_obj.id, student_key, label, ip_address, user_agent)
+
+@bp.route('/api/courses/<int:course_id>/proxy_flags', methods=['GET'])
+@login_required()
+def course_proxy_flags(course_id):
+    """Suspicious check-in clusters across a course's history (or one session_id), in one pass"""
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({'error': 'Course not found'}), 404
+    if flask_session['role'] != 'admin' and course.instructor_id != flask_session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    session_id = request.args.get('session_id', type=int)
+    with report_reader() as reader:
+        sessions = reader.query(Session.id, Session.session_name, Session.session_date).filter(
+            Session.course_id == course_id, *([Session.id == session_id] if session_id is not None else [])
+        ).order_by(Session.session_date, Session.id).all()
+        rows = reader.connection().execute(db.select(
+            Attendance.session_id, Attendance.student_key, Attendance.name, Attendance.surname,
+            Attendance.student_id, Attendance.ip_address, Attendance.user_agent, Attendance.entry_time
+        ).where(Attendance.session_id.in_([s.id for s in sessions])).order_by(Attendance.entry_time))
+        detector = scan_proxy_attendance(rows)
+
+    flagged = []
+    for s in sessions:
+        clusters = detector.clusters(s.id)
+        if clusters:
+            flagged.append({
+                'session_id': s.id,
+                'session_name': s.session_name or f'Session {s.id}',
+                'date': s.session_date.isoformat() if s.session_date else None,
+                'clusters': clusters
+            })
+    return jsonify({
+        'course_id': course_id,
+        'thresholds': detector.thresholds,
+        'sessions_scanned': len(sessions),
+        'sessions': flagged
+    })
+
+@bp.route('/api/proxy_alerts', methods=['GET'])
+@login_required()
+def proxy_alerts():
+    """Alerts raised live by this worker's detector, newest first, for the caller's courses"""
+    alerts = list(current_app.extensions['proxy_detector'].alerts)[::-1]
+    if flask_session['role'] != 'admin' and alerts:
+        owned = {sid for (sid,) in db.session.query(Session.id).join(Course).filter(
+            Session.id.in_({a['session_id'] for a in alerts}),
+            Course.instructor_id == flask_session['user_id']
+        )}
+        alerts = [a for a in alerts if a['session_id'] in owned]
+    return jsonify(alerts)
+
+# Presence in active sessions
+PRESENCE_IN = 1
+PRESENCE_OUT = 2
+
+class PresenceTracker:
+    """Per-active-session map of student_key -> checked in (PRESENCE_IN) or out (PRESENCE_OUT).
+    
+    attend_entry and attend_exit consult it before writing, so repeat taps are
+    answered without taking SQLite's write lock. A student's state only moves
+    forward (attendance rows are never un-checked-in), so updates keep the
+    higher state and may arrive in any order. A session is loaded on its first
+    scan (or starts empty when created here), and is evicted when it closes or
+    is deleted, or oldest first beyond max_sessions. Unknown students fall through to
+    the database; only sessions marked complete (kept current by sync_caches())
+    may also answer "not checked in".
+    """
+    
+    def __init__(self, max_sessions=1000):
+        self.max_sessions = max_sessions
+        self.sessions = {}  # session_id -> {'complete': bool, 'students': {student_key: state}}
+        self.lock = threading.Lock()
+    
+    def _session(self, session_id, complete):
+        index = self.sessions.get(session_id)
+        if index is None:
+            if self.max_sessions and len(self.sessions) >= self.max_sessions:
+                del self.sessions[next(iter(self.sessions))]
+            index = self.sessions[session_id] = {'complete': complete, 'students': {}}
+        return index
+    
+    def tracking(self, session_id):
+        with self.lock:
+            return session_id in self.sessions
+    
+    def start(self, session_id, complete):
+        with self.lock:
+            self._session(session_id, complete)
+    
+    def load(self, session_id, rows, complete):
+        """Merge (student_key, state) rows read from the database"""
+        with self.lock:
+            index = self._session(session_id, complete)
+            students = index['students']
+            for student_key, state in rows:
+                if state > students.get(student_key, 0):
+                    students[student_key] = state
+            index['complete'] = index['complete'] or complete
+    
+    def mark(self, session_id, student_key, state):
+        """Record a committed check-in or check-out in a session being tracked"""
+        with self.lock:
+            index = self.sessions.get(session_id)
+            if index is not None and state > index['students'].get(student_key, 0):
+                index['students'][student_key] = state
+    
+    def state(self, session_id, keys):
+        """State of the first of keys (in order of preference) the session knows,
+        else 0 if the session is complete, else None (ask the database)"""
+        with self.lock:
+            index = self.sessions.get(session_id)
+            if index is None:
+                return None
+            for position, key in enumerate(keys):
+                state = index['students'].get(key, 0)
+                if state:
+                    # A fallback key checked out says nothing while a preferred key may
+                    # still have a row this worker has not seen
+                    if state == PRESENCE_OUT and position and not index['complete']:
+                        return None
+                    return state
+            return 0 if index['complete'] else None
+    
+    def forget(self, session_id):
+        with self.lock:
+            self.sessions.pop(session_id, None)
+    
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+def presence_state(entry_time, exit_time):
+    if exit_time is not None:
+        return PRESENCE_OUT
+    return PRESENCE_IN if entry_time is not None else 0
+
+def student_presence(session_id, keys):
+    """Presence of a student (keys in order of preference) in a session, loading it on first use.
+    
+    With cache coherence the load runs under the coherence lock, between two
+    log polls, so no check-in can slip between the query and the index and
+    the session can answer "not checked in" too.
+    """
+    presence = current_app.extensions['presence']
+    coherence = current_app.extensions.get('coherence')
+    with coherence.lock if coherence is not None else nullcontext():
+        sync_caches()
+        if not presence.tracking(session_id):
+            rows = db.session.query(Attendance.student_key, Attendance.entry_time, Attendance.exit_time).filter(
+                Attendance.session_id == session_id, Attendance.entry_time.isnot(None)
+            )
+            presence.load(session_id, [(row.student_key, presence_state(row.entry_time, row.exit_time)) for row in rows],
+                          complete=coherence is not None)
+    return presence.state(session_id, keys)
 
 # Simple attendance form without GPS tracking
 ATTEND_FORM_HTML = '''
@@ -671,6 +1831,27 @@ ATTEND_FORM_HTML = '''
             padding: 10px;
             border-radius: 8px;
         }
+        .suggestions {
+            margin: -10px 0 20px 0;
+            border: 2px solid #e1e5e9;
+            border-radius: 8px;
+            overflow: hidden;
+        }
+        .suggestions:empty {
+            display: none;
+        }
+        .suggestions div {
+            padding: 12px 15px;
+            cursor: pointer;
+            font-size: 16px;
+            border-bottom: 1px solid #f0f0f0;
+        }
+        .suggestions div:last-child {
+            border-bottom: none;
+        }
+        .suggestions div:hover {
+            background: #f0f8ff;
+        }
     </style>
 </head>
 <body>
@@ -697,6 +1878,7 @@ ATTEND_FORM_HTML = '''
                 <label>👤 Last Name:</label>
                 <input type="text" name="surname" id="surname" required placeholder="Enter your last name">
             </div>
+            <div class="suggestions" id="suggestions"></div>
             
             <div class="form-group">
                 <label>🎓 Student ID (Optional):</label>
@@ -713,6 +1895,37 @@ ATTEND_FORM_HTML = '''
     </div>
 
     <script>
+        // Offer matching names from the course roster as the student types
+        const suggestions = document.getElementById('suggestions');
+        let suggestTimer = null;
+        ['name', 'surname'].forEach(function(field) {
+            document.getElementById(field).addEventListener('input', function(e) {
+                clearTimeout(suggestTimer);
+                const typed = e.target.value.trim();
+                if (typed.length < 2) {
+                    suggestions.replaceChildren();
+                    return;
+                }
+                suggestTimer = setTimeout(function() {
+                    fetch('{{ suggest_url }}?q=' + encodeURIComponent(typed))
+                        .then(function(response) { return response.ok ? response.json() : []; })
+                        .then(function(matches) {
+                            suggestions.replaceChildren(...matches.map(function(match) {
+                                const option = document.createElement('div');
+                                option.textContent = match.name + ' ' + match.surname;
+                                option.addEventListener('click', function() {
+                                    document.getElementById('name').value = match.name;
+                                    document.getElementById('surname').value = match.surname;
+                                    suggestions.replaceChildren();
+                                });
+                                return option;
+                            }));
+                        })
+                        .catch(function() {});
+                }, 150);
+            });
+        });
+        
         // Form submission validation
         document.getElementById('attendance-form').addEventListener('submit', function(e) {
             const name = document.getElementById('name').value.trim();
@@ -733,7 +1946,8 @@ ATTEND_FORM_HTML = '''
 </html>
 '''
 
-@app.route('/attend/entry/<token>', methods=['GET', 'POST'])
+@bp.route('/attend/entry/<token>', methods=['GET', 'POST'])
+@admission_controlled
 def attend_entry(token):
     session_obj = Session.query.filter_by(entry_token=token).first()
     if not session_obj:
@@ -746,45 +1960,66 @@ def attend_entry(token):
     error = None
     success = None
     
-    if request.method == 'POST':
+    if not session_accepts_scans(session_obj):
+        error = 'This session has closed and no longer accepts check-ins.'
+    elif request.method == 'POST':
         name = request.form.get('name')
         surname = request.form.get('surname')
         student_id = request.form.get('student_id', '')
         ip_address = request.remote_addr
         user_agent = request.headers.get('User-Agent', '')
         
+        student_key = normalize_student_key(name, surname, student_id)
+        name_key = normalize_student_key(name, surname)
         if not name or not surname:
             error = 'Name and surname are required.'
+        elif student_presence(session_obj.id, [student_key, name_key]):
+            # A repeat tap, answered without taking the write lock
+            error = 'You have already checked in for this session.'
         else:
-            # Check if attendance record already exists
-            existing = Attendance.query.filter_by(
-                session_id=session_obj.id, 
-                name=name, 
-                surname=surname
-            ).first()
+            # A check-in under the other key counts too: with an ID, one made by name
+            # only; without an ID, any made under this name, with or without an ID
+            checked_in_before = db.exists().where(
+                Attendance.session_id == session_obj.id,
+                Attendance.entry_time.isnot(None),
+                Attendance.student_key == name_key if student_key != name_key else same_name(name, surname)
+            )
+            # One atomic statement: insert the row, or fill in a row that has no check-in
+            # yet. A repeat or a concurrent double tap conflicts or is filtered out and
+            # returns nothing.
+            row = {
+                'session_id': (session_obj.id, db.Integer),
+                'name': (name, db.String),
+                'surname': (surname, db.String),
+                'student_id': (student_id, db.String),
+                'ip_address': (ip_address, db.String),
+                'entry_time': (datetime.now(), db.DateTime),
+                'course_name': (course.name, db.String),
+                'user_agent': (user_agent, db.String),
+                'student_key': (student_key, db.String)
+            }
+            upsert = sqlite_insert(Attendance).from_select(list(row), db.select(
+                *(db.literal(value, type_) for value, type_ in row.values())
+            ).where(~checked_in_before))
+            checked_in = db.session.execute(upsert.on_conflict_do_update(
+                index_elements=['session_id', 'student_key'],
+                set_={
+                    'entry_time': upsert.excluded.entry_time,
+                    'ip_address': upsert.excluded.ip_address,
+                    'user_agent': upsert.excluded.user_agent
+                },
+                where=Attendance.entry_time.is_(None)
+            ).returning(Attendance.id)).first()
+            db.session.commit()
+            # Checked in now, or already (in or out) if nothing was written
+            current_app.extensions['presence'].mark(session_obj.id, student_key, PRESENCE_IN)
             
-            if existing and existing.entry_time:
+            if checked_in is None:
                 error = 'You have already checked in for this session.'
             else:
-                # Create or update attendance record for entry
-                if not existing:
-                    attendance = Attendance(
-                        session_id=session_obj.id,
-                        name=name,
-                        surname=surname,
-                        student_id=student_id,
-                        ip_address=ip_address,
-                        entry_time=datetime.now(),
-                        course_name=course.name,
-                        user_agent=user_agent
-                    )
-                    db.session.add(attendance)
-                else:
-                    existing.entry_time = datetime.now()
-                    existing.ip_address = ip_address
-                    existing.user_agent = user_agent
-                
-                db.session.commit()
+                invalidate_course_analytics(course)
+                detect_proxy_check_in(session_obj, checked_in.id, student_key,
+                                      student_label(name, surname, student_id), ip_address, user_agent)
                 success = f'✅ Successfully checked IN to {course.name}!'
     
     return render_template_string(
@@ -794,11 +2029,13 @@ def attend_entry(token):
         session_date=session_obj.session_date.strftime('%Y-%m-%d %H:%M') if session_obj.session_date else 'N/A',
         current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         attendance_type='ENTRY / CHECK-IN',
+        suggest_url=f'/attend/suggest/{token}',
         error=error,
         success=success
     )
 
-@app.route('/attend/exit/<token>', methods=['GET', 'POST'])
+@bp.route('/attend/exit/<token>', methods=['GET', 'POST'])
+@admission_controlled
 def attend_exit(token):
     session_obj = Session.query.filter_by(exit_token=token).first()
     if not session_obj:
@@ -811,39 +2048,67 @@ def attend_exit(token):
     error = None
     success = None
     
-    if request.method == 'POST':
+    if not session_accepts_scans(session_obj):
+        error = 'This session has closed. Anyone still checked in was checked out automatically.'
+    elif request.method == 'POST':
         name = request.form.get('name')
         surname = request.form.get('surname')
         student_id = request.form.get('student_id', '')
-        ip_address = request.remote_addr
-        user_agent = request.headers.get('User-Agent', '')
         
+        # Match the check-in by student ID or, if it was made without one, by name
+        student_key = normalize_student_key(name, surname, student_id)
+        name_key = normalize_student_key(name, surname)
+        presence = student_presence(session_obj.id, [student_key, name_key]) if name and surname else None
+        if presence == 0 and student_key == name_key:
+            # Without an ID the check-in may be filed under one, which the index cannot find by name
+            presence = None
         if not name or not surname:
             error = 'Name and surname are required.'
+        elif presence == PRESENCE_OUT:
+            error = 'You have already checked out for this session.'
+        elif presence == 0:
+            error = 'You must check in first before checking out.'
         else:
-            # Find existing attendance record
-            existing = Attendance.query.filter_by(
-                session_id=session_obj.id, 
-                name=name, 
-                surname=surname
+            exit_time = datetime.now()
+            # One row only, so a namesake is never checked out along with this student. With
+            # an ID: the row under it if there is one, else the name's. Without: the name's,
+            # else a check-in made under this name with an ID that is still open.
+            target_key = db.select(Attendance.student_key).where(
+                Attendance.session_id == session_obj.id,
+                Attendance.student_key.in_([student_key, name_key]) if student_key != name_key else same_name(name, surname)
+            ).order_by(
+                Attendance.student_key != student_key, Attendance.exit_time.isnot(None), Attendance.id
+            ).limit(1).scalar_subquery()
+            checked_out = db.session.execute(
+                db.update(Attendance).where(
+                    Attendance.session_id == session_obj.id,
+                    Attendance.student_key == target_key,
+                    Attendance.entry_time.isnot(None),
+                    Attendance.exit_time.is_(None)
+                ).values(
+                    # ip_address stays the check-in's: proxy detection and exports cluster on it
+                    exit_time=exit_time,
+                    duration_minutes=duration_minutes_until(exit_time)
+                ).returning(Attendance.student_key, Attendance.duration_minutes),
+                execution_options={'synchronize_session': False}
             ).first()
+            db.session.commit()
             
-            if not existing or not existing.entry_time:
-                error = 'You must check in first before checking out.'
-            elif existing.exit_time:
-                error = 'You have already checked out for this session.'
+            if checked_out is None:
+                # Nothing updated; look up why only on this rare path
+                already_out = db.session.query(Attendance.id).filter(
+                    Attendance.session_id == session_obj.id,
+                    Attendance.student_key == target_key,
+                    Attendance.exit_time.isnot(None)
+                ).first()
+                if already_out:
+                    error = 'You have already checked out for this session.'
+                else:
+                    error = 'You must check in first before checking out.'
             else:
-                # Update attendance record for exit
-                existing.exit_time = datetime.now()
-                existing.ip_address = ip_address  # Update with exit IP
-                
-                # Calculate duration in minutes
-                if existing.entry_time and existing.exit_time:
-                    duration = existing.exit_time - existing.entry_time
-                    existing.duration_minutes = int(duration.total_seconds() / 60)
-                
-                db.session.commit()
-                duration_text = f" (Duration: {existing.duration_minutes} minutes)" if existing.duration_minutes else ""
+                current_app.extensions['presence'].mark(session_obj.id, checked_out.student_key, PRESENCE_OUT)
+                invalidate_course_analytics(course)
+                duration_text = f" (Duration: {checked_out.duration_minutes} minutes)" if checked_out.duration_minutes else ""
                 success = f'✅ Successfully checked OUT from {course.name}!{duration_text}'
     
     return render_template_string(
@@ -853,43 +2118,131 @@ def attend_exit(token):
         session_date=session_obj.session_date.strftime('%Y-%m-%d %H:%M') if session_obj.session_date else 'N/A',
         current_time=datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
         attendance_type='EXIT / CHECK-OUT',
+        suggest_url=f'/attend/suggest/{token}',
         error=error,
         success=success
     )
 
+# Dashboard bootstrap
+BOOTSTRAP_RECENT_SESSIONS = 10
+
+def recent_sessions_query(instructor_id=None, limit=BOOTSTRAP_RECENT_SESSIONS):
+    """Latest sessions with their course and attendance counts; only those sessions are aggregated"""
+    latest = db.select(Session.id).join(Course, Session.course_id == Course.id)
+    if instructor_id is not None:
+        latest = latest.where(Course.instructor_id == instructor_id)
+    latest = latest.order_by(Session.session_date.desc(), Session.id.desc()).limit(limit)
+    return db.select(
+        Session.id,
+        Session.course_id,
+        Course.name.label('course_name'),
+        Session.session_name,
+        Session.session_date,
+        Session.is_active,
+        Session.entry_token,
+        Session.exit_token,
+        db.func.count(db.case(
+            (db.or_(Attendance.status.is_(None), Attendance.status != 'absent'), Attendance.id)
+        )).label('attendance_count'),
+        db.func.count(Attendance.entry_time).label('checked_in_count'),
+        db.func.count(Attendance.exit_time).label('checked_out_count')
+    ).join(
+        Course, Session.course_id == Course.id
+    ).outerjoin(
+        Attendance, Session.id == Attendance.session_id
+    ).where(
+        Session.id.in_(latest.scalar_subquery())
+    ).group_by(Session.id).order_by(Session.session_date.desc(), Session.id.desc())
+
+def bootstrap_totals_query(instructor_id=None):
+    """Active sessions and attendances across the user's courses, in one statement"""
+    scoped_sessions = db.select(Session.id).join(Course, Session.course_id == Course.id)
+    if instructor_id is not None:
+        scoped_sessions = scoped_sessions.where(Course.instructor_id == instructor_id)
+    return db.select(
+        db.select(db.func.count(Session.id)).where(
+            Session.id.in_(scoped_sessions), Session.is_active == True
+        ).scalar_subquery().label('active_sessions'),
+        db.select(db.func.count(Attendance.id)).where(
+            Attendance.session_id.in_(scoped_sessions),
+            db.or_(Attendance.status.is_(None), Attendance.status != 'absent')
+        ).scalar_subquery().label('total_attendances')
+    )
+
+@bp.route('/api/bootstrap', methods=['GET'])
+@login_required()
+def bootstrap():
+    """Everything the dashboard needs for its first paint, in one response.
+    
+    Returns the logged-in user, their courses (all courses for admins), the
+    latest sessions with attendance counts and summary totals. A weak ETag
+    over the rows lets repeat loads revalidate with a 304.
+    """
+    user_id = flask_session['user_id']
+    role = flask_session['role']
+    instructor_id = None if role == 'admin' else user_id
+    
+    user = (user_id, flask_session.get('username'), role, flask_session.get('full_name'))
+    courses = db.session.execute(courses_listing_query(instructor_id)).all()
+    recent = db.session.execute(recent_sessions_query(instructor_id)).all()
+    totals = db.session.execute(bootstrap_totals_query(instructor_id)).one()
+    
+    etag = etag_for_rows(user, courses, recent, totals)
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify({
+            'user': dict(zip(('id', 'username', 'role', 'full_name'), user)),
+            'courses': [dict(row._mapping) for row in courses],
+            'recent_sessions': [dict(row._mapping) for row in recent],
+            'stats': {
+                'total_courses': len(courses),
+                'total_sessions': sum(row.sessions_count for row in courses),
+                'active_sessions': totals.active_sessions,
+                'total_attendances': totals.total_attendances
+            }
+        })
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 # Protected Courses API (unchanged but improved)
-@app.route('/api/courses', methods=['GET'])
+@bp.route('/api/courses', methods=['GET'])
 @login_required()
 def get_courses():
     user_id = flask_session['user_id']
     role = flask_session['role']
-    if role == 'admin':
-        courses = Course.query.all()
-    else:
-        courses = Course.query.filter_by(instructor_id=user_id).all()
-    
-    # Get instructor information for each course
-    courses_with_instructor = []
-    for c in courses:
-        instructor = db.session.get(User, c.instructor_id)
-        course_data = {
-            'id': c.id, 
-            'name': c.name, 
-            'description': c.description,
-            'instructor_id': c.instructor_id,
-            'instructor_name': instructor.full_name if instructor and instructor.full_name else (instructor.username if instructor else 'Unknown'),
-            'instructor_email': instructor.email if instructor else None,
-            'created_at': c.created_at.isoformat() if c.created_at else None,
-            'is_active': c.is_active,
-            'course_code': c.course_code,
-            'max_students': c.max_students,
-            'sessions_count': len(c.sessions)
-        }
-        courses_with_instructor.append(course_data)
-    
-    return jsonify(courses_with_instructor)
+    return stream_query_json(courses_listing_query(None if role == 'admin' else user_id))
 
-@app.route('/api/courses', methods=['POST'])
+def courses_listing_query(instructor_id=None):
+    """One query for course listings, with instructor details and session counts"""
+    sessions_count = db.select(db.func.count(Session.id)).where(
+        Session.course_id == Course.id
+    ).correlate(Course).scalar_subquery()
+    query = db.select(
+        Course.id,
+        Course.name,
+        Course.description,
+        Course.instructor_id,
+        db.case(
+            (User.id.is_(None), 'Unknown'),
+            (db.func.coalesce(User.full_name, '') != '', User.full_name),
+            else_=User.username
+        ).label('instructor_name'),
+        User.email.label('instructor_email'),
+        Course.created_at,
+        Course.is_active,
+        Course.course_code,
+        Course.max_students,
+        Course.late_grace_minutes,
+        Course.early_leave_minutes,
+        sessions_count.label('sessions_count')
+    ).outerjoin(User, Course.instructor_id == User.id).order_by(Course.id)
+    if instructor_id is not None:
+        query = query.where(Course.instructor_id == instructor_id)
+    return query
+
+@bp.route('/api/courses', methods=['POST'])
 @login_required()
 def add_course():
     data = request.json
@@ -898,17 +2251,26 @@ def add_course():
     instructor_id = flask_session['user_id']
     if not name:
         return jsonify({'error': 'Course name required'}), 400
-    course = Course(name=name, description=description, instructor_id=instructor_id)
+    course = Course(
+        name=name,
+        description=description,
+        instructor_id=instructor_id,
+        late_grace_minutes=data.get('late_grace_minutes', 10),
+        early_leave_minutes=data.get('early_leave_minutes', 10)
+    )
     db.session.add(course)
     db.session.commit()
+    invalidate_course_analytics(course)
     return jsonify({
         'id': course.id, 
         'name': course.name, 
         'description': course.description,
-        'instructor_id': course.instructor_id
+        'instructor_id': course.instructor_id,
+        'late_grace_minutes': course.late_grace_minutes,
+        'early_leave_minutes': course.early_leave_minutes
     })
 
-@app.route('/api/courses/<int:course_id>', methods=['DELETE'])
+@bp.route('/api/courses/<int:course_id>', methods=['DELETE'])
 @login_required()
 def delete_course(course_id):
     user_id = flask_session['user_id']
@@ -930,9 +2292,17 @@ def delete_course(course_id):
             # Delete the session
             db.session.delete(session)
         
+        RosterEntry.query.filter_by(course_id=course_id).delete()
+        
         # Now delete the course
         db.session.delete(course)
         db.session.commit()
+        invalidate_course_analytics(course)
+        current_app.extensions['roster_index'].forget(course_id)
+        current_app.extensions['roster_index'].forget_tokens(course_id)
+        
+        for session in sessions:
+            remove_session_qr_files(session)
         
         print(f"Course {course_id} deleted successfully with {len(sessions)} sessions")
         return jsonify({'result': 'Course deleted successfully'})
@@ -943,7 +2313,7 @@ def delete_course(course_id):
         return jsonify({'error': f'Failed to delete course: {str(e)}'}), 500
 
 # Enhanced Sessions API
-@app.route('/api/courses/<int:course_id>/sessions', methods=['GET'])
+@bp.route('/api/courses/<int:course_id>/sessions', methods=['GET'])
 @login_required()
 def get_sessions(course_id):
     user_id = flask_session['user_id']
@@ -953,22 +2323,29 @@ def get_sessions(course_id):
         return jsonify({'error': 'Course not found'}), 404
     if role != 'admin' and course.instructor_id != user_id:
         return jsonify({'error': 'Unauthorized'}), 403
-    sessions = Session.query.filter_by(course_id=course_id).all()
-    return jsonify([
-        {
-            'id': s.id, 
-            'entry_token': s.entry_token,
-            'exit_token': s.exit_token,
-            'session_name': s.session_name,
-            'session_date': s.session_date.isoformat() if s.session_date else None,
-            'is_active': s.is_active,
-            'attendance_count': len(s.attendances),
-            'checked_in_count': len([a for a in s.attendances if a.entry_time]),
-            'checked_out_count': len([a for a in s.attendances if a.exit_time])
-        } for s in sessions
-    ])
+    return stream_query_json(sessions_listing_query(course_id))
+
+def sessions_listing_query(course_id):
+    """One grouped query for a course's sessions with their attendance counts"""
+    return db.select(
+        Session.id,
+        Session.entry_token,
+        Session.exit_token,
+        Session.session_name,
+        Session.session_date,
+        Session.is_active,
+        db.func.count(db.case(
+            (db.or_(Attendance.status.is_(None), Attendance.status != 'absent'), Attendance.id)
+        )).label('attendance_count'),
+        db.func.count(Attendance.entry_time).label('checked_in_count'),
+        db.func.count(Attendance.exit_time).label('checked_out_count')
+    ).outerjoin(
+        Attendance, Session.id == Attendance.session_id
+    ).where(
+        Session.course_id == course_id
+    ).group_by(Session.id).order_by(Session.id)
 
-@app.route('/api/sessions/<int:session_id>', methods=['DELETE'])
+@bp.route('/api/sessions/<int:session_id>', methods=['DELETE'])
 @login_required()
 def delete_session(session_id):
     user_id = flask_session['user_id']
@@ -981,9 +2358,14 @@ def delete_session(session_id):
         return jsonify({'error': 'Unauthorized'}), 403
     db.session.delete(session_obj)
     db.session.commit()
+    invalidate_course_analytics(course)
+    current_app.extensions['proxy_detector'].forget(session_id)
+    current_app.extensions['presence'].forget(session_id)
+    current_app.extensions['roster_index'].forget_tokens(session_obj.course_id)
+    remove_session_qr_files(session_obj)
     return jsonify({'result': 'deleted'})
 
-@app.route('/api/sessions/<int:session_id>/export_csv', methods=['GET'])
+@bp.route('/api/sessions/<int:session_id>/export_csv', methods=['GET'])
 @login_required()
 def export_session_csv(session_id):
     user_id = flask_session['user_id']
@@ -995,14 +2377,18 @@ def export_session_csv(session_id):
     if role != 'admin' and course.instructor_id != user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    attendances = Attendance.query.filter_by(session_id=session_id).all()
+    import csv
+    from io import StringIO
+    with report_reader() as reader:
+        attendances = reader.query(Attendance).filter_by(session_id=session_id).all()
+    proxy_flags = scan_proxy_attendance(attendances).student_flags(session_id)
     si = StringIO()
     writer = csv.writer(si)
     
     # CSV headers with entry/exit tracking
     writer.writerow([
         'Name', 'Surname', 'Student ID', 'Course', 'Session', 
-        'Entry Time', 'Exit Time', 'Duration (minutes)', 'IP Address', 'Device/Browser', 'Status'
+        'Entry Time', 'Exit Time', 'Duration (minutes)', 'IP Address', 'Device/Browser', 'Status', 'Proxy Flag'
     ])
     
     for a in attendances:
@@ -1028,7 +2414,8 @@ def export_session_csv(session_id):
             a.duration_minutes or 'N/A',
             a.ip_address,
             device_info,
-            a.status or 'present'
+            a.status or 'present',
+            ', '.join(proxy_flags.get(a.student_key, []))
         ])
     
     output = si.getvalue()
@@ -1041,121 +2428,1275 @@ def export_session_csv(session_id):
         }
     )
 
-# Analytics endpoints
-@app.route('/api/analytics/dashboard', methods=['GET'])
-@login_required()
-def analytics_dashboard():
-    try:
-        # Get overall statistics
-        total_courses = Course.query.filter_by(is_active=True).count()
-        total_sessions = Session.query.count()
-        total_attendances = Attendance.query.count()
-        active_sessions = Session.query.filter_by(is_active=True).count()
-        
-        # Get recent activity (last 7 days) - fixed datetime deprecation
-        week_ago = datetime.now() - timedelta(days=7)
-        recent_attendances = Attendance.query.filter(
-            Attendance.entry_time >= week_ago
-        ).count()
-        
-        # Get top courses by attendance - fixed join ambiguity
-        top_courses_result = db.session.query(
-            Course.name, 
-            Course.course_code,
-            db.func.count(Attendance.id).label('attendance_count')
-        ).select_from(Course).join(
-            Session, Course.id == Session.course_id
-        ).join(
-            Attendance, Session.id == Attendance.session_id
-        ).group_by(Course.id, Course.name, Course.course_code).order_by(
-            db.func.count(Attendance.id).desc()
-        ).limit(5).all()
-        
-        # Get attendance trends (last 30 days) - fixed datetime deprecation
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        attendance_trends = db.session.query(
-            db.func.date(Attendance.entry_time).label('date'),
-            db.func.count(Attendance.id).label('count')
-        ).filter(
-            Attendance.entry_time >= thirty_days_ago,
-            Attendance.entry_time.isnot(None)
-        ).group_by(
-            db.func.date(Attendance.entry_time)
-        ).order_by('date').all()
-        
-        return jsonify({
-            'overview': {
-                'total_courses': total_courses,
-                'total_sessions': total_sessions,
-                'total_attendances': total_attendances,
-                'active_sessions': active_sessions,
-                'recent_attendances': recent_attendances
-            },
-            'top_courses': [
-                {
-                    'name': course[0],
-                    'code': course[1] if course[1] else 'N/A',
-                    'attendance_count': course[2]
-                } for course in top_courses_result
-            ],
-            'attendance_trends': [
-                {
-                    'date': str(trend[0]) if trend[0] else 'N/A',
-                    'count': trend[1]
-                } for trend in attendance_trends
-            ]
+# Attendance classification
+def session_start_time(session_obj):
+    return session_obj.start_time or session_obj.session_date
+
+def session_end_time(session_obj):
+    """Scheduled end of a session: explicit end_time, else start plus max_duration"""
+    if session_obj.end_time:
+        return session_obj.end_time
+    start = session_start_time(session_obj)
+    if not start:
+        return None
+    return start + timedelta(minutes=session_obj.max_duration or 120)
+
+def session_accepts_scans(session_obj, now=None):
+    """A session takes check-ins and check-outs until it is closed or its end time passes"""
+    if not session_obj.is_active:
+        return False
+    end = session_end_time(session_obj)
+    return end is None or (now or datetime.now()) < end
+
+def duration_minutes_until(exit_time):
+    """SQL expression for whole minutes from a row's entry_time to exit_time"""
+    exit_at = db.literal(exit_time, db.DateTime)
+    # Whole seconds first so julianday rounding error cannot drop a minute
+    return db.cast(
+        db.func.round((db.func.julianday(exit_at) - db.func.julianday(Attendance.entry_time)) * 86400),
+        db.Integer
+    ) // 60
+
+def auto_checkout_session(session_obj, closed_at):
+    """Check out everyone still present in one UPDATE, computing duration in SQL"""
+    return db.session.execute(
+        db.update(Attendance).where(
+            Attendance.session_id == session_obj.id,
+            Attendance.entry_time.isnot(None),
+            Attendance.exit_time.is_(None)
+        ).values(
+            exit_time=closed_at,
+            duration_minutes=duration_minutes_until(closed_at)
+        )
+    ).rowcount
+
+def classify_session_attendance(session_obj, closed_at):
+    """Record final statuses for a closed session with one bulk insert and one UPDATE.
+    
+    Roster students with no attendance row get an 'absent' row, then a single
+    UPDATE marks every row absent, late, left_early or present relative to the
+    course grace windows. Rows marked 'excused' are left alone.
+    """
+    course = db.session.get(Course, session_obj.course_id)
+    start = session_start_time(session_obj)
+    end = min(session_end_time(session_obj), closed_at)
+    late_after = start + timedelta(minutes=course.late_grace_minutes or 0)
+    early_before = end - timedelta(minutes=course.early_leave_minutes or 0)
+    
+    # Keys are computed here rather than backfilled so the insert cannot collide
+    # with a check-in made under the student's ID or name
+    recorded = {key for (key,) in db.session.query(Attendance.student_key).filter_by(session_id=session_obj.id)}
+    no_shows = []
+    for entry in RosterEntry.query.filter_by(course_id=course.id):
+        key = normalize_student_key(entry.name, entry.surname, entry.student_id)
+        if key in recorded or normalize_student_key(entry.name, entry.surname) in recorded:
+            continue
+        recorded.add(key)
+        no_shows.append({
+            'session_id': session_obj.id,
+            'name': entry.name,
+            'surname': entry.surname,
+            'student_id': entry.student_id,
+            'ip_address': '',
+            'course_name': course.name,
+            'status': 'absent',
+            'student_key': key
         })
-    except Exception as e:
-        print(f"Analytics error: {str(e)}")
-        return jsonify({'error': 'Failed to fetch analytics data'}), 500
+    if no_shows:
+        db.session.execute(db.insert(Attendance), no_shows)
+    inserted = len(no_shows)
+    
+    classified = db.session.execute(
+        db.update(Attendance).where(
+            Attendance.session_id == session_obj.id,
+            db.or_(Attendance.status.is_(None), Attendance.status != 'excused')
+        ).values(status=db.case(
+            (Attendance.entry_time.is_(None), 'absent'),
+            (Attendance.entry_time > late_after, 'late'),
+            (db.and_(Attendance.exit_time.isnot(None), Attendance.exit_time < early_before), 'left_early'),
+            else_='present'
+        ))
+    ).rowcount
+    return {'absent_rows_added': inserted, 'classified': classified}
 
-@app.route('/api/analytics/course/<int:course_id>', methods=['GET'])
+def close_session(session_obj):
+    """Deactivate a session, check out stragglers and classify attendance exactly once"""
+    if not session_obj.is_active:
+        return {'auto_checked_out': 0, 'absent_rows_added': 0, 'classified': 0}
+    # Sessions closed by the scheduler end at their scheduled time, manual closes end now
+    closed_at = min(datetime.now(), session_end_time(session_obj))
+    session_obj.is_active = False
+    checked_out = auto_checkout_session(session_obj, closed_at)
+    result = classify_session_attendance(session_obj, closed_at)
+    db.session.commit()
+    invalidate_course_analytics(session_obj.course)
+    current_app.extensions['proxy_detector'].forget(session_obj.id)
+    current_app.extensions['presence'].forget(session_obj.id)
+    current_app.extensions['roster_index'].forget_tokens(session_obj.course_id)
+    return {'auto_checked_out': checked_out, **result}
+
+@bp.route('/api/sessions/<int:session_id>/close', methods=['POST'])
 @login_required()
-def course_analytics(course_id):
-    try:
-        course = db.session.get(Course, course_id)
-        if not course:
-            return jsonify({'error': 'Course not found'}), 404
-        
-        # Check permissions
-        user_id = flask_session['user_id']
-        role = flask_session['role']
-        if role != 'admin' and course.instructor_id != user_id:
-            return jsonify({'error': 'Unauthorized'}), 403
-        
-        # Get course sessions
-        sessions = Session.query.filter_by(course_id=course_id).all()
-        
-        # Get attendance statistics - fixed join syntax (only count those who checked in)
-        total_attendances = db.session.query(Attendance).select_from(Attendance).join(
-            Session, Attendance.session_id == Session.id
-        ).filter(
-            Session.course_id == course_id,
-            Attendance.entry_time.isnot(None)
-        ).count()
+def close_session_endpoint(session_id):
+    user_id = flask_session['user_id']
+    role = flask_session['role']
+    session_obj = db.session.get(Session, session_id)
+    if not session_obj:
+        return jsonify({'error': 'Session not found'}), 404
+    course = db.session.get(Course, session_obj.course_id)
+    if role != 'admin' and course.instructor_id != user_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    if not session_obj.is_active:
+        return jsonify({'error': 'Session is already closed'}), 400
+    result = close_session(session_obj)
+    return jsonify({'result': 'closed', **result})
+
+@bp.route('/api/courses/<int:course_id>/roster', methods=['GET'])
+@login_required()
+def get_roster(course_id):
+    user_id = flask_session['user_id']
+    role = flask_session['role']
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({'error': 'Course not found'}), 404
+    if role != 'admin' and course.instructor_id != user_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    entries = RosterEntry.query.filter_by(course_id=course_id).order_by(RosterEntry.surname, RosterEntry.name).all()
+    return jsonify([
+        {'id': e.id, 'name': e.name, 'surname': e.surname, 'student_id': e.student_id}
+        for e in entries
+    ])
+
+@bp.route('/api/courses/<int:course_id>/roster', methods=['POST'])
+@login_required()
+def add_roster_students(course_id):
+    user_id = flask_session['user_id']
+    role = flask_session['role']
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({'error': 'Course not found'}), 404
+    if role != 'admin' and course.instructor_id != user_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    added, roster_size = add_roster_entries(course_id, request.json.get('students', []))
+    return jsonify({'added': added, 'roster_size': roster_size})
+
+def add_roster_entries(course_id, students):
+    """Insert new roster students in one statement, skipping names already listed.
+    
+    Returns (added, roster_size). The autocomplete index is updated in place.
+    """
+    existing = {
+        (n.lower(), sn.lower())
+        for n, sn in db.session.query(RosterEntry.name, RosterEntry.surname).filter_by(course_id=course_id)
+    }
+    rows = []
+    for student in students:
+        name = (student.get('name') or '').strip()
+        surname = (student.get('surname') or '').strip()
+        if not name or not surname or (name.lower(), surname.lower()) in existing:
+            continue
+        existing.add((name.lower(), surname.lower()))
+        rows.append({
+            'course_id': course_id, 'name': name, 'surname': surname,
+            'student_id': (student.get('student_id') or '').strip() or None
+        })
+    if rows:
+        inserted = db.session.execute(
+            db.insert(RosterEntry).returning(RosterEntry.id, RosterEntry.name, RosterEntry.surname), rows
+        ).all()
+        db.session.commit()
+        current_app.extensions['roster_index'].add(course_id, inserted)
+    return len(rows), len(existing)
+
+@bp.route('/api/courses/<int:course_id>/roster/import', methods=['POST'])
+@login_required()
+def import_roster_csv(course_id):
+    """Add students from an uploaded CSV with name, surname and optional student_id columns"""
+    import csv
+    from io import StringIO
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({'error': 'Course not found'}), 404
+    if flask_session['role'] != 'admin' and course.instructor_id != flask_session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    file = request.files.get('file')
+    if file is None or file.filename == '':
+        return jsonify({'error': 'No file uploaded'}), 400
+    if not file.filename.lower().endswith('.csv'):
+        return jsonify({'error': 'File must be a CSV file'}), 400
+    
+    try:
+        # utf-8-sig drops the byte order mark spreadsheet programs put in front
+        csv_reader = csv.DictReader(StringIO(file.read().decode('utf-8-sig')))
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSV must be UTF-8 encoded'}), 400
+    columns = {(f or '').strip().lower(): f for f in csv_reader.fieldnames or []}
+    if 'name' not in columns or 'surname' not in columns:
+        return jsonify({'error': 'CSV must contain columns: name, surname (student_id optional)'}), 400
+    
+    students = []
+    errors = []
+    for line_number, row in enumerate(csv_reader, 2):
+        student = {key: (row.get(columns[key]) or '').strip() for key in ('name', 'surname', 'student_id') if key in columns}
+        if not student['name'] or not student['surname']:
+            errors.append(f"Line {line_number}: Missing name or surname")
+            continue
+        students.append(student)
+    added, roster_size = add_roster_entries(course_id, students)
+    return jsonify({
+        'added': added,
+        'skipped': len(students) - added,
+        'error_count': len(errors),
+        'errors': errors,
+        'roster_size': roster_size
+    })
+
+@bp.route('/api/courses/<int:course_id>/roster/<int:entry_id>', methods=['DELETE'])
+@login_required()
+def delete_roster_student(course_id, entry_id):
+    course = db.session.get(Course, course_id)
+    if not course:
+        return jsonify({'error': 'Course not found'}), 404
+    if flask_session['role'] != 'admin' and course.instructor_id != flask_session['user_id']:
+        return jsonify({'error': 'Unauthorized'}), 403
+    entry = db.session.get(RosterEntry, entry_id)
+    if not entry or entry.course_id != course_id:
+        return jsonify({'error': 'Roster entry not found'}), 404
+    db.session.delete(entry)
+    db.session.commit()
+    current_app.extensions['roster_index'].remove(course_id, [entry_id])
+    return jsonify({'result': 'deleted'})
+
+# Roster autocomplete
+def fold_name(text):
+    """Case- and accent-insensitive form of a name, so 'ayse' finds 'Ayşe'"""
+    text = unicodedata.normalize('NFKD', (text or '').replace('ı', 'i').replace('İ', 'I'))
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).casefold().split())
+
+class RosterIndex:
+    """Per-course sorted arrays of folded 'name surname' and 'surname name' keys.
+    
+    A lookup bisects to the first key at or after the typed prefix and scans
+    while keys still start with it: microseconds, and no database work once a
+    course is loaded. Roster edits made through this worker update the arrays
+    in place, and sync_caches() drops courses edited through other workers. As
+    a backstop a course is also reloaded once it is older than max_age.
+    """
+    
+    def __init__(self, max_age, max_courses=1000, max_tokens=10000):
+        self.max_age = max_age
+        self.max_courses = max_courses
+        self.max_tokens = max_tokens
+        self.courses = {}  # course_id -> {'loaded_at', 'keys': [(folded, entry_id)], 'entries': {entry_id: (name, surname)}}
+        self.tokens = {}   # entry or exit token -> (course_id, scans_until), see session_for_token
+        self.lock = threading.Lock()
+    
+    @staticmethod
+    def _keys(entry_id, name, surname):
+        return ((fold_name(f'{name} {surname}'), entry_id), (fold_name(f'{surname} {name}'), entry_id))
+    
+    def session_for_token(self, token):
+        """(course_id, scans_until) of the session an entry or exit token belongs to, or None.
         
-        # Get unique students - fixed join syntax (only count those who checked in)
-        unique_students = db.session.query(
-            Attendance.name, Attendance.surname
-        ).select_from(Attendance).join(
+        scans_until is when the session stops taking scans: its scheduled end,
+        None if it has none, or datetime.min once it is closed. Closing or
+        deleting a session drops its course's tokens, so this stays current.
+        """
+        cached = self.tokens.get(token)
+        if cached is None:
+            session_obj = Session.query.filter(
+                db.or_(Session.entry_token == token, Session.exit_token == token)
+            ).first()
+            if session_obj is None:
+                return None
+            cached = (session_obj.course_id, session_end_time(session_obj) if session_obj.is_active else datetime.min)
+            if len(self.tokens) >= self.max_tokens:
+                self.tokens.clear()
+            self.tokens[token] = cached
+        return cached
+    
+    def _course(self, course_id):
+        index = self.courses.get(course_id)
+        if index is not None and time.monotonic() - index['loaded_at'] <= self.max_age:
+            return index
+        rows = db.session.query(RosterEntry.id, RosterEntry.name, RosterEntry.surname).filter_by(course_id=course_id).all()
+        index = {
+            'loaded_at': time.monotonic(),
+            'keys': sorted(key for row in rows for key in self._keys(*row)),
+            'entries': {row.id: (row.name, row.surname) for row in rows}
+        }
+        with self.lock:
+            self.courses.pop(course_id, None)
+            if len(self.courses) >= self.max_courses:
+                del self.courses[next(iter(self.courses))]
+            self.courses[course_id] = index
+        return index
+    
+    def suggest(self, course_id, typed, limit=8):
+        """Roster (name, surname) pairs whose name or surname-first form starts with `typed`"""
+        prefix = fold_name(typed)
+        if not prefix:
+            return []
+        index = self._course(course_id)
+        results = []
+        seen = set()
+        with self.lock:
+            keys = index['keys']
+            i = bisect.bisect_left(keys, (prefix,))
+            while i < len(keys) and len(results) < limit and keys[i][0].startswith(prefix):
+                entry_id = keys[i][1]
+                if entry_id not in seen:
+                    seen.add(entry_id)
+                    results.append(index['entries'][entry_id])
+                i += 1
+        return results
+    
+    def _discard(self, index, entry_id):
+        entry = index['entries'].pop(entry_id, None)
+        if entry is None:
+            return
+        for key in self._keys(entry_id, *entry):
+            i = bisect.bisect_left(index['keys'], key)
+            if i < len(index['keys']) and index['keys'][i] == key:
+                del index['keys'][i]
+    
+    def add(self, course_id, rows):
+        """Insert (id, name, surname) rows into a loaded course; unloaded courses load on first use"""
+        with self.lock:
+            index = self.courses.get(course_id)
+            if index is None:
+                return
+            for row in rows:
+                # SQLite reuses the ids of deleted rows, so an id may still hold an older entry
+                self._discard(index, row[0])
+                index['entries'][row[0]] = (row[1], row[2])
+                for key in self._keys(*row):
+                    bisect.insort(index['keys'], key)
+    
+    def remove(self, course_id, entry_ids):
+        with self.lock:
+            index = self.courses.get(course_id)
+            if index is None:
+                return
+            for entry_id in entry_ids:
+                self._discard(index, entry_id)
+    
+    def forget(self, course_id):
+        with self.lock:
+            self.courses.pop(course_id, None)
+    
+    def forget_tokens(self, course_id):
+        """Drop cached tokens of a course, after one of its sessions was closed or deleted"""
+        with self.lock:
+            self.tokens = {token: cached for token, cached in self.tokens.items() if cached[0] != course_id}
+    
+    def clear(self):
+        with self.lock:
+            self.courses.clear()
+            self.tokens.clear()
+
+@bp.route('/attend/suggest/<token>', methods=['GET'])
+def suggest_roster_names(token):
+    """Autocomplete for the check-in form: roster names starting with ?q="""
+    typed = request.args.get('q', '')
+    if len(typed.strip()) < 2:
+        return jsonify([])
+    roster_index = current_app.extensions['roster_index']
+    sync_caches()
+    found = roster_index.session_for_token(token)
+    if found is None:
+        return jsonify({'error': 'Invalid token'}), 404
+    # Same rule as session_accepts_scans(): no roster names once the session stops taking scans
+    course_id, scans_until = found
+    if scans_until is not None and datetime.now() >= scans_until:
+        return jsonify({'error': 'This session has closed'}), 410
+    return jsonify([{'name': name, 'surname': surname} for name, surname in roster_index.suggest(course_id, typed)])
+
+# Report snapshots
+class ReportSnapshot:
+    """Read-only copy of the database that heavy reports query instead of the live file.
+    
+    refresh() copies the live database into a new file with SQLite's online
+    backup API and swaps in a read-only engine for it. With WAL journaling the
+    copy is a single read transaction, so check-ins keep committing while it
+    runs. Every refresh writes a new file because report queries may still be
+    reading the previous one; older files of this process are removed after
+    the swap.
+    """
+    
+    def __init__(self, database_path, max_age):
+        self.database_path = database_path
+        self.directory = os.path.dirname(database_path)
+        self.prefix = f'report_snapshot_{os.getpid()}_'
+        self.max_age = max_age
+        self.current = (None, None)  # (engine, taken_at), swapped as one value
+        self.generation = 0
+        self.lock = threading.Lock()
+    
+    def age(self):
+        taken_at = self.current[1]
+        return None if taken_at is None else (datetime.now() - taken_at).total_seconds()
+    
+    def refresh(self, max_age=None):
+        """Take a new snapshot; with max_age, only if the current one is older than that"""
+        import sqlite3
+        with self.lock:
+            age = self.age()
+            if max_age is not None and age is not None and age <= max_age:
+                return None
+            self.generation += 1
+            path = os.path.join(self.directory, f'{self.prefix}{self.generation}.db')
+            started = time.perf_counter()
+            source = sqlite3.connect(self.database_path)
+            target = sqlite3.connect(path)
+            try:
+                taken_at = datetime.now()
+                source.backup(target)
+            finally:
+                target.close()
+                source.close()
+            uri = Path(path).resolve().as_uri() + '?mode=ro'
+            engine = create_engine(
+                'sqlite://',
+                creator=lambda: sqlite3.connect(uri, uri=True, check_same_thread=False),
+                poolclass=NullPool
+            )
+            self.current = (engine, taken_at)
+            removed = 0
+            for name in os.listdir(self.directory):
+                if name.startswith(self.prefix) and os.path.join(self.directory, name) != path:
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                        removed += 1
+                    except OSError:
+                        pass  # Still open by a running report; the next refresh retries
+        return {
+            'taken_at': taken_at.isoformat(),
+            'snapshot_bytes': os.path.getsize(path),
+            'copy_ms': round((time.perf_counter() - started) * 1000, 2),
+            'old_snapshots_removed': removed
+        }
+
+def refresh_report_snapshot(max_age=None):
+    """Refresh the snapshot and drop analytics computed from the previous one"""
+    report = current_app.extensions['report_snapshot'].refresh(max_age)
+    if report is not None:
+        current_app.extensions['analytics_cache'].invalidate('snapshot')
+    return report
+
+def refresh_report_snapshot_in_background(flask_app, max_age):
+    with flask_app.app_context():
+        try:
+            refresh_report_snapshot(max_age)
+        except Exception as e:
+            print(f"Report snapshot refresh failed: {e}")
+
+def refresh_stale_report_snapshot():
+    """In reporting mode, start refreshing a snapshot older than its max age.
+    
+    The copy runs on a background thread; reports keep reading the stale
+    snapshot meanwhile and are flagged as stale. A thread that finds another
+    refresh already done returns without copying.
+    """
+    snapshot = current_app.extensions.get('report_snapshot')
+    if snapshot is not None and not snapshot.lock.locked():
+        age = snapshot.age()
+        if age is None or age > snapshot.max_age:
+            threading.Thread(
+                target=refresh_report_snapshot_in_background,
+                args=(current_app._get_current_object(), snapshot.max_age),
+                name='report-snapshot', daemon=True
+            ).start()
+    return snapshot
+
+@contextmanager
+def report_reader():
+    """ORM session for report queries: the snapshot in reporting mode, else the live database.
+    
+    Until the first snapshot exists, reports read the live database. Records
+    the data source on g so the response carries its staleness.
+    """
+    snapshot = refresh_stale_report_snapshot()
+    engine, taken_at = snapshot.current if snapshot is not None else (None, None)
+    if engine is None:
+        g.report_source = ('live', None)
+        yield db.session
+        return
+    g.report_source = ('snapshot', taken_at)
+    reader = ReportSession(bind=engine)
+    try:
+        yield reader
+    finally:
+        reader.close()
+
+@bp.after_app_request
+def report_source_headers(response):
+    source = g.get('report_source')
+    if source is not None:
+        kind, taken_at = source
+        response.headers['X-Report-Source'] = kind
+        if taken_at is not None:
+            staleness = (datetime.now() - taken_at).total_seconds()
+            response.headers['X-Report-Snapshot-At'] = taken_at.isoformat(timespec='seconds')
+            response.headers['X-Report-Staleness'] = str(round(staleness, 1))
+            if staleness > current_app.extensions['report_snapshot'].max_age:
+                response.headers['X-Report-Stale'] = '1'
+    return response
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # Takes effect when a new file gets its first table; existing files keep their
+    # mode until convert-incremental-vacuum rebuilds them offline
+    cursor.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    # WAL lets readers, including snapshot copies, run alongside check-in writes
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+# Student history
+STUDENT_HISTORY_PAGE_SIZE = 100
+STUDENT_HISTORY_MAX_PAGE_SIZE = 1000
+
+def date_range_filters(column):
+    """Conditions on column for the optional ?from= and ?to= ISO dates.
+    
+    Returns (conditions, None), or (None, name) for an argument that is not a
+    valid date. A date-only `to` includes that whole day.
+    """
+    conditions = []
+    for arg in ('from', 'to'):
+        value = request.args.get(arg, '').strip()
+        if not value:
+            continue
+        try:
+            bound = datetime.fromisoformat(value)
+        except ValueError:
+            return None, arg
+        if arg == 'from':
+            conditions.append(column >= bound)
+        elif len(value) <= 10:
+            conditions.append(column < bound + timedelta(days=1))
+        else:
+            conditions.append(column <= bound)
+    return conditions, None
+
+def student_history_query(reader):
+    """Attendance rows for the requested student, limited to the caller's courses.
+    
+    Returns (query, None) or (None, error_response). The student is identified by
+    student_id and/or name+surname; each maps to an indexed student_key.
+    """
+    student_id = request.args.get('student_id', '').strip()
+    name = request.args.get('name', '').strip()
+    surname = request.args.get('surname', '').strip()
+    keys = set()
+    if student_id:
+        keys.add(normalize_student_key(name, surname, student_id))
+    if name and surname:
+        keys.add(normalize_student_key(name, surname))
+    if not keys:
+        return None, (jsonify({'error': 'student_id or name and surname required'}), 400)
+    
+    query = reader.query(
+        Attendance.id,
+        Attendance.name,
+        Attendance.surname,
+        Attendance.student_id,
+        Course.id.label('course_id'),
+        Course.name.label('course_name'),
+        Course.course_code,
+        Session.id.label('session_id'),
+        Session.session_name,
+        Session.session_date,
+        Attendance.entry_time,
+        Attendance.exit_time,
+        Attendance.duration_minutes,
+        Attendance.status
+    ).select_from(Attendance).join(
+        Session, Attendance.session_id == Session.id
+    ).join(
+        Course, Session.course_id == Course.id
+    ).filter(Attendance.student_key.in_(keys))
+    if flask_session['role'] != 'admin':
+        query = query.filter(Course.instructor_id == flask_session['user_id'])
+    dates, invalid = date_range_filters(Session.session_date)
+    if invalid:
+        return None, (jsonify({'error': f'Invalid {invalid} date'}), 400)
+    return query.filter(*dates).order_by(Attendance.id.desc()), None
+
+@bp.route('/api/students/history', methods=['GET'])
+@login_required()
+def student_history():
+    """Newest-first attendance history across courses, paginated by the before=<id> cursor"""
+    limit = min(max(request.args.get('limit', STUDENT_HISTORY_PAGE_SIZE, type=int), 1), STUDENT_HISTORY_MAX_PAGE_SIZE)
+    before = request.args.get('before', type=int)
+    with report_reader() as reader:
+        query, error = student_history_query(reader)
+        if error:
+            return error
+        if before is not None:
+            query = query.filter(Attendance.id < before)
+        rows = query.limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return jsonify({
+        'records': [row._asdict() for row in rows[:limit]],
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/api/students/history/export_csv', methods=['GET'])
+@login_required()
+def export_student_history_csv():
+    import csv
+    from io import StringIO
+    # The reader stays open until the stream finishes
+    stack = ExitStack()
+    query, error = student_history_query(stack.enter_context(report_reader()))
+    if error:
+        stack.close()
+        return error
+    
+    def generate():
+        with stack:
+            si = StringIO()
+            writer = csv.writer(si)
+            writer.writerow([
+                'Name', 'Surname', 'Student ID', 'Course', 'Course Code', 'Session', 'Session Date',
+                'Entry Time', 'Exit Time', 'Duration (minutes)', 'Status'
+            ])
+            for i, a in enumerate(query.yield_per(500), 1):
+                writer.writerow([
+                    a.name,
+                    a.surname,
+                    a.student_id or 'N/A',
+                    a.course_name,
+                    a.course_code or 'N/A',
+                    a.session_name,
+                    a.session_date.strftime('%Y-%m-%d %H:%M') if a.session_date else 'N/A',
+                    a.entry_time.strftime('%Y-%m-%d %H:%M:%S') if a.entry_time else 'Not checked in',
+                    a.exit_time.strftime('%Y-%m-%d %H:%M:%S') if a.exit_time else 'Not checked out',
+                    a.duration_minutes or 'N/A',
+                    a.status or 'present'
+                ])
+                if i % 500 == 0:
+                    yield si.getvalue()
+                    si.seek(0)
+                    si.truncate(0)
+            yield si.getvalue()
+    
+    from flask import Response, stream_with_context
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={
+            'Content-Disposition': 'attachment;filename=student_attendance_history.csv'
+        }
+    )
+
+# Attendance search
+SEARCH_PAGE_SIZE = 25
+SEARCH_MAX_PAGE_SIZE = 100
+SEARCH_MAX_TERMS = 8
+# Shorter words match whole tokens only; a one-letter prefix expands to most of the index
+SEARCH_MIN_PREFIX = 2
+# bm25 column weights: name, surname, student_id, course_name, session_name, course_scope
+SEARCH_WEIGHTS = '10.0, 10.0, 20.0, 2.0, 1.0, 0.0'
+
+def attendance_search_match(text, course_ids=None):
+    """FTS5 query in which every typed word must prefix-match a searchable column.
+    
+    Words are quoted, so user input can never form FTS5 syntax. With course_ids
+    the scope tokens join the MATCH, so FTS intersects posting lists instead of
+    ranking every match and filtering afterwards.
+    """
+    terms = re.findall(r'\w+', text)[:SEARCH_MAX_TERMS]
+    if not terms:
+        return None
+    words = ' AND '.join(f'"{term}"*' if len(term) >= SEARCH_MIN_PREFIX else f'"{term}"' for term in terms)
+    match = f"{{{' '.join(ATTENDANCE_SEARCH_COLUMNS)}}} : ({words})"
+    if course_ids is not None:
+        match += f" AND course_scope : ({' OR '.join(f'c{course_id}' for course_id in course_ids)})"
+    return match
+
+@bp.route('/api/attendance/search', methods=['GET'])
+@login_required()
+def search_attendance():
+    """Ranked full-text search over attendance rows in the caller's courses.
+    
+    Query parameters: q (words matched as prefixes of name, surname, student ID,
+    course or session name), page (from 1) and limit. Best matches come first.
+    """
+    limit = min(max(request.args.get('limit', SEARCH_PAGE_SIZE, type=int), 1), SEARCH_MAX_PAGE_SIZE)
+    page = max(request.args.get('page', 1, type=int), 1)
+    course_ids = None
+    if flask_session['role'] != 'admin':
+        course_ids = [course_id for (course_id,) in db.session.query(Course.id).filter_by(instructor_id=flask_session['user_id'])]
+        if not course_ids:
+            return jsonify({'results': [], 'page': page, 'limit': limit, 'has_more': False})
+    match = attendance_search_match(request.args.get('q', ''), course_ids)
+    if match is None:
+        return jsonify({'error': 'q is required'}), 400
+    
+    # Rank and page inside FTS first, then join only the rows being returned
+    ranked = db.text(f"""
+        SELECT rowid, bm25(attendance_search, {SEARCH_WEIGHTS}) AS score FROM attendance_search
+        WHERE attendance_search MATCH :match ORDER BY score LIMIT :limit OFFSET :offset
+    """).bindparams(match=match, limit=limit + 1, offset=(page - 1) * limit).columns(
+        db.column('rowid', db.Integer), db.column('score', db.Float)
+    ).subquery('ranked')
+    with report_reader() as reader:
+        rows = reader.query(
+            Attendance.id,
+            Attendance.name,
+            Attendance.surname,
+            Attendance.student_id,
+            Course.id.label('course_id'),
+            Course.name.label('course_name'),
+            Course.course_code,
+            Session.id.label('session_id'),
+            Session.session_name,
+            Session.session_date,
+            Attendance.entry_time,
+            Attendance.exit_time,
+            Attendance.status,
+            ranked.c.score
+        ).select_from(ranked).join(
+            Attendance, Attendance.id == ranked.c.rowid
+        ).join(
             Session, Attendance.session_id == Session.id
-        ).filter(
-            Session.course_id == course_id,
-            Attendance.entry_time.isnot(None)
-        ).distinct().count()
-        
-        # Session attendance rates
-        session_stats = []
-        for session in sessions:
-            attendance_count = len(session.attendances)
-            session_stats.append({
-                'session_name': session.session_name or f'Session {session.id}',
-                'date': session.session_date.isoformat() if session.session_date else None,
-                'attendance_count': attendance_count,
-                'is_active': session.is_active
-            })
-        
-        return jsonify({
+        ).join(
+            Course, Session.course_id == Course.id
+        ).order_by(ranked.c.score).all()
+    return jsonify({
+        'results': [dict(row._asdict(), score=round(-row.score, 3)) for row in rows[:limit]],
+        'page': page,
+        'limit': limit,
+        'has_more': len(rows) > limit
+    })
+
+# Attendance matrix
+# One byte per (student, session) cell, row-major. Per-student totals are
+# bytes.count over a row slice and per-session totals over a strided column
+# slice, so the totals run in C instead of a Python loop per cell.
+MATRIX_STATUSES = ('present', 'late', 'left_early', 'absent', 'excused')
+MATRIX_CELL_LETTERS = bytes.maketrans(bytes(range(len(MATRIX_STATUSES) + 1)), b'-PLEAX')  # '-' = no record
+MATRIX_ATTENDED = (1, 2, 3)
+MATRIX_ABSENT = 4
+
+def build_attendance_matrix(reader, course):
+    """Students (roster first, then walk-ins) by sessions for one course.
+
+    Rows for the same student under their ID key and their name key share a
+    matrix row. Where two rows land in the same cell the better status wins.
+    """
+    sessions = reader.query(
+        Session.id, Session.session_name, Session.session_date, Session.is_active
+    ).filter(Session.course_id == course.id).order_by(Session.session_date, Session.id).all()
+    roster = reader.query(
+        RosterEntry.name, RosterEntry.surname, RosterEntry.student_id
+    ).filter(RosterEntry.course_id == course.id).all()
+    # Status codes come back from SQL, so the Python loop only places bytes
+    code = db.case(
+        *[(Attendance.status == status, code) for code, status in enumerate(MATRIX_STATUSES, 1)], else_=1
+    )
+    # Core rows: ORM result processing would cost more than the query itself here
+    cell_rows = reader.connection().execute(db.select(
+        Attendance.session_id, Attendance.student_key, code, Attendance.name, Attendance.surname, Attendance.student_id
+    ).join(Session, Attendance.session_id == Session.id).where(
+        Session.course_id == course.id
+    )).all()
+
+    students = []
+    row_of = {}
+
+    def student_row(name, surname, student_id):
+        keys = (normalize_student_key(name, surname, student_id), normalize_student_key(name, surname))
+        row = next((row_of[key] for key in keys if key in row_of), None)
+        if row is None:
+            row = len(students)
+            students.append({'name': name, 'surname': surname, 'student_id': student_id or None})
+        for key in keys:
+            row_of.setdefault(key, row)
+        return row
+
+    for entry in roster:
+        student_row(entry.name, entry.surname, entry.student_id)
+    column_of = {session.id: column for column, session in enumerate(sessions)}
+    placed = []
+    for session_id, student_key, status_code, name, surname, student_id in cell_rows:
+        row = row_of.get(student_key)
+        if row is None:
+            row = student_row(name, surname, student_id)
+        placed.append((row, column_of[session_id], status_code))
+
+    width = len(sessions)
+    cells = bytearray(len(students) * width)
+    for row, column, status_code in placed:
+        index = row * width + column
+        if not cells[index] or status_code < cells[index]:
+            cells[index] = status_code
+    # Alphabetical rows; re-slicing whole rows keeps the reorder in C too
+    order = sorted(range(len(students)), key=lambda i: (students[i]['surname'].casefold(), students[i]['name'].casefold()))
+    cells = b''.join(cells[i * width:(i + 1) * width] for i in order)
+    return sessions, [students[i] for i in order], cells
+
+def matrix_counts(cells):
+    """Count of each status code in a run of cells, plus the attendance percentage"""
+    counts = {status: cells.count(code) for code, status in enumerate(MATRIX_STATUSES, 1)}
+    attended = sum(counts[MATRIX_STATUSES[code - 1]] for code in MATRIX_ATTENDED)
+    counted = attended + counts['absent']
+    return counts, round(100 * attended / counted, 1) if counted else None
+
+def attendance_matrix_or_error(course_id):
+    course = db.session.get(Course, course_id)
+    if not course:
+        return None, (jsonify({'error': 'Course not found'}), 404)
+    if flask_session['role'] != 'admin' and course.instructor_id != flask_session['user_id']:
+        return None, (jsonify({'error': 'Unauthorized'}), 403)
+    with report_reader() as reader:
+        return (course, *build_attendance_matrix(reader, course)), None
+
+@bp.route('/api/courses/<int:course_id>/matrix', methods=['GET'])
+@login_required()
+def course_attendance_matrix(course_id):
+    """Students x sessions grid for a course.
+
+    Each student's `cells` string has one letter per session, in the order of
+    `sessions`: P present, L late, E left early, A absent, X excused, - no record.
+    """
+    matrix, error = attendance_matrix_or_error(course_id)
+    if error:
+        return error
+    course, sessions, students, cells = matrix
+    width = len(sessions)
+    letters = cells.translate(MATRIX_CELL_LETTERS).decode('ascii')
+
+    session_rows = []
+    for column, session in enumerate(sessions):
+        counts, rate = matrix_counts(cells[column::width])
+        session_rows.append({
+            'id': session.id,
+            'session_name': session.session_name or f'Session {session.id}',
+            'date': session.session_date.isoformat() if session.session_date else None,
+            'is_active': session.is_active,
+            'status_counts': counts,
+            'attendance_rate': rate
+        })
+    student_rows = []
+    for row, student in enumerate(students):
+        counts, percentage = matrix_counts(cells[row * width:(row + 1) * width])
+        student_rows.append(dict(
+            student,
+            cells=letters[row * width:(row + 1) * width],
+            status_counts=counts,
+            attendance_percentage=percentage
+        ))
+    counts, rate = matrix_counts(cells)
+    return jsonify({
+        'course': {'id': course.id, 'name': course.name, 'code': course.course_code or 'N/A'},
+        'legend': {'P': 'present', 'L': 'late', 'E': 'left_early', 'A': 'absent', 'X': 'excused', '-': None},
+        'sessions': session_rows,
+        'students': student_rows,
+        'totals': {'status_counts': counts, 'attendance_rate': rate}
+    })
+
+@bp.route('/api/courses/<int:course_id>/matrix/export_csv', methods=['GET'])
+@login_required()
+def export_attendance_matrix_csv(course_id):
+    import csv
+    from io import StringIO
+    matrix, error = attendance_matrix_or_error(course_id)
+    if error:
+        return error
+    course, sessions, students, cells = matrix
+    width = len(sessions)
+    letters = cells.translate(MATRIX_CELL_LETTERS).decode('ascii')
+    si = StringIO()
+    writer = csv.writer(si)
+    writer.writerow(
+        ['Name', 'Surname', 'Student ID']
+        + [f"{s.session_name or f'Session {s.id}'} ({s.session_date.strftime('%Y-%m-%d') if s.session_date else 'N/A'})"
+           for s in sessions]
+        + ['Present', 'Late', 'Left Early', 'Absent', 'Excused', 'Attendance %']
+    )
+    for row, student in enumerate(students):
+        counts, percentage = matrix_counts(cells[row * width:(row + 1) * width])
+        writer.writerow(
+            [student['name'], student['surname'], student['student_id'] or 'N/A']
+            + list(letters[row * width:(row + 1) * width])
+            + [counts[status] for status in MATRIX_STATUSES]
+            + [percentage if percentage is not None else 'N/A']
+        )
+
+    from flask import Response
+    return Response(
+        si.getvalue(),
+        mimetype='text/csv',
+        headers={
+            'Content-Disposition': f'attachment;filename=course_{course.id}_attendance_matrix.csv'
+        }
+    )
+
+# Change feed
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_FEED_MAX_PAGE_SIZE = 5000
+CHANGE_FEED_POLL_INTERVAL = 0.5
+
+def encode_feed_cursor(seq):
+    return base64.urlsafe_b64encode(f'seq:{seq}'.encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_feed_cursor(cursor):
+    """Sequence number inside an opaque cursor; an empty cursor decodes to 0"""
+    if not cursor:
+        return 0
+    try:
+        kind, _, seq = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii').partition(':')
+        if kind == 'seq' and seq.isdigit():
+            return int(seq)
+    except (ValueError, UnicodeDecodeError):
+        pass
+    return None
+
+def oldest_feed_seq():
+    """First sequence number still in the log (pruning removes older ones)"""
+    oldest = db.session.query(db.func.min(AttendanceChange.seq)).scalar()
+    if oldest is not None:
+        return oldest
+    high_water = db.session.execute(
+        db.text("SELECT seq FROM sqlite_sequence WHERE name = 'attendance_changes'")
+    ).scalar()
+    return (high_water or 0) + 1
+
+@bp.route('/api/changes', methods=['GET'])
+@login_required(role='admin')
+def attendance_change_feed():
+    """Attendance inserts, updates and deletes after an opaque cursor, oldest first.
+    
+    Each page holds the latest change per attendance row with the row's current
+    values (null once deleted); consumers apply them as upserts and deletes and
+    pass the returned cursor back. With wait=<seconds> an empty result is held
+    open until changes arrive or the wait runs out. Without a cursor the feed
+    starts at the oldest retained change; history_pruned says whether older
+    entries were pruned, in which case rows unchanged since then need a full
+    export.
+    """
+    cursor = request.args.get('cursor', '')
+    after = decode_feed_cursor(cursor)
+    if after is None:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    oldest = oldest_feed_seq()
+    if not cursor:
+        after = oldest - 1
+    elif after + 1 < oldest:
+        return jsonify({'error': 'Cursor is older than the retained change log; run a full export and start again without a cursor'}), 410
+    limit = min(max(request.args.get('limit', CHANGE_FEED_PAGE_SIZE, type=int), 1), CHANGE_FEED_MAX_PAGE_SIZE)
+    wait = min(max(request.args.get('wait', 0, type=float), 0), current_app.config['CHANGE_FEED_MAX_WAIT'])
+    course_id = request.args.get('course_id', type=int)
+    
+    query = AttendanceChange.query.filter(AttendanceChange.seq > after)
+    if course_id is not None:
+        query = query.filter(AttendanceChange.course_id == course_id)
+    deadline = time.monotonic() + wait
+    while True:
+        changes = query.order_by(AttendanceChange.seq).limit(limit + 1).all()
+        if changes or time.monotonic() >= deadline:
+            break
+        time.sleep(min(CHANGE_FEED_POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    
+    latest = {change.attendance_id: change for change in changes}
+    records = {
+        a.id: a for a in Attendance.query.filter(Attendance.id.in_(list(latest))).all()
+    } if latest else {}
+    return jsonify({
+        'changes': [
+            {
+                'seq': change.seq,
+                'op': change.op,
+                'attendance_id': change.attendance_id,
+                'session_id': change.session_id,
+                'course_id': change.course_id,
+                'changed_at': change.changed_at,
+                'record': attendance_feed_record(records.get(change.attendance_id))
+            } for change in sorted(latest.values(), key=lambda change: change.seq)
+        ],
+        'cursor': encode_feed_cursor(changes[-1].seq if changes else after),
+        'has_more': has_more,
+        'history_pruned': oldest > 1
+    })
+
+def attendance_feed_record(a):
+    if a is None:
+        return None
+    return {
+        'id': a.id,
+        'session_id': a.session_id,
+        'name': a.name,
+        'surname': a.surname,
+        'student_id': a.student_id,
+        'student_key': a.student_key,
+        'course_name': a.course_name,
+        'entry_time': a.entry_time,
+        'exit_time': a.exit_time,
+        'duration_minutes': a.duration_minutes,
+        'status': a.status
+    }
+
+def prune_change_feed():
+    """Drop change log entries older than the retention window, and cache invalidations older than a day"""
+    cutoff = datetime.now() - timedelta(days=current_app.config['CHANGE_FEED_RETENTION_DAYS'])
+    deleted = AttendanceChange.query.filter(AttendanceChange.changed_at < cutoff).delete(synchronize_session=False)
+    # Workers read these within seconds; one that fell further behind flushes its caches
+    CacheInvalidation.query.filter(
+        CacheInvalidation.changed_at < datetime.now() - timedelta(days=1)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return {'entries_pruned': deleted, 'oldest_seq': oldest_feed_seq()}
+
+# Analytics cache
+class AnalyticsCache:
+    """Keyed cache of analytics payloads, invalidated by dependency tags.
+    
+    Each entry depends on tags such as 'course:3', 'instructor:2' or 'all'.
+    invalidate() drops exactly the entries depending on the given tags, plus
+    the 'all' entries (institution-wide numbers depend on every course). A
+    generation counter stops a computation that overlapped an invalidation
+    from storing its now-stale result.
+    """
+    
+    def __init__(self, max_entries=1000):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.tag_index = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'invalidated': 0}
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['hits'] += 1
+            return entry
+    
+    def set(self, key, value, tags, generation, source=None):
+        with self.lock:
+            if generation != self.generation:
+                return
+            if len(self.entries) >= self.max_entries:
+                self._remove(next(iter(self.entries)))
+            self.entries[key] = {'value': value, 'tags': tags, 'source': source}
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+    
+    def invalidate(self, *tags):
+        with self.lock:
+            self.generation += 1
+            keys = set(self.tag_index.get('all', ()))
+            for tag in tags:
+                keys.update(self.tag_index.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            self.counters['invalidated'] += len(keys)
+    
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.counters['invalidated'] += len(self.entries)
+            self.entries.clear()
+            self.tag_index.clear()
+    
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry['tags']:
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries))
+
+def invalidate_course_analytics(*courses):
+    """Drop cached analytics that include any of these courses"""
+    tags = set()
+    for course in courses:
+        tags.add(f'course:{course.id}')
+        tags.add(f'instructor:{course.instructor_id}')
+    current_app.extensions['analytics_cache'].invalidate(*tags)
+
+def analytics_scope():
+    """Cache scope and dependency tags for the logged-in user's analytics"""
+    if flask_session['role'] == 'admin':
+        return 'admin', None, {'all'}
+    user_id = flask_session['user_id']
+    return f'instructor:{user_id}', user_id, {f'instructor:{user_id}'}
+
+def cached_analytics(key, tags, compute):
+    """Cached result of compute(reader); entries remember which data source they came from"""
+    refresh_stale_report_snapshot()
+    sync_caches()
+    cache = current_app.extensions['analytics_cache']
+    entry = cache.get(key)
+    if entry is not None:
+        g.report_source = entry['source']
+        return entry['value']
+    # Taken before the reader: a snapshot refresh finishing meanwhile stops the result being stored
+    generation = cache.generation
+    with report_reader() as reader:
+        value = compute(reader)
+    cache.set(key, value, report_tags(tags), generation, g.report_source)
+    return value
+
+def report_tags(tags):
+    """Results read from a snapshot also expire when the snapshot is refreshed"""
+    return tags | {'snapshot'} if g.report_source[0] == 'snapshot' else tags
+
+def start_of_day(days_ago=0):
+    return datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days_ago)
+
+def compute_dashboard_analytics(reader, instructor_id):
+    course_filter = [] if instructor_id is None else [Course.instructor_id == instructor_id]
+    scoped_sessions = db.select(Session.id).join(Course, Session.course_id == Course.id).where(*course_filter)
+    session_filter = [] if instructor_id is None else [Session.id.in_(scoped_sessions)]
+    attendance_filter = [] if instructor_id is None else [Attendance.session_id.in_(scoped_sessions)]
+    
+    # Get overall statistics
+    total_courses = reader.query(Course).filter(Course.is_active == True, *course_filter).count()
+    total_sessions = reader.query(Session).filter(*session_filter).count()
+    total_attendances = reader.query(Attendance).filter(Attendance.entry_time.isnot(None), *attendance_filter).count()
+    active_sessions = reader.query(Session).filter(Session.is_active == True, *session_filter).count()
+    
+    # Recent activity counts whole days so the result is stable between writes:
+    # today and the six days before it, never more than the original rolling week
+    week_ago = start_of_day(6)
+    recent_attendances = reader.query(Attendance).filter(
+        Attendance.entry_time >= week_ago, *attendance_filter
+    ).count()
+    
+    # Get top courses by attendance - fixed join ambiguity
+    top_courses_result = reader.query(
+        Course.name, 
+        Course.course_code,
+        db.func.count(Attendance.id).label('attendance_count')
+    ).select_from(Course).join(
+        Session, Course.id == Session.course_id
+    ).join(
+        Attendance, Session.id == Attendance.session_id
+    ).filter(
+        Attendance.entry_time.isnot(None), *course_filter
+    ).group_by(Course.id, Course.name, Course.course_code).order_by(
+        db.func.count(Attendance.id).desc()
+    ).limit(5).all()
+    
+    # Get attendance trends (last 30 days)
+    thirty_days_ago = start_of_day(30)
+    attendance_trends = reader.query(
+        db.func.date(Attendance.entry_time).label('date'),
+        db.func.count(Attendance.id).label('count')
+    ).filter(
+        Attendance.entry_time >= thirty_days_ago,
+        Attendance.entry_time.isnot(None),
+        *attendance_filter
+    ).group_by(
+        db.func.date(Attendance.entry_time)
+    ).order_by('date').all()
+    
+    return {
+        'overview': {
+            'total_courses': total_courses,
+            'total_sessions': total_sessions,
+            'total_attendances': total_attendances,
+            'active_sessions': active_sessions,
+            'recent_attendances': recent_attendances
+        },
+        'top_courses': [
+            {
+                'name': course[0],
+                'code': course[1] if course[1] else 'N/A',
+                'attendance_count': course[2]
+            } for course in top_courses_result
+        ],
+        'attendance_trends': [
+            {
+                'date': str(trend[0]) if trend[0] else 'N/A',
+                'count': trend[1]
+            } for trend in attendance_trends
+        ]
+    }
+
+# Analytics endpoints
+@bp.route('/api/analytics/dashboard', methods=['GET'])
+@login_required()
+def analytics_dashboard():
+    try:
+        scope, instructor_id, tags = analytics_scope()
+        # The date is part of the key so day-relative windows roll over at midnight
+        key = ('dashboard', scope, start_of_day())
+        return jsonify(cached_analytics(key, tags, lambda reader: compute_dashboard_analytics(reader, instructor_id)))
+    except Exception as e:
+        print(f"Analytics error: {str(e)}")
+        return jsonify({'error': 'Failed to fetch analytics data'}), 500
+
+def compute_course_analytics(reader, course):
+    course_id = course.id
+    
+    # Get course sessions
+    sessions = reader.query(Session).filter_by(course_id=course_id).all()
+    
+    # Get attendance statistics - fixed join syntax (only count those who checked in)
+    total_attendances = reader.query(Attendance).select_from(Attendance).join(
+        Session, Attendance.session_id == Session.id
+    ).filter(
+        Session.course_id == course_id,
+        Attendance.entry_time.isnot(None)
+    ).count()
+    
+    # Get unique students - fixed join syntax (only count those who checked in)
+    unique_students = reader.query(
+        Attendance.name, Attendance.surname
+    ).select_from(Attendance).join(
+        Session, Attendance.session_id == Session.id
+    ).filter(
+        Session.course_id == course_id,
+        Attendance.entry_time.isnot(None)
+    ).distinct().count()
+    
+    # Stored statuses, set when each session closed
+    status_rows = reader.query(
+        Attendance.session_id, Attendance.status, db.func.count(Attendance.id)
+    ).select_from(Attendance).join(
+        Session, Attendance.session_id == Session.id
+    ).filter(
+        Session.course_id == course_id
+    ).group_by(Attendance.session_id, Attendance.status).all()
+    status_by_session = {}
+    status_breakdown = {}
+    for session_id, status, count in status_rows:
+        status = status or 'present'
+        status_by_session.setdefault(session_id, {})[status] = count
+        status_breakdown[status] = status_breakdown.get(status, 0) + count
+    
+    # Session attendance rates
+    session_stats = []
+    for session in sessions:
+        statuses = status_by_session.get(session.id, {})
+        session_stats.append({
+            'session_name': session.session_name or f'Session {session.id}',
+            'date': session.session_date.isoformat() if session.session_date else None,
+            'attendance_count': sum(statuses.values()) - statuses.get('absent', 0),
+            'status_counts': statuses,
+            'is_active': session.is_active
+        })
+    
+    return {
+        'instructor_id': course.instructor_id,
+        'payload': {
             'course': {
                 'name': course.name,
                 'code': course.course_code or 'N/A',
@@ -1166,57 +3707,98 @@ def course_analytics(course_id):
                 'total_sessions': len(sessions),
                 'total_attendances': total_attendances,
                 'unique_students': unique_students,
-                'average_attendance': round(total_attendances / len(sessions), 2) if sessions else 0
+                'average_attendance': round(total_attendances / len(sessions), 2) if sessions else 0,
+                'status_breakdown': status_breakdown
             },
             'sessions': session_stats
-        })
+        }
+    }
+
+@bp.route('/api/analytics/course/<int:course_id>', methods=['GET'])
+@login_required()
+def course_analytics(course_id):
+    try:
+        user_id = flask_session['user_id']
+        role = flask_session['role']
+        key = ('course', course_id)
+        
+        # Cached entries remember the owner, so permission checks need no query
+        refresh_stale_report_snapshot()
+        sync_caches()
+        cache = current_app.extensions['analytics_cache']
+        entry = cache.get(key)
+        if entry is None:
+            course = db.session.get(Course, course_id)
+            if not course:
+                return jsonify({'error': 'Course not found'}), 404
+            generation = cache.generation
+            with report_reader() as reader:
+                result = compute_course_analytics(reader, course)
+            cache.set(key, result, report_tags({f'course:{course_id}'}), generation, g.report_source)
+        else:
+            g.report_source = entry['source']
+            result = entry['value']
+        
+        # Check permissions
+        if role != 'admin' and result['instructor_id'] != user_id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        return jsonify(result['payload'])
     except Exception as e:
         print(f"Course analytics error: {str(e)}")
         return jsonify({'error': 'Failed to fetch course analytics'}), 500
 
+def compute_simple_analytics(reader, instructor_id):
+    course_filter = [] if instructor_id is None else [Course.instructor_id == instructor_id]
+    scoped_sessions = db.select(Session.id).join(Course, Session.course_id == Course.id).where(*course_filter)
+    session_filter = [] if instructor_id is None else [Session.id.in_(scoped_sessions)]
+    attendance_filter = [] if instructor_id is None else [Attendance.session_id.in_(scoped_sessions)]
+    
+    # Basic counts
+    total_courses = reader.query(Course).filter(*course_filter).count()
+    total_sessions = reader.query(Session).filter(*session_filter).count()
+    total_attendances = reader.query(Attendance).filter(Attendance.entry_time.isnot(None), *attendance_filter).count()
+    
+    # Recent sessions (last 10) with entry/exit counts
+    recent_sessions = reader.query(
+        Session.session_name, 
+        Course.name.label('course_name'),
+        Session.session_date,
+        db.func.count(db.case((Attendance.entry_time.isnot(None), Attendance.id))).label('checked_in_count'),
+        db.func.count(db.case((Attendance.exit_time.isnot(None), Attendance.id))).label('checked_out_count')
+    ).select_from(Session).join(
+        Course, Session.course_id == Course.id
+    ).outerjoin(
+        Attendance, Session.id == Attendance.session_id
+    ).filter(*course_filter).group_by(Session.id).order_by(
+        Session.session_date.desc()
+    ).limit(10).all()
+    
+    return {
+        'success': True,
+        'basic_stats': {
+            'total_courses': total_courses,
+            'total_sessions': total_sessions,
+            'total_attendances': total_attendances
+        },
+        'recent_sessions': [
+            {
+                'session_name': session[0] or 'Unnamed Session',
+                'course_name': session[1],
+                'date': session[2].isoformat() if session[2] else 'N/A',
+                'checked_in_count': session[3] or 0,
+                'checked_out_count': session[4] or 0
+            } for session in recent_sessions
+        ]
+    }
+
 # Simple analytics endpoint as fallback
-@app.route('/api/analytics/simple', methods=['GET'])
+@bp.route('/api/analytics/simple', methods=['GET'])
 @login_required()
 def simple_analytics():
     """Simplified analytics that always works"""
     try:
-        # Basic counts
-        total_courses = Course.query.count()
-        total_sessions = Session.query.count()
-        total_attendances = Attendance.query.count()
-        
-        # Recent sessions (last 10) with entry/exit counts
-        recent_sessions = db.session.query(
-            Session.session_name, 
-            Course.name.label('course_name'),
-            Session.session_date,
-            db.func.count(db.case([(Attendance.entry_time.isnot(None), Attendance.id)])).label('checked_in_count'),
-            db.func.count(db.case([(Attendance.exit_time.isnot(None), Attendance.id)])).label('checked_out_count')
-        ).select_from(Session).join(
-            Course, Session.course_id == Course.id
-        ).outerjoin(
-            Attendance, Session.id == Attendance.session_id
-        ).group_by(Session.id).order_by(
-            Session.session_date.desc()
-        ).limit(10).all()
-        
-        return jsonify({
-            'success': True,
-            'basic_stats': {
-                'total_courses': total_courses,
-                'total_sessions': total_sessions,
-                'total_attendances': total_attendances
-            },
-            'recent_sessions': [
-                {
-                    'session_name': session[0] or 'Unnamed Session',
-                    'course_name': session[1],
-                    'date': session[2].isoformat() if session[2] else 'N/A',
-                    'checked_in_count': session[3] or 0,
-                    'checked_out_count': session[4] or 0
-                } for session in recent_sessions
-            ]
-        })
+        scope, instructor_id, tags = analytics_scope()
+        return jsonify(cached_analytics(('simple', scope), tags, lambda reader: compute_simple_analytics(reader, instructor_id)))
     except Exception as e:
         print(f"Simple analytics error: {str(e)}")
         return jsonify({
@@ -1230,17 +3812,786 @@ def simple_analytics():
             'recent_sessions': []
         })
 
-if __name__ == '__main__':
-    # Initialize database on startup
+@bp.route('/api/analytics/cache', methods=['GET'])
+@login_required(role='admin')
+def analytics_cache_stats():
+    stats = current_app.extensions['analytics_cache'].stats()
+    coherence = current_app.extensions.get('coherence')
+    if coherence is not None:
+        stats['coherence'] = coherence.stats()
+    return jsonify(stats)
+
+# Cache coherence across workers
+COHERENCE_MAX_BATCH = 10000
+COHERENCE_LOGS = ('attendance_changes', 'cache_invalidations')
+
+class CacheCoherence:
+    """Tells this worker which cached data other workers have changed.
+    
+    Workers share nothing but the database file, so the file is the broadcast
+    channel. Triggers log attendance writes to attendance_changes and session,
+    course and roster writes to cache_invalidations. poll() first reads PRAGMA
+    data_version on a private connection. That value only moves when another
+    connection commits, so an idle database costs one PRAGMA. Otherwise it reads
+    the log entries past its last position. If entries were missed, because the
+    logs were pruned past that position or more than COHERENCE_MAX_BATCH
+    arrived, it asks for a full flush instead. The first poll has no position
+    yet: it starts at the end of the logs and flushes too.
+    """
+    
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self.connection = None
+        self.data_version = None
+        self.positions = None  # last attendance_changes seq, last cache_invalidations seq
+        self.lock = threading.RLock()
+        self.counters = {'polls': 0, 'changed': 0, 'entries': 0, 'flushes': 0}
+    
+    def poll(self):
+        """(attendance changes, invalidations) since the last poll, 'flush', or None when nothing changed"""
+        import sqlite3
+        with self.lock:
+            self.counters['polls'] += 1
+            if self.connection is None:
+                self.connection = sqlite3.connect(self.database_path, isolation_level=None, check_same_thread=False)
+                self.connection.row_factory = sqlite3.Row
+            version = self.connection.execute('PRAGMA data_version').fetchone()[0]
+            if version == self.data_version:
+                return None
+            self.data_version = version
+            self.counters['changed'] += 1
+            try:
+                if self.positions is None:
+                    # Start from the end of the logs. Whatever was cached before this first
+                    # poll, such as a session this worker just created and counts as
+                    # complete, may have missed other workers' writes, so flush it once
+                    self.positions = tuple(self.connection.execute(
+                        'SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = ?), 0)', (table,)
+                    ).fetchone()[0] for table in COHERENCE_LOGS)
+                    return 'flush'
+                batches = [
+                    self.connection.execute(
+                        f'SELECT * FROM {table} WHERE seq > ? ORDER BY seq LIMIT ?', (after, COHERENCE_MAX_BATCH + 1)
+                    ).fetchall()
+                    for table, after in zip(COHERENCE_LOGS, self.positions)
+                ]
+            except sqlite3.OperationalError:
+                return None  # logs not created yet
+            if not any(batches):
+                return None
+            missed = False
+            positions = []
+            for table, rows, after in zip(COHERENCE_LOGS, batches, self.positions):
+                if rows and (rows[0]['seq'] != after + 1 or len(rows) > COHERENCE_MAX_BATCH):
+                    missed = True
+                    after = self.connection.execute(f'SELECT MAX(seq) FROM {table}').fetchone()[0]
+                elif rows:
+                    after = rows[-1]['seq']
+                positions.append(after)
+            self.positions = tuple(positions)
+            if missed:
+                self.counters['flushes'] += 1
+                return 'flush'
+            self.counters['entries'] += sum(len(rows) for rows in batches)
+            return batches
+    
+    def attendance_rows(self, attendance_ids):
+        """Current state of changed attendance rows, for presence and the proxy detector"""
+        with self.lock:
+            return self.connection.execute(
+                f'SELECT id, session_id, student_key, name, surname, student_id, ip_address, user_agent, '
+                f'entry_time, exit_time FROM attendances WHERE id IN ({",".join("?" * len(attendance_ids))})',
+                list(attendance_ids)
+            ).fetchall()
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+def sync_caches():
+    """Expire what other workers' writes made stale in this worker's caches"""
+    coherence = current_app.extensions.get('coherence')
+    if coherence is None:
+        return
+    # Held while applying too, so student_presence() can load a session between two syncs
+    with coherence.lock:
+        changes = coherence.poll()
+        if changes is None:
+            return
+        analytics_cache = current_app.extensions['analytics_cache']
+        roster_index = current_app.extensions['roster_index']
+        detector = current_app.extensions['proxy_detector']
+        presence = current_app.extensions['presence']
+        if changes == 'flush':
+            analytics_cache.clear()
+            roster_index.clear()
+            detector.clear()
+            presence.clear()
+            return
+        attendance_changes, invalidations = changes
+        tags = set()
+        changed_rows = []
+        for change in attendance_changes:
+            if change['course_id'] is not None:
+                tags.add(f"course:{change['course_id']}")
+            if change['op'] == 'delete':
+                # Rows only go away with their session; reload it if it is somehow still scanned
+                presence.forget(change['session_id'])
+            elif detector.tracking(change['session_id']) or presence.tracking(change['session_id']):
+                changed_rows.append(change['attendance_id'])
+        for change in invalidations:
+            if change['course_id'] is not None:
+                tags.add(f"course:{change['course_id']}")
+            if change['instructor_id'] is not None:
+                tags.add(f"instructor:{change['instructor_id']}")
+            if change['source'] in ('roster', 'course'):
+                roster_index.forget(change['course_id'])
+            elif change['op'] in ('close', 'delete'):
+                detector.forget(change['session_id'])
+                presence.forget(change['session_id'])
+                roster_index.forget_tokens(change['course_id'])
+        if attendance_changes:
+            # Attendance changes carry the course; the instructor's entries depend on it too
+            course_ids = {change['course_id'] for change in attendance_changes if change['course_id'] is not None}
+            tags.update(f'instructor:{instructor_id}' for (instructor_id,) in db.session.query(Course.instructor_id).filter(
+                Course.id.in_(course_ids)
+            ).distinct())
+        if tags:
+            analytics_cache.invalidate(*tags)
+        for row in coherence.attendance_rows(changed_rows) if changed_rows else ():
+            if row['entry_time'] is None:
+                continue
+            presence.mark(row['session_id'], row['student_key'], presence_state(row['entry_time'], row['exit_time']))
+            # Silent: the worker that took each check-in raises its alert
+            if detector.tracking(row['session_id']):
+                detector.observe(row['session_id'], row['student_key'],
+                                 student_label(row['name'], row['surname'], row['student_id']),
+                                 row['ip_address'], row['user_agent'], alert=False)
+
+# Background maintenance
+def lock_file(path, blocking=True):
+    """Exclusive lock shared by every process that opens path.
+    
+    Returns a file descriptor holding the lock until it is closed, or None if
+    another process holds it and blocking is False. Without fcntl (Windows,
+    where WSGI servers such as waitress run one process) nothing is locked
+    and -1 is returned.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return -1
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+def unlock_file(fd):
+    if fd is not None and fd >= 0:
+        os.close(fd)
+
+class MaintenanceScheduler:
+    """Runs maintenance jobs at fixed intervals on a daemon thread.
+    
+    Worker processes sharing a database each have a scheduler. With lock_path
+    only the one holding that file's lock runs the shared jobs, and another
+    takes over if it exits; jobs added with every_worker run in each process.
+    """
+    
+    def __init__(self, flask_app, lock_path=None):
+        self.app = flask_app
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.lock_path = lock_path
+        self.leader_fd = None
+    
+    def add_job(self, name, interval, func, every_worker=False):
+        if interval <= 0:
+            return
+        self.jobs[name] = {
+            'func': func,
+            'interval': interval,
+            'every_worker': every_worker,
+            'next_run': time.monotonic() + interval,
+            'running': False,
+            'last_run': None,
+            'last_report': None
+        }
+    
+    def run_job(self, name):
+        """Run a single job now and return its report"""
+        job = self.jobs[name]
+        with self.lock:
+            if job['running']:
+                return {'job': name, 'skipped': 'already running'}
+            job['running'] = True
+        started = time.perf_counter()
+        try:
+            with self.app.app_context():
+                report = job['func']()
+        except Exception as e:
+            report = {'error': str(e)}
+        finally:
+            job['running'] = False
+            job['next_run'] = time.monotonic() + job['interval']
+        report['job'] = name
+        report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        job['last_run'] = datetime.now().isoformat()
+        job['last_report'] = report
+        print(f"Maintenance {name}: {report}")
+        return report
+    
+    def status(self):
+        return {
+            name: {
+                'interval_seconds': job['interval'],
+                'running': job['running'],
+                'last_run': job['last_run'],
+                'last_report': job['last_report']
+            } for name, job in self.jobs.items()
+        }
+    
+    def start(self):
+        if self.thread or not self.jobs:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name='maintenance', daemon=True)
+                self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def is_leader(self):
+        """Whether this process runs the shared jobs; retried until some worker holds the lock"""
+        if self.leader_fd is None:
+            self.leader_fd = lock_file(self.lock_path, blocking=False) if self.lock_path else -1
+        return self.leader_fd is not None
+    
+    def _loop(self):
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            leader = self.is_leader()
+            for name, job in list(self.jobs.items()):
+                if job['next_run'] <= now and not job['running'] and (leader or job['every_worker']):
+                    self.run_job(name)
+            upcoming = min(job['next_run'] for job in self.jobs.values())
+            self.stop_event.wait(max(1.0, upcoming - time.monotonic()))
+
+def sweep_orphan_qr_codes():
+    """Delete QR images in the configured QR_CODES_DIR whose token no longer belongs to any session"""
+    batch_size = current_app.config['QR_SWEEP_BATCH_SIZE']
+    min_age = current_app.config['QR_SWEEP_MIN_AGE']
+    cutoff = time.time() - min_age
+    scanned = deleted = bytes_reclaimed = 0
+    
+    def flush(batch):
+        nonlocal deleted, bytes_reclaimed
+        tokens = [token for token, _, _ in batch]
+        referenced = set()
+        for entry_token, exit_token in db.session.query(Session.entry_token, Session.exit_token).filter(
+            db.or_(Session.entry_token.in_(tokens), Session.exit_token.in_(tokens))
+        ):
+            referenced.add(entry_token)
+            referenced.add(exit_token)
+        for token, path, size in batch:
+            if token in referenced:
+                continue
+            try:
+                os.remove(path)
+                deleted += 1
+                bytes_reclaimed += size
+            except OSError:
+                pass
+    
+    batch = []
+    with os.scandir(current_app.config['QR_CODES_DIR']) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith('.png'):
+                continue
+            token, _, kind = entry.name[:-4].rpartition('_')
+            if not token or kind not in ('entry', 'exit'):
+                continue
+            stat = entry.stat()
+            # Skip files that may belong to a session still being created
+            if stat.st_mtime > cutoff:
+                continue
+            scanned += 1
+            batch.append((token, entry.path, stat.st_size))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+    if batch:
+        flush(batch)
+    
+    return {'files_scanned': scanned, 'files_deleted': deleted, 'bytes_reclaimed': bytes_reclaimed}
+
+def optimize_database():
+    """Reclaim free pages with incremental vacuum and refresh planner statistics.
+
+    Never runs a full VACUUM: that locks and rewrites the whole file. Databases
+    created before incremental mode only get ANALYZE until they are converted
+    offline with convert-incremental-vacuum.
+    """
+    pages = current_app.config['DB_VACUUM_PAGES']
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        page_size = conn.exec_driver_sql('PRAGMA page_size').scalar()
+        incremental = conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() == 2
+        freelist_before = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        if incremental:
+            conn.exec_driver_sql(f'PRAGMA incremental_vacuum({int(pages)})')
+        freelist_after = conn.exec_driver_sql('PRAGMA freelist_count').scalar()
+        conn.exec_driver_sql('ANALYZE')
+    pages_reclaimed = max(freelist_before - freelist_after, 0)
+    return {
+        'incremental_vacuum': incremental,
+        'pages_reclaimed': pages_reclaimed,
+        'bytes_reclaimed': pages_reclaimed * page_size,
+        'free_pages_remaining': freelist_after,
+        'analyzed': True
+    }
+
+@bp.cli.command('convert-incremental-vacuum')
+def convert_incremental_vacuum_command():
+    """Rebuild an older database in incremental auto-vacuum mode; stop the server first"""
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.exec_driver_sql('PRAGMA auto_vacuum').scalar() == 2:
+            print("Database already uses incremental auto-vacuum")
+            return
+        # The pragma is set on every connection; VACUUM rebuilds the file in that mode
+        conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.exec_driver_sql('VACUUM')
+    print("Database converted to incremental auto-vacuum")
+
+def expire_stale_sessions():
+    """Mark sessions inactive once their scheduled end time has passed"""
+    now = datetime.now()
+    expired = [
+        s for s in Session.query.filter_by(is_active=True).all()
+        if session_end_time(s) and session_end_time(s) <= now
+    ]
+    checked_out = classified = 0
+    for session_obj in expired:
+        result = close_session(session_obj)
+        checked_out += result['auto_checked_out']
+        classified += result['classified']
+    return {
+        'sessions_expired': len(expired),
+        'session_ids': [s.id for s in expired],
+        'attendances_auto_checked_out': checked_out,
+        'attendances_classified': classified
+    }
+
+@bp.before_app_request
+def start_maintenance():
+    """Start the scheduler with the first request, so WSGI servers that fork workers start it after the fork"""
+    if current_app.config['MAINTENANCE_ENABLED']:
+        current_app.extensions['maintenance'].start()
+
+@bp.route('/api/maintenance', methods=['GET'])
+@login_required(role='admin')
+def maintenance_status():
+    return jsonify(current_app.extensions['maintenance'].status())
+
+@bp.route('/api/maintenance/<job_name>/run', methods=['POST'])
+@login_required(role='admin')
+def run_maintenance_job(job_name):
+    maintenance = current_app.extensions['maintenance']
+    if job_name not in maintenance.jobs:
+        return jsonify({'error': 'Unknown maintenance job'}), 404
+    return jsonify(maintenance.run_job(job_name))
+
+# Online backups
+class BackupManager:
+    """Point-in-time copies of the live database taken with SQLite's online backup API.
+    
+    The copy advances pages_per_step pages at a time and pauses step_sleep
+    seconds between steps (and between compressed chunks), so a backup only
+    takes a small share of the CPU from check-ins. Under WAL the backup
+    connection holds one read transaction for the whole copy: writers are
+    not blocked and the copy is the database as of the moment it started.
+    Without WAL, SQLite restarts the copy whenever another connection writes;
+    after max_restarts the rest is copied in one step.
+    """
+    
+    def __init__(self, database_path, directory, pages_per_step, step_sleep, compress, retain, max_restarts=5):
+        self.database_path = database_path
+        self.directory = directory
+        self.pages_per_step = pages_per_step
+        self.step_sleep = step_sleep
+        self.compress = compress
+        self.retain = retain
+        self.max_restarts = max_restarts
+        self.lock = threading.Lock()
+    
+    def list(self):
+        """Finished backups, newest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        backups = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.startswith('attendance-') and entry.name.endswith(('.db', '.db.gz')):
+                    stat = entry.stat()
+                    backups.append({
+                        'name': entry.name,
+                        'bytes': stat.st_size,
+                        'created_at': datetime.fromtimestamp(stat.st_mtime).isoformat()
+                    })
+        return sorted(backups, key=lambda backup: backup['name'], reverse=True)
+    
+    def run(self):
+        """Take one backup; returns its report, or {'error': ...} with the partial files removed"""
+        import sqlite3
+        if not self.lock.acquire(blocking=False):
+            return {'skipped': 'backup already running'}
+        partials = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            name = f"attendance-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db"
+            partial = os.path.join(self.directory, name + '.partial')
+            partials.append(partial)
+            started = time.perf_counter()
+            copy = self._copy(partial)
+            copy_ms = round((time.perf_counter() - started) * 1000, 2)
+            database_bytes = os.path.getsize(partial)
+            
+            path = os.path.join(self.directory, name)
+            if self.compress:
+                path += '.gz'
+                partials.append(path + '.partial')
+                with open(partial, 'rb') as source, gzip.open(path + '.partial', 'wb', compresslevel=1) as target:
+                    while chunk := source.read(256 * 1024):
+                        target.write(chunk)
+                        time.sleep(self.step_sleep)
+                os.remove(partial)
+                partial = path + '.partial'
+            # Only finished backups get their final name
+            os.replace(partial, path)
+            partials.clear()
+            
+            return {
+                'backup': os.path.basename(path),
+                'database_bytes': database_bytes,
+                'backup_bytes': os.path.getsize(path),
+                'copy_ms': copy_ms,
+                **copy,
+                'pruned': self.prune()
+            }
+        except (OSError, sqlite3.Error) as e:
+            # e.g. disk full: leave no half-written file behind
+            for leftover in partials:
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+            return {'error': f'Backup failed: {e}'}
+        finally:
+            self.lock.release()
+    
+    def _copy(self, target_path):
+        import sqlite3
+        progress = {'steps': 0, 'restarts': 0, 'remaining': None}
+        
+        def on_progress(status, remaining, total):
+            progress['steps'] += 1
+            # Remaining pages only grow when SQLite restarted the copy
+            if progress['remaining'] is not None and remaining > progress['remaining']:
+                progress['restarts'] += 1
+                if progress['restarts'] > self.max_restarts:
+                    raise InterruptedError('backup restarted too often')
+            progress['remaining'] = remaining
+            # backup(sleep=...) only waits on busy errors, so pace the steps here
+            time.sleep(self.step_sleep)
+        
+        source = sqlite3.connect(self.database_path, isolation_level=None)
+        try:
+            if source.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+                # Pin one snapshot; other connections' commits then never restart the copy
+                source.execute('BEGIN')
+                source.execute('SELECT count(*) FROM sqlite_master').fetchone()
+            target = sqlite3.connect(target_path)
+            try:
+                source.backup(target, pages=self.pages_per_step, progress=on_progress)
+                incremental = True
+            except InterruptedError:
+                source.backup(target)
+                incremental = False
+            finally:
+                target.close()
+        finally:
+            source.close()
+        return {'steps': progress['steps'], 'restarts': progress['restarts'], 'incremental': incremental}
+    
+    def prune(self):
+        """Delete the oldest backups beyond the retention count (0 keeps everything)"""
+        if self.retain <= 0:
+            return []
+        pruned = []
+        for backup in self.list()[self.retain:]:
+            try:
+                os.remove(os.path.join(self.directory, backup['name']))
+                pruned.append(backup['name'])
+            except OSError:
+                pass
+        return pruned
+
+def scheduled_backup():
+    return current_app.extensions['backups'].run()
+
+@bp.route('/api/backups', methods=['GET'])
+@login_required(role='admin')
+def list_backups():
+    backups = current_app.extensions.get('backups')
+    if backups is None:
+        return jsonify({'error': 'Backups need a file-backed SQLite database'}), 400
+    return jsonify({'directory': backups.directory, 'backups': backups.list()})
+
+@bp.route('/api/backups', methods=['POST'])
+@login_required(role='admin')
+def create_backup():
+    backups = current_app.extensions.get('backups')
+    if backups is None:
+        return jsonify({'error': 'Backups need a file-backed SQLite database'}), 400
+    report = backups.run()
+    if 'skipped' in report:
+        return jsonify(report), 409
+    if 'error' in report:
+        return jsonify(report), 500
+    return jsonify(report), 201
+
+# Sampling profiler
+# Nothing is installed while no profile is running: no trace hooks, no timers, no
+# per-request work. A profile request samples every thread's Python stack with
+# sys._current_frames from its own thread and returns the stacks in the collapsed
+# format read by flamegraph.pl, speedscope and similar tools. Samples are wall-clock,
+# so time waiting on SQLite's write lock or a slow query shows up too. Native code
+# is charged to the Python frame that called it, e.g. sqlite3 to SQLAlchemy's do_execute.
+PROFILE_DEFAULT_INTERVAL = 0.005
+
+class SamplingProfiler:
+    """Collects stack samples from the threads of this worker process, one profile at a time"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.paths = {}
+        self.labels = {}
+    
+    def sample(self, seconds, interval, all_threads=False):
+        """Sample for seconds; returns None while another profile is running"""
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            own = threading.get_ident()
+            request_root = Flask.wsgi_app.__code__
+            stacks = {}
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own:
+                        continue
+                    codes = []
+                    while frame is not None:
+                        codes.append(frame.f_code)
+                        frame = frame.f_back
+                    codes.reverse()
+                    # Request threads start at Flask's WSGI entry point, below the server's own frames
+                    if request_root in codes:
+                        codes = codes[codes.index(request_root):]
+                    elif not all_threads:
+                        continue
+                    key = tuple(codes)
+                    stacks[key] = stacks.get(key, 0) + 1
+                samples += 1
+                time.sleep(interval)
+            return samples, stacks
+        finally:
+            self.lock.release()
+    
+    def path(self, code):
+        """Source file relative to site-packages, or just its name for the app and the stdlib"""
+        path = self.paths.get(code.co_filename)
+        if path is None:
+            path = code.co_filename.replace(os.sep, '/')
+            path = self.paths[code.co_filename] = (
+                path.rsplit('site-packages/', 1)[1] if 'site-packages/' in path else os.path.basename(path)
+            )
+        return path
+    
+    def label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            # co_qualname (Class.method) is Python 3.11+; older versions get the bare name
+            name = getattr(code, 'co_qualname', code.co_name)
+            label = self.labels[code] = f'{name} ({self.path(code)})'
+        return label
+    
+    def collapsed(self, stacks):
+        """One 'frame;frame;frame count' line per distinct stack, root first"""
+        lines = [f"{';'.join(self.label(code) for code in codes)} {count}" for codes, count in stacks.items()]
+        lines.sort()
+        return '\n'.join(lines) + '\n' if lines else ''
+
+def profile_summary(profiler, stacks):
+    """Samples per view function and per package of the innermost frame"""
+    views = {inspect.unwrap(view).__code__: endpoint.rsplit('.', 1)[-1]
+             for endpoint, view in current_app.view_functions.items()}
+    handlers = {}
+    packages = {}
+    for codes, count in stacks.items():
+        handler = next((views[code] for code in codes if code in views), None)
+        if handler:
+            handlers[handler] = handlers.get(handler, 0) + count
+        package = profiler.path(codes[-1]).split('/', 1)[0]
+        if package.endswith('.py'):
+            package = package[:-3]
+        packages[package] = packages.get(package, 0) + count
+    by_count = lambda totals: dict(sorted(totals.items(), key=lambda item: -item[1]))
+    return by_count(handlers), by_count(packages)
+
+@bp.route('/api/profile', methods=['POST'])
+@login_required(role='admin')
+def run_profile():
+    """Samples this worker's threads for ?seconds= and returns collapsed stacks.
+    
+    interval is in milliseconds. Only threads serving a request are sampled unless
+    all_threads=1. format=json adds sample counts per handler and per package.
+    """
+    seconds = request.args.get('seconds', 10, type=float)
+    if not 0 < seconds <= current_app.config['PROFILER_MAX_SECONDS']:
+        return jsonify({'error': f"seconds must be between 0 and {current_app.config['PROFILER_MAX_SECONDS']:g}"}), 400
+    interval = max(request.args.get('interval', PROFILE_DEFAULT_INTERVAL * 1000, type=float), 1) / 1000
+    profiler = current_app.extensions['profiler']
+    result = profiler.sample(seconds, interval, request.args.get('all_threads') == '1')
+    if result is None:
+        return jsonify({'error': 'A profile is already running in this worker'}), 409
+    samples, stacks = result
+    if request.args.get('format') == 'json':
+        handlers, packages = profile_summary(profiler, stacks)
+        return jsonify({
+            'pid': os.getpid(),
+            'seconds': seconds,
+            'interval_ms': interval * 1000,
+            'samples': samples,
+            'thread_samples': sum(stacks.values()),
+            'handlers': handlers,
+            'packages': packages,
+            'collapsed': profiler.collapsed(stacks)
+        })
+    from flask import Response
+    return Response(
+        profiler.collapsed(stacks),
+        mimetype='text/plain',
+        headers={'X-Profile-Samples': str(samples), 'X-Profile-Pid': str(os.getpid())}
+    )
+
+# Application factory
+def create_app(config=None):
+    """Build the Flask application; config overrides the environment defaults"""
+    app = Flask(__name__, static_folder='../frontend', static_url_path='')
+    app.json = AttendanceJSONProvider(app)
+    load_config(app)
+    if config:
+        app.config.update(config)
+    
+    if app.config['TRUSTED_PROXY_COUNT']:
+        # remote_addr must be the student's address: admission limits and proxy detection key on it
+        from werkzeug.middleware.proxy_fix import ProxyFix
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+    
+    db.init_app(app)
+    CORS(app)
+    os.makedirs(app.config['QR_CODES_DIR'] or DEFAULT_QR_CODES_DIR, exist_ok=True)
+    
+    app.extensions['admission'] = AdmissionController(
+        app.config['ADMISSION_IP_BURST'],
+        app.config['ADMISSION_IP_RATE'],
+        app.config['ADMISSION_SESSION_BURST'],
+        app.config['ADMISSION_SESSION_RATE'],
+        app.config['ADMISSION_RESERVE']
+    )
+    app.extensions['proxy_detector'] = ProxyDetector(app.config['PROXY_DEVICE_THRESHOLD'], app.config['PROXY_IP_THRESHOLD'])
+    app.extensions['presence'] = PresenceTracker()
+    app.extensions['roster_index'] = RosterIndex(app.config['ROSTER_INDEX_MAX_AGE'])
+    app.extensions['analytics_cache'] = AnalyticsCache()
+    app.extensions['qr_sheets'] = QRSheetRenderer(app.config['QR_SHEET_WORKERS'])
+    # Stop the render processes with the server instead of leaving them to be reaped
+    atexit.register(app.extensions['qr_sheets'].shutdown)
+    app.extensions['profiler'] = SamplingProfiler()
+    with app.app_context():
+        # Snapshots, backups and cache coherence need a database file
+        database_path = None
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', set_sqlite_pragmas)
+            if db.engine.url.database not in (None, '', ':memory:'):
+                database_path = db.engine.url.database
+    if database_path and app.config['CACHE_COHERENCE_ENABLED']:
+        app.extensions['coherence'] = CacheCoherence(database_path)
+    maintenance = MaintenanceScheduler(app, database_path and database_path + '.maintenance-lock')
+    if app.config['QR_CODES_DIR']:
+        # Never swept by default: the shared qr_codes/ may hold images of another database
+        maintenance.add_job('qr_sweep', app.config['QR_SWEEP_INTERVAL'], sweep_orphan_qr_codes)
+    maintenance.add_job('db_optimize', app.config['DB_OPTIMIZE_INTERVAL'], optimize_database)
+    maintenance.add_job('session_expiry', app.config['SESSION_EXPIRY_INTERVAL'], expire_stale_sessions)
+    maintenance.add_job('change_feed_prune', app.config['CHANGE_FEED_PRUNE_INTERVAL'], prune_change_feed)
+    if app.config['REPORT_SNAPSHOT_ENABLED']:
+        if database_path:
+            app.extensions['report_snapshot'] = ReportSnapshot(database_path, app.config['REPORT_SNAPSHOT_MAX_AGE'])
+            # Snapshots belong to one process, so every worker refreshes its own
+            maintenance.add_job('report_snapshot', app.config['REPORT_SNAPSHOT_INTERVAL'], refresh_report_snapshot,
+                                every_worker=True)
+        else:
+            print("Reporting mode needs a file-backed SQLite database; reports will read live data")
+    if database_path:
+        app.extensions['backups'] = BackupManager(
+            database_path,
+            app.config['BACKUP_DIR'] or os.path.join(os.path.dirname(database_path), 'backups'),
+            app.config['BACKUP_PAGES_PER_STEP'],
+            app.config['BACKUP_STEP_SLEEP'],
+            app.config['BACKUP_COMPRESS'],
+            app.config['BACKUP_RETAIN']
+        )
+        maintenance.add_job('db_backup', app.config['BACKUP_INTERVAL'], scheduled_backup)
+    app.extensions['maintenance'] = maintenance
+    
+    app.register_blueprint(bp)
+    if app.config['DB_INIT_ON_START']:
+        # Workers of one server start together; the first creates or upgrades the schema
+        init_lock = lock_file(database_path + '.init-lock') if database_path else -1
+        try:
+            init_db(app)
+        finally:
+            unlock_file(init_lock)
+    return app
+
+@bp.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the database schema and the default users"""
     init_db()
-    print("\n" + "="*60)
-    print("🎓 QR ATTENDANCE SYSTEM - ENHANCED VERSION 🎓")
-    print("="*60)
-    print(f"Frontend: http://localhost:5000")
-    print(f"LAN Access: http://{get_lan_ip()}:5000")
-    print("\n📚 Default Login Credentials:")
-    print("👨‍💼 Admin: username=admin, password=admin123")
-    print("👨‍🏫 Instructor: username=instructor, password=instructor123")
-    print("📱 Students: NO LOGIN - Only QR Code Access")
-    print("="*60 + "\n")
-    app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
+
+if __name__ == '__main__':
+    # With the debug reloader the parent process only watches files; the
+    # child (WERKZEUG_RUN_MAIN) serves requests, so only it touches the database
+    serving = os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    app = create_app(None if serving else {'DB_INIT_ON_START': False})
+    if serving:
+        if app.config['MAINTENANCE_ENABLED']:
+            app.extensions['maintenance'].start()
+    else:
+        print("\n" + "="*60)
+        print("🎓 QR ATTENDANCE SYSTEM - ENHANCED VERSION 🎓")
+        print("="*60)
+        print(f"Frontend: http://localhost:5000")
+        print(f"LAN Access: http://{get_lan_ip()}:5000")
+        print("\n📚 Default Login Credentials:")
+        print("👨‍💼 Admin: username=admin, password=admin123")
+        print("👨‍🏫 Instructor: username=instructor, password=instructor123")
+        print("📱 Students: NO LOGIN - Only QR Code Access")
+        print("="*60 + "\n")
+    app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,95 @@
+"""Check-in latency with and without an online backup running.
+
+Seeds a throwaway SQLite database with N attendance rows (so the backup has
+real work to do), then posts check-ins through /attend/entry and reports
+latency percentiles twice:
+
+  idle           nothing else running
+  during backup  BackupManager.run() looping on a background thread
+
+Usage: python benchmarks/bench_backup.py [rows] [check-ins]
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+CHECKINS = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(db_dir, "bench.db")}'
+os.environ['MAINTENANCE_ENABLED'] = '0'
+os.environ['DB_INIT_ON_START'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import app as attendance_app  # noqa: E402
+from app import db, Attendance, Course, Session, User  # noqa: E402
+
+app = attendance_app.create_app({'ADMISSION_IP_BURST': 1e9, 'ADMISSION_SESSION_BURST': 1e9})
+
+
+def seed():
+    db.create_all()
+    db.session.execute(db.insert(User), [{'username': 'bench', 'password_hash': 'x', 'role': 'admin'}])
+    db.session.execute(db.insert(Course), [{'name': 'Bench 101', 'instructor_id': 1}])
+    now = attendance_app.datetime.now()
+    db.session.execute(db.insert(Session), [
+        {'course_id': 1, 'entry_token': 'archive', 'exit_token': 'archive-exit', 'session_date': now, 'is_active': False},
+        {'course_id': 1, 'entry_token': 'live', 'exit_token': 'live-exit', 'session_date': now, 'is_active': True}
+    ])
+    for start in range(0, ROWS, 50_000):
+        db.session.execute(db.insert(Attendance), [
+            {
+                'session_id': 1,
+                'name': f'Student{i}',
+                'surname': 'Archive',
+                'student_id': str(i),
+                'ip_address': '10.0.0.1',
+                'user_agent': 'bench',
+                'course_name': 'Bench 101',
+                'entry_time': now
+            } for i in range(start, min(start + 50_000, ROWS))
+        ])
+    db.session.commit()
+
+
+def check_ins(client, label, offset):
+    latencies = []
+    for i in range(offset, offset + CHECKINS):
+        started = time.perf_counter()
+        response = client.post('/attend/entry/live', data={'name': f'N{i}', 'surname': 'Live', 'student_id': f'L{i}'},
+                                environ_base={'REMOTE_ADDR': f'10.1.{i // 250}.{i % 250}'})
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.status_code
+    latencies.sort()
+    p = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)]
+    print(f'{label:<14} p50 {p(0.5):6.2f} ms   p95 {p(0.95):6.2f} ms   p99 {p(0.99):6.2f} ms   '
+          f'max {latencies[-1]:7.2f} ms   mean {statistics.fmean(latencies):6.2f} ms')
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        seed()
+    backups = app.extensions['backups']
+    print(f'{ROWS} rows, database {os.path.getsize(backups.database_path) / 2**20:.1f} MiB, '
+          f'{backups.pages_per_step} pages per step, compress={backups.compress}')
+    client = app.test_client()
+    check_ins(client, 'idle', 0)
+
+    stop = threading.Event()
+    reports = []
+
+    def backup_loop():
+        while not stop.is_set():
+            with app.app_context():
+                reports.append(backups.run())
+
+    thread = threading.Thread(target=backup_loop)
+    thread.start()
+    check_ins(client, 'during backup', CHECKINS)
+    stop.set()
+    thread.join()
+    print(f'{len(reports)} backups during the run, last: {reports[-1]}')
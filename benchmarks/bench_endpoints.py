@@ -0,0 +1,116 @@
+"""Latency of every analytics, listing and export endpoint on a large dataset.
+
+Runs against a database made by generate_dataset.py (generating one with the
+default sizes first if DATABASE does not exist). Each endpoint is requested
+as the admin and as the instructor who owns the busiest course, RUNS times
+cold (analytics cache emptied before every request) and RUNS times warm, and
+the median of each is reported with the response size. Streaming exports are
+timed until the last byte.
+
+Usage: python benchmarks/bench_endpoints.py [--database PATH] [--runs N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default=os.path.join('instance', 'synthetic.db'))
+    parser.add_argument('--runs', type=int, default=3)
+    return parser.parse_args(argv)
+
+
+def pick_targets(db):
+    """The busiest course, its busiest session and a student enrolled in many courses"""
+    course_id, instructor = db.session.execute(db.text(
+        'SELECT c.id, u.username FROM courses c JOIN users u ON u.id = c.instructor_id '
+        'JOIN sessions s ON s.course_id = c.id GROUP BY c.id ORDER BY c.max_students * COUNT(s.id) DESC LIMIT 1'
+    )).one()
+    session_id = db.session.execute(db.text(
+        'SELECT session_id FROM attendances WHERE session_id IN (SELECT id FROM sessions WHERE course_id = :c) '
+        'GROUP BY session_id ORDER BY COUNT(*) DESC LIMIT 1'
+    ), {'c': course_id}).scalar()
+    student_id = db.session.execute(db.text(
+        'SELECT student_id FROM course_roster WHERE course_id = :c ORDER BY '
+        '(SELECT COUNT(*) FROM course_roster r WHERE r.student_id = course_roster.student_id) DESC LIMIT 1'
+    ), {'c': course_id}).scalar()
+    return course_id, instructor, session_id, student_id
+
+
+def endpoints(course_id, session_id, student_id):
+    return [
+        '/api/bootstrap',
+        '/api/analytics/dashboard',
+        '/api/analytics/simple',
+        f'/api/analytics/course/{course_id}',
+        '/api/courses',
+        f'/api/courses/{course_id}/sessions',
+        f'/api/courses/{course_id}/roster',
+        f'/api/courses/{course_id}/matrix',
+        f'/api/courses/{course_id}/matrix/export_csv',
+        f'/api/courses/{course_id}/proxy_flags',
+        f'/api/sessions/{session_id}/export_csv',
+        f'/api/students/history?student_id={student_id}',
+        f'/api/students/history/export_csv?student_id={student_id}',
+        f'/api/attendance/search?q={student_id}',
+        '/api/attendance/search?q=ali',
+        '/api/users',
+        '/api/changes?limit=500'
+    ]
+
+
+def timed(client, url):
+    started = time.perf_counter()
+    response = client.get(url)
+    body = response.get_data()
+    return (time.perf_counter() - started) * 1000, response.status_code, len(body)
+
+
+def bench(app, client, label, urls, runs):
+    import app as attendance_app
+    print(f'\n{label}')
+    print(f'{"endpoint":<58} {"status":>6} {"bytes":>10} {"cold p50":>10} {"warm p50":>10}')
+    for url in urls:
+        cold = []
+        for _ in range(runs):
+            app.extensions['analytics_cache'] = attendance_app.AnalyticsCache()
+            elapsed, status, size = timed(client, url)
+            cold.append(elapsed)
+        warm = [timed(client, url)[0] for _ in range(runs)]
+        print(f'{url:<58} {status:>6} {size:>10} {statistics.median(cold):>8.1f}ms {statistics.median(warm):>8.1f}ms')
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    database = os.path.abspath(args.database)
+    if not os.path.exists(database):
+        import generate_dataset
+        print('generating', database)
+        print(generate_dataset.generate(database))
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ['MAINTENANCE_ENABLED'] = '0'
+
+    import app as attendance_app
+    from app import db
+
+    app = attendance_app.create_app()
+    with app.app_context():
+        counts = {table: db.session.execute(db.text(f'SELECT COUNT(*) FROM {table}')).scalar()
+                  for table in ('users', 'courses', 'sessions', 'attendances')}
+        course_id, instructor, session_id, student_id = pick_targets(db)
+    print(', '.join(f'{table}={count}' for table, count in counts.items()))
+    print(f'course {course_id} ({instructor}), session {session_id}, student {student_id}')
+
+    urls = endpoints(course_id, session_id, student_id)
+    for username, password in (('admin', 'admin123'), (instructor, 'password123')):
+        client = app.test_client()
+        response = client.post('/api/login', json={'username': username, 'password': password})
+        assert response.status_code == 200, response.get_json()
+        bench(app, client, username, urls if username == 'admin' else
+              [url for url in urls if not url.startswith(('/api/users', '/api/changes'))], args.runs)
@@ -0,0 +1,76 @@
+"""Compare peak memory of materialized vs streamed JSON for a large session list.
+
+Seeds a throwaway SQLite database with one course holding N sessions, then
+serves /api/courses/<id>/sessions two ways and reports time and the peak
+Python allocation measured by tracemalloc:
+
+  materialized  list of dicts + jsonify (how list endpoints used to respond)
+  streamed      stream_query_json, consumed chunk by chunk like a WSGI server
+
+Usage: python benchmarks/bench_json_streaming.py [rows]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(db_dir, "bench.db")}'
+os.environ['MAINTENANCE_ENABLED'] = '0'
+os.environ['DB_INIT_ON_START'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+import app as attendance_app  # noqa: E402
+from app import db, Course, Session, User, jsonify, sessions_listing_query, stream_query_json  # noqa: E402
+
+app = attendance_app.create_app()
+
+
+def seed():
+    db.create_all()
+    db.session.execute(db.insert(User), [{'username': 'bench', 'password_hash': 'x', 'role': 'admin'}])
+    db.session.execute(db.insert(Course), [{'name': 'Bench 101', 'instructor_id': 1}])
+    now = attendance_app.datetime.now()
+    db.session.execute(db.insert(Session), [
+        {
+            'course_id': 1,
+            'entry_token': f'entry{i}',
+            'exit_token': f'exit{i}',
+            'session_name': f'Session {i}',
+            'session_date': now,
+            'is_active': False
+        } for i in range(ROWS)
+    ])
+    db.session.commit()
+
+
+def materialized():
+    rows = db.session.execute(sessions_listing_query(1))
+    return len(jsonify([dict(row._mapping) for row in rows]).get_data())
+
+
+def streamed():
+    response = stream_query_json(sessions_listing_query(1))
+    return sum(len(chunk) for chunk in response.response)
+
+
+def measure(label, func):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = func()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:<13} {elapsed * 1000:9.1f} ms   peak {peak / 2**20:8.2f} MiB   body {size / 2**20:7.2f} MiB')
+
+
+if __name__ == '__main__':
+    with app.test_request_context():
+        seed()
+        provider = 'orjson' if app.json.fast else 'json'
+        print(f'{ROWS} sessions, serializer: {provider}')
+        measure('materialized', materialized)
+        measure('streamed', streamed)
@@ -0,0 +1,67 @@
+"""Measure worker cold start: module import, create_app, init_db and first requests.
+
+Each run happens in a fresh interpreter so nothing is cached between runs. The
+first run creates a throwaway database; later runs find the schema current and
+skip schema work. The script also reports which heavy modules were loaded,
+since qrcode/Pillow and bcrypt should load only when a handler needs them.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend'))
+HEAVY_MODULES = ('qrcode', 'PIL', 'bcrypt')
+
+CHILD = '''
+import json, sys, time
+heavy = lambda: [name for name in HEAVY_MODULES if name in sys.modules]
+t0 = time.perf_counter()
+sys.path.insert(0, BACKEND_DIR)
+import app as attendance_app
+t1 = time.perf_counter()
+after_import = heavy()
+app = attendance_app.create_app()
+t2 = time.perf_counter()
+attendance_app.init_db(app)
+t3 = time.perf_counter()
+client = app.test_client()
+client.get('/')
+t4 = time.perf_counter()
+client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+t5 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'create_app_ms': (t2 - t1) * 1000,
+    'init_db_ms': (t3 - t2) * 1000,
+    'first_request_ms': (t4 - t3) * 1000,
+    'first_login_ms': (t5 - t4) * 1000,
+    'heavy_after_import': after_import,
+    'heavy_after_login': heavy()
+}))
+'''
+
+
+def run_once(env):
+    code = f'BACKEND_DIR = {BACKEND_DIR!r}\nHEAVY_MODULES = {HEAVY_MODULES!r}\n' + CHILD
+    result = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    db_dir = tempfile.mkdtemp()
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(db_dir, "startup.db")}', MAINTENANCE_ENABLED='0',
+               DB_INIT_ON_START='0')
+    first = run_once(env)
+    runs = [run_once(env) for _ in range(RUNS)]
+    print(f'fresh database: init_db {first["init_db_ms"]:.1f} ms')
+    print(f'existing database, median of {RUNS} runs:')
+    for key in ('import_ms', 'create_app_ms', 'init_db_ms', 'first_request_ms', 'first_login_ms'):
+        print(f'  {key:<18} {statistics.median(r[key] for r in runs):8.1f} ms')
+    print(f'  heavy modules after import: {runs[-1]["heavy_after_import"]}')
+    print(f'  heavy modules after login:  {runs[-1]["heavy_after_login"]}')
@@ -0,0 +1,267 @@
+"""Bulk-load a synthetic, realistically shaped dataset for benchmarking.
+
+Builds a fresh SQLite database with the app's schema and fills it with:
+
+  instructors   each teaching 1..2*C-1 courses (C on average)
+  courses       a class list drawn from a shared student pool, 15..120 students
+  sessions      S per course, on weekdays at class hours over the last DAYS days;
+                sessions from today are still active
+  attendances   every enrolled student attends with a per-course probability
+                (70-97%); arrivals cluster a few minutes before the start with a
+                late tail, most stay until near the end, some leave early and a
+                few never check out. Statuses follow the course grace windows,
+                and no-shows get 'absent' rows as closing a session would.
+
+Rows go in through executemany on one transaction with the attendance
+indexes, change-log triggers and search index added afterwards, which is what keeps a
+multi-million row load to about half a minute. Logins: admin/admin123, and
+instructor0001.. with password123.
+
+Usage: python benchmarks/generate_dataset.py [--database PATH] [--instructors N]
+       [--courses-per-instructor C] [--sessions-per-course S] [--students N]
+       [--days DAYS] [--seed SEED]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+FIRST_NAMES = [
+    'Ali', 'Ayse', 'Mehmet', 'Fatma', 'Mustafa', 'Zeynep', 'Emre', 'Elif', 'Can', 'Selin', 'Burak', 'Deniz',
+    'John', 'Mary', 'James', 'Linda', 'Wei', 'Mei', 'Omar', 'Sara', 'Luca', 'Giulia', 'Ivan', 'Olga'
+]
+SURNAMES = [
+    'Yilmaz', 'Kaya', 'Demir', 'Sahin', 'Celik', 'Yildiz', 'Aydin', 'Ozturk', 'Arslan', 'Dogan',
+    'Smith', 'Johnson', 'Brown', 'Garcia', 'Chen', 'Wang', 'Hassan', 'Rossi', 'Ivanov', 'Novak'
+]
+SUBJECTS = ['MATH', 'PHYS', 'CHEM', 'BIO', 'CS', 'EE', 'ME', 'HIST', 'ECON', 'PSY', 'ENG', 'ART']
+USER_AGENTS = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 Chrome/120.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (iPad; CPU OS 17_0 like Mac OS X) Mobile/15E148 Safari/604.1',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36'
+]
+BATCH_SIZE = 50_000
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--database', default=os.path.join('instance', 'synthetic.db'),
+                        help='SQLite file to create (replaced if it exists)')
+    parser.add_argument('--instructors', type=int, default=2000)
+    parser.add_argument('--courses-per-instructor', type=int, default=3)
+    parser.add_argument('--sessions-per-course', type=int, default=8)
+    parser.add_argument('--students', type=int, default=50_000, help='size of the shared student pool')
+    parser.add_argument('--days', type=int, default=120, help='sessions are spread over this many past days')
+    parser.add_argument('--seed', type=int, default=42)
+    return parser.parse_args(argv)
+
+
+def generate(database, instructors=2000, courses_per_instructor=3, sessions_per_course=8,
+             students=50_000, days=120, seed=42, log=print):
+    """Create `database` and fill it; returns the row counts"""
+    database = os.path.abspath(database)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database + suffix):
+            os.remove(database + suffix)
+    os.makedirs(os.path.dirname(database), exist_ok=True)
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    os.environ.setdefault('MAINTENANCE_ENABLED', '0')
+    os.environ.setdefault('DB_INIT_ON_START', '0')
+
+    import bcrypt
+    import app as attendance_app
+    from app import db, Attendance, AttendanceChange, CacheInvalidation, create_attendance_search, schema_fingerprint
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    app = attendance_app.create_app()
+    with app.app_context():
+        # Change log tables last: creating them adds the triggers (and logs existing attendances in one statement)
+        db.metadata.create_all(db.engine, tables=[
+            table for table in db.metadata.sorted_tables
+            if table not in (AttendanceChange.__table__, CacheInvalidation.__table__)
+        ])
+        conn = db.engine.raw_connection()
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA synchronous = OFF')
+        for index in Attendance.__table__.indexes:
+            cursor.execute(f'DROP INDEX {index.name}')
+
+        counts = load(cursor, rng, bcrypt, instructors, courses_per_instructor, sessions_per_course,
+                      students, days, log)
+        conn.commit()
+
+        log('building indexes, change log and search index...')
+        for index in Attendance.__table__.indexes:
+            index.create(db.engine)
+        AttendanceChange.__table__.create(db.engine)
+        CacheInvalidation.__table__.create(db.engine)
+        with db.engine.begin() as search_conn:
+            create_attendance_search(search_conn)
+        cursor.execute(f'PRAGMA user_version = {schema_fingerprint()}')
+        cursor.execute('ANALYZE')
+        conn.commit()
+        conn.close()
+    counts['seconds'] = round(time.perf_counter() - started, 1)
+    counts['database_mib'] = round(os.path.getsize(database) / 2**20, 1)
+    return counts
+
+
+def load(cursor, rng, bcrypt, instructors, courses_per_instructor, sessions_per_course, students, days, log):
+    now = datetime.now().replace(microsecond=0)
+    today = now.replace(hour=0, minute=0, second=0)
+    password_hash = bcrypt.hashpw(b'password123', bcrypt.gensalt(rounds=4)).decode('utf-8')
+    admin_hash = bcrypt.hashpw(b'admin123', bcrypt.gensalt()).decode('utf-8')
+
+    users = [('admin', admin_hash, 'admin', 'System Administrator', 'admin@school.edu', str(now), 1)]
+    users += [
+        (f'instructor{i:04d}', password_hash, 'instructor', f'{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}',
+         f'instructor{i:04d}@school.edu', str(now), 1)
+        for i in range(1, instructors + 1)
+    ]
+    cursor.executemany(
+        'INSERT INTO users (username, password_hash, role, full_name, email, created_at, is_active) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?)', users
+    )
+
+    pool = [(rng.choice(FIRST_NAMES), rng.choice(SURNAMES), f'S{i:06d}') for i in range(students)]
+    courses = []
+    for instructor_id in range(2, instructors + 2):
+        for _ in range(rng.randint(1, 2 * courses_per_instructor - 1)):
+            subject = rng.choice(SUBJECTS)
+            number = rng.randint(100, 499)
+            # Rosters are unique on (name, surname) within a course
+            class_list = {}
+            for student in rng.sample(pool, min(students, int(rng.triangular(15, 120, 35)))):
+                class_list.setdefault(student[:2], student)
+            courses.append({
+                'id': len(courses) + 1,
+                'row': (f'{subject} {number}', f'Synthetic {subject} course', instructor_id, str(now), 1,
+                        f'{subject}{number}', len(class_list), 10, 10),
+                'name': f'{subject} {number}',
+                'students': list(class_list.values()),
+                'rate': rng.uniform(0.70, 0.97),
+                'hour': rng.randint(8, 17),
+                'weekday': rng.randint(0, 4),
+                'length': rng.choice((50, 90, 120, 180))
+            })
+    cursor.executemany(
+        'INSERT INTO courses (name, description, instructor_id, created_at, is_active, course_code, '
+        'max_students, late_grace_minutes, early_leave_minutes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        [course['row'] for course in courses]
+    )
+    cursor.executemany(
+        'INSERT INTO course_roster (course_id, name, surname, student_id, created_at) VALUES (?, ?, ?, ?, ?)',
+        [(course['id'], name, surname, student_id, str(now))
+         for course in courses for name, surname, student_id in course['students']]
+    )
+    log(f'{len(users)} users, {len(courses)} courses')
+
+    sessions = []
+    session_id = 0
+    attendances = []
+    attendance_count = 0
+
+    def flush():
+        nonlocal attendance_count
+        cursor.executemany(
+            'INSERT INTO attendances (session_id, name, surname, student_id, ip_address, entry_time, exit_time, '
+            'course_name, user_agent, status, duration_minutes, student_key) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', attendances
+        )
+        attendance_count += len(attendances)
+        attendances.clear()
+
+    # Timestamps are built from precomputed 'HH:MM:' and 'SS' pieces; classes never cross midnight
+    clock = [f'{minute // 60:02d}:{minute % 60:02d}:' for minute in range(24 * 60)]
+    seconds = [f'{second:02d}' for second in range(60)]
+    random_, gauss, expovariate = rng.random, rng.gauss, rng.expovariate
+    for course in courses:
+        # Each student checks in from the same phone all term
+        devices = [
+            (f'10.{course["id"] % 250}.{rng.randint(0, 255)}.{rng.randint(1, 254)}', rng.choice(USER_AGENTS))
+            for _ in course['students']
+        ]
+        # Weekly class on the course's weekday, going back from today
+        first = today - timedelta(days=(today.weekday() - course['weekday']) % 7)
+        length = course['length'] * 60
+        for week in range(sessions_per_course):
+            start = first.replace(hour=course['hour']) - timedelta(weeks=week)
+            if (today - start).days > days:
+                break
+            end = start + timedelta(seconds=length)
+            session_id += 1
+            active = end > now
+            sessions.append((course['id'], f'e{session_id:07d}', f'x{session_id:07d}', f'Week {week + 1}',
+                             str(start), str(start), str(end), int(active), course['length']))
+            if start > now:
+                continue
+            date = f'{start.date()} '
+            start_minute = course['hour'] * 60
+            elapsed = (now - start).total_seconds() if active else float('inf')
+            late_after = 10 * 60
+            early_before = length - 10 * 60
+            for (name, surname, student_id), (ip_address, user_agent) in zip(course['students'], devices):
+                key = f'id:{student_id.casefold()}'
+                if random_() > course['rate']:
+                    if not active:
+                        attendances.append((session_id, name, surname, student_id, '', None, None,
+                                            course['name'], None, 'absent', None, key))
+                    continue
+                # Arrivals cluster just before the start, with a tail of late comers (seconds from the start)
+                offset = gauss(-180, 240) if random_() > 0.12 else expovariate(1 / 720)
+                entry = int(max(-900.0, min(offset, length * 0.6)))
+                if entry > elapsed:
+                    continue
+                leave = random_()
+                if leave < 0.05:
+                    exit_ = None
+                elif leave < 0.13:
+                    exit_ = entry + int(random_() * (length - entry))
+                else:
+                    exit_ = length - int(abs(gauss(0, 300)))
+                if exit_ is not None and (exit_ > elapsed or exit_ <= entry):
+                    exit_ = None
+                if entry > late_after:
+                    status = 'late'
+                elif exit_ is not None and exit_ < early_before:
+                    status = 'left_early'
+                else:
+                    status = 'present'
+                minute, second = divmod(entry, 60)
+                entry_time = date + clock[start_minute + minute] + seconds[second]
+                if exit_ is None:
+                    exit_time = duration = None
+                else:
+                    minute, second = divmod(exit_, 60)
+                    exit_time = date + clock[start_minute + minute] + seconds[second]
+                    duration = (exit_ - entry) // 60
+                attendances.append((session_id, name, surname, student_id, ip_address, entry_time, exit_time,
+                                    course['name'], user_agent, status, duration, key))
+            if len(attendances) >= BATCH_SIZE:
+                flush()
+    flush()
+    cursor.executemany(
+        'INSERT INTO sessions (course_id, entry_token, exit_token, session_name, session_date, start_time, '
+        'end_time, is_active, max_duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', sessions
+    )
+    log(f'{len(sessions)} sessions, {attendance_count} attendances')
+    return {
+        'users': len(users),
+        'courses': len(courses),
+        'roster_entries': sum(len(course['students']) for course in courses),
+        'sessions': len(sessions),
+        'attendances': attendance_count
+    }
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    counts = generate(args.database, args.instructors, args.courses_per_instructor, args.sessions_per_course,
+                      args.students, args.days, args.seed)
+    print(', '.join(f'{key}={value}' for key, value in counts.items()))
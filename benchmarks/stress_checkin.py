@@ -0,0 +1,115 @@
+"""Concurrent double-tap stress test for check-in and check-out.
+
+Serves the app from a real threaded HTTP server on a throwaway SQLite
+database, then fires TAPS simultaneous check-ins for each of N students
+(a barrier releases them together), followed by TAPS simultaneous
+check-outs. Odd-numbered students type their student ID on only some of
+their taps, as when one is forgotten, so check-ins and check-outs must also
+match across the ID and the name. Afterwards it verifies:
+
+  - exactly one attendance row per student
+  - exactly one successful check-in and one successful check-out per student
+  - every row has an exit time and a duration
+
+Exits non-zero if any check fails.
+
+Usage: python benchmarks/stress_checkin.py [students] [taps]
+"""
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+STUDENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+TAPS = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+db_dir = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(db_dir, "stress.db")}'
+os.environ['MAINTENANCE_ENABLED'] = '0'
+os.environ['DB_INIT_ON_START'] = '0'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend'))
+
+from werkzeug.serving import make_server  # noqa: E402
+
+import app as attendance_app  # noqa: E402
+from app import db, Attendance, Course, Session, User  # noqa: E402
+
+app = attendance_app.create_app({'ADMISSION_IP_BURST': 1e9, 'ADMISSION_SESSION_BURST': 1e9})
+
+
+def seed():
+    db.create_all()
+    db.session.execute(db.insert(User), [{'username': 'stress', 'password_hash': 'x', 'role': 'admin'}])
+    db.session.execute(db.insert(Course), [{'name': 'Stress 101', 'instructor_id': 1}])
+    db.session.execute(db.insert(Session), [{
+        'course_id': 1, 'entry_token': 'entry', 'exit_token': 'exit',
+        'session_date': attendance_app.datetime.now(), 'is_active': True
+    }])
+    db.session.commit()
+
+
+def tap_all(base_url, kind, success_marker):
+    """TAPS concurrent submissions per student; returns successes per student"""
+    lock = threading.Lock()
+    barriers = {}
+
+    def tap(job):
+        student, tap_number = job
+        with lock:
+            student_barrier = barriers.setdefault(student, threading.Barrier(TAPS))
+        form = {'name': f'Student{student}', 'surname': 'Stress'}
+        # Odd students give their ID on alternate taps, a different half for check-out
+        if student % 2 == 0 or tap_number % 2 == (kind == 'exit'):
+            form['student_id'] = f'S{student}'
+        student_barrier.wait()
+        with urllib.request.urlopen(f'{base_url}/attend/{kind}/{kind}', data=urllib.parse.urlencode(form).encode()) as response:
+            body = response.read().decode('utf-8')
+        return student if success_marker in body else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=TAPS * 16) as pool:
+        results = list(pool.map(tap, [(s, t) for s in range(STUDENTS) for t in range(TAPS)]))
+    elapsed = time.perf_counter() - started
+    print(f'{kind:<6} {STUDENTS * TAPS} requests in {elapsed:.2f} s ({STUDENTS * TAPS / elapsed:.0f} req/s)')
+    return Counter(student for student in results if student is not None)
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        seed()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    print(f'{STUDENTS} students x {TAPS} simultaneous taps')
+
+    entries = tap_all(base_url, 'entry', 'Successfully checked IN')
+    exits = tap_all(base_url, 'exit', 'Successfully checked OUT')
+    server.shutdown()
+
+    with app.app_context():
+        rows = Counter(key for (key,) in db.session.query(Attendance.student_key))
+        incomplete = Attendance.query.filter(
+            db.or_(Attendance.exit_time.is_(None), Attendance.duration_minutes.is_(None))
+        ).count()
+    failures = []
+    if len(rows) != STUDENTS or any(count != 1 for count in rows.values()):
+        failures.append(f'expected {STUDENTS} rows, one per student; got {sum(rows.values())} rows for {len(rows)} students')
+    for label, successes in (('check-in', entries), ('check-out', exits)):
+        wrong = [s for s in range(STUDENTS) if successes.get(s, 0) != 1]
+        if wrong:
+            failures.append(f'{len(wrong)} students without exactly one successful {label}')
+    if incomplete:
+        failures.append(f'{incomplete} rows missing exit time or duration')
+
+    for failure in failures:
+        print('FAIL', failure)
+    if not failures:
+        print('OK: one row, one check-in and one check-out per student')
+    sys.exit(1 if failures else 0)
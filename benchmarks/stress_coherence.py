@@ -0,0 +1,239 @@
+"""Multi-process cache coherence check.
+
+Starts WORKERS server processes on one throwaway SQLite database, the way a
+pre-forking WSGI server would, and logs in once (the session cookie is valid
+on every worker). Each round warms every worker's caches, writes through one
+worker and immediately reads back through all of them. It checks that:
+
+  - course and dashboard analytics count the new check-in on every worker
+  - a closed session stops counting as active on every worker
+  - roster names added or removed through one worker show up in (or vanish
+    from) check-in autocomplete on every worker
+  - a shared-device cluster built from check-ins taken by different workers
+    raises its alert on the worker that completes it
+  - repeat taps answered from the in-memory presence sets match the
+    database, whichever worker took the check-in or check-out
+  - a session created through a worker that has not synced yet can be
+    checked out of there after another worker took the check-in
+
+It prints each worker's analytics cache hit rate and coherence counters,
+and exits non-zero if any read was stale. With --without-coherence it runs
+the same rounds with CACHE_COHERENCE_ENABLED=0 to show the failures it
+catches.
+
+Usage: python benchmarks/stress_coherence.py [--workers N] [--rounds N] [--without-coherence]
+"""
+import argparse
+import http.cookiejar
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--without-coherence', action='store_true')
+    return parser.parse_args(argv)
+
+
+def serve(ports):
+    """Worker process: one app instance on its own port"""
+    sys.path.insert(0, BACKEND)
+    from werkzeug.serving import make_server
+    import app as attendance_app
+
+    app = attendance_app.create_app({
+        'ADMISSION_IP_BURST': 1e9, 'ADMISSION_SESSION_BURST': 1e9,
+        'PROXY_DEVICE_THRESHOLD': 3, 'PROXY_IP_THRESHOLD': 0
+    })
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def seed():
+    sys.path.insert(0, BACKEND)
+    import app as attendance_app
+    from app import db, Course, Session
+
+    app = attendance_app.create_app()
+    with app.app_context():
+        course = Course.query.filter_by(course_code='MATH101').one()
+        sessions = []
+        for i in range(2):
+            session = Session(
+                course_id=course.id, entry_token=f'entry{i}', exit_token=f'exit{i}',
+                session_name=f'Coherence {i}', session_date=attendance_app.datetime.now(), is_active=True
+            )
+            db.session.add(session)
+            sessions.append(session)
+        db.session.commit()
+        return course.id, [session.id for session in sessions]
+
+
+class Client:
+    def __init__(self, ports):
+        self.urls = [f'http://127.0.0.1:{port}' for port in ports]
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, worker, path, data=None, method=None, headers=None):
+        body = None
+        request_headers = dict(headers or {})
+        if isinstance(data, dict) and method != 'FORM':
+            body = json.dumps(data).encode()
+            request_headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode()
+        request = urllib.request.Request(self.urls[worker] + path, data=body, headers=request_headers,
+                                         method=None if method == 'FORM' else method)
+        with self.opener.open(request) as response:
+            payload = response.read().decode('utf-8')
+        return json.loads(payload) if response.headers.get_content_type() == 'application/json' else payload
+
+
+def check_in(client, worker, token, student, user_agent='stress'):
+    return client.request(worker, f'/attend/entry/{token}', {
+        'name': f'Student{student}', 'surname': 'Coherence', 'student_id': f'C{student}'
+    }, method='FORM', headers={'User-Agent': user_agent})
+
+
+def check_out(client, worker, token, student):
+    return client.request(worker, f'/attend/exit/{token}', {
+        'name': f'Student{student}', 'surname': 'Coherence', 'student_id': f'C{student}'
+    }, method='FORM')
+
+
+def run(args):
+    context = multiprocessing.get_context('spawn')
+    ports = context.Queue()
+    processes = [context.Process(target=serve, args=(ports,), daemon=True) for _ in range(args.workers)]
+    for process in processes:
+        process.start()
+    client = Client([ports.get(timeout=60) for _ in processes])
+    workers = range(args.workers)
+    client.request(0, '/api/login', {'username': 'admin', 'password': 'admin123'})
+    rng = random.Random(1)
+    failures = []
+    course_id, session_ids = args.course_id, args.session_ids
+
+    def expect(label, worker, actual, expected):
+        if actual != expected:
+            failures.append(f'{label} on worker {worker}: got {actual!r}, expected {expected!r}')
+
+    # A new session: must run first, while the last worker has not polled the logs yet
+    checked_in = 0
+    if args.workers >= 2:
+        creator = args.workers - 1
+        created = client.request(creator, '/api/create_session', {'course_id': course_id, 'session_name': 'Coherence new'})
+        check_in(client, 0, created['entry_token'], 'N1')
+        checked_in += 1
+        expect('check-out from the worker that created the session', creator,
+               'checked OUT' in check_out(client, creator, created['exit_token'], 'N1'), True)
+        client.request(creator, f"/api/sessions/{created['session_id']}/close", {}, method='POST')
+
+    # Analytics: every worker must count every check-in at once
+    for round_number in range(args.rounds):
+        for worker in workers:
+            client.request(worker, f'/api/analytics/course/{course_id}')
+            client.request(worker, '/api/analytics/dashboard')
+        writer = rng.choice(workers)
+        if 'checked IN' not in check_in(client, writer, 'entry0', round_number, f'phone{round_number}'):
+            failures.append(f'check-in {round_number} failed on worker {writer}')
+        checked_in += 1
+        for worker in workers:
+            course = client.request(worker, f'/api/analytics/course/{course_id}')
+            expect('course attendances', worker, course['statistics']['total_attendances'], checked_in)
+            dashboard = client.request(worker, '/api/analytics/dashboard')
+            expect('dashboard attendances', worker, dashboard['overview']['total_attendances'], checked_in)
+
+    # Closing a session through one worker
+    for worker in workers:
+        client.request(worker, '/api/analytics/dashboard')
+    client.request(rng.choice(workers), f'/api/sessions/{session_ids[1]}/close', {}, method='POST')
+    for worker in workers:
+        expect('active sessions after close', worker,
+               client.request(worker, '/api/analytics/dashboard')['overview']['active_sessions'], 1)
+
+    # Roster autocomplete
+    for round_number in range(min(args.rounds, 10)):
+        for worker in workers:
+            client.request(worker, '/attend/suggest/entry0?q=zz')
+        writer = rng.choice(workers)
+        name = f'Zz{round_number:02d}'
+        client.request(writer, f'/api/courses/{course_id}/roster', {'students': [{'name': name, 'surname': 'Roster'}]},
+                       method='POST')
+        for worker in workers:
+            names = [row['name'] for row in client.request(worker, f'/attend/suggest/entry0?q={name}')]
+            expect(f'suggestions for new {name}', worker, names, [name])
+        entry_id = next(e['id'] for e in client.request(writer, f'/api/courses/{course_id}/roster') if e['name'] == name)
+        client.request(rng.choice(workers), f'/api/courses/{course_id}/roster/{entry_id}', method='DELETE')
+        for worker in workers:
+            expect(f'suggestions for deleted {name}', worker, client.request(worker, f'/attend/suggest/entry0?q={name}'), [])
+
+    # Proxy detection: three students on one device, through different workers
+    if args.workers >= 2:
+        device = 'shared-phone'
+        check_in(client, 0, 'entry0', 'P1', device)
+        check_in(client, 1, 'entry0', 'P2', device)
+        check_in(client, 0, 'entry0', 'P3', device)
+        alerts = [alert['student'] for alert in client.request(0, '/api/proxy_alerts')]
+        expect('alert for the third student on one device', 0, 'StudentP3 Coherence (CP3)' in alerts, True)
+
+    # Presence: every worker answers repeat taps correctly, wherever the write went
+    for round_number in range(args.rounds):
+        student = f'Q{round_number}'
+        writer, other = rng.sample(list(workers), 2) if args.workers >= 2 else (0, 0)
+        expect(f'check-out of {student} before check-in', other,
+               'must check in first' in check_out(client, other, 'exit0', student), True)
+        check_in(client, writer, 'entry0', student, f'phone{student}')
+        for worker in workers:
+            expect(f'repeat check-in of {student}', worker, 'already checked in' in check_in(client, worker, 'entry0', student), True)
+        response = check_out(client, other, 'exit0', student)
+        expect(f'check-out of {student}', other, 'checked OUT' in response, True)
+        for worker in workers:
+            response = check_out(client, worker, 'exit0', student)
+            expect(f'repeat check-out of {student}', worker, 'already checked out' in response, True)
+
+    print(f'{args.workers} workers, {args.rounds} rounds, coherence {"off" if args.without_coherence else "on"}')
+    for worker in workers:
+        stats = client.request(worker, '/api/analytics/cache')
+        lookups = stats['hits'] + stats['misses']
+        print(f'worker {worker}: analytics hit rate {stats["hits"] / lookups:.0%} ({stats["hits"]}/{lookups})'
+              + (f', coherence {stats["coherence"]}' if 'coherence' in stats else ''))
+    for process in processes:
+        process.terminate()
+    return failures
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    db_dir = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(db_dir, "coherence.db")}'
+    # Session QR images go next to the throwaway database, not into the repository
+    os.environ['QR_CODES_DIR'] = db_dir
+    os.environ['MAINTENANCE_ENABLED'] = '0'
+    os.environ['CACHE_COHERENCE_ENABLED'] = '0' if args.without_coherence else '1'
+    args.course_id, args.session_ids = seed()
+
+    started = time.perf_counter()
+    failures = run(args)
+    print(f'finished in {time.perf_counter() - started:.1f} s')
+    for failure in failures[:20]:
+        print('FAIL', failure)
+    if len(failures) > 20:
+        print(f'... and {len(failures) - 20} more')
+    if not failures:
+        print('OK: every worker saw every write immediately')
+    sys.exit(1 if failures else 0)
@@ -25,6 +25,7 @@ const usersContent = document.getElementById('users-content');
 const totalCourses = document.getElementById('total-courses');
 const totalSessions = document.getElementById('total-sessions');
 const totalAttendances = document.getElementById('total-attendances');
+const recentSessionsList = document.getElementById('recent-sessions-list');
 
 // Course elements
 const coursesGrid = document.getElementById('courses-grid');
@@ -42,6 +43,10 @@ const userForm = document.getElementById('user-form');
 const sessionsModal = document.getElementById('sessions-modal');
 const sessionsList = document.getElementById('sessions-list');
 const createSessionBtn = document.getElementById('create-session-btn');
+const exportMatrixBtn = document.getElementById('export-matrix-btn');
+const printQrBtn = document.getElementById('print-qr-btn');
+const importRosterBtn = document.getElementById('import-roster-btn');
+const rosterFileInput = document.getElementById('roster-file');
 
 // QR elements
 const qrModal = document.getElementById('qr-modal');
@@ -79,12 +84,12 @@ document.addEventListener('DOMContentLoaded', function() {
 // Authentication functions
 async function checkAuth() {
     try {
-        const response = await fetch('/api/courses');
+        // One request tells us who is logged in and holds everything the dashboard shows
+        const response = await fetch('/api/bootstrap');
         if (response.ok) {
-            const courses = await response.json();
-            // User is logged in, get user info from session storage or make another call
-            showDashboard();
-            loadDashboardData();
+            const bootstrap = await response.json();
+            setCurrentUser(bootstrap.user);
+            showDashboard(bootstrap);
         } else {
             showLogin();
         }
@@ -94,16 +99,28 @@ async function checkAuth() {
     }
 }
 
+function setCurrentUser(user) {
+    currentUser = user;
+    userName.textContent = `Welcome, ${user.full_name || user.username}!`;
+    
+    // Show/hide admin features
+    if (user.role === 'admin') {
+        usersMenuItem.style.display = 'block';
+    } else {
+        usersMenuItem.style.display = 'none';
+    }
+}
+
 function showLogin() {
     loginSection.style.display = 'flex';
     dashboardSection.style.display = 'none';
     loginError.textContent = '';
 }
 
-function showDashboard() {
+function showDashboard(bootstrap) {
     loginSection.style.display = 'none';
     dashboardSection.style.display = 'block';
-    switchTab('dashboard');
+    switchTab('dashboard', bootstrap);
 }
 
 async function login(username, password) {
@@ -118,16 +135,7 @@ async function login(username, password) {
 
         if (response.ok) {
             const user = await response.json();
-            currentUser = user;
-            userName.textContent = `Welcome, ${user.full_name || user.username}!`;
-            
-            // Show/hide admin features
-            if (user.role === 'admin') {
-                usersMenuItem.style.display = 'block';
-            } else {
-                usersMenuItem.style.display = 'none';
-            }
-            
+            setCurrentUser(user);
             showDashboard();
             return true;
         } else {
@@ -151,34 +159,57 @@ async function logout() {
 }
 
 // Dashboard functions
-async function loadDashboardData() {
+async function fetchBootstrap() {
+    // The browser revalidates with If-None-Match, so unchanged data costs a 304
+    const response = await fetch('/api/bootstrap');
+    if (response.status === 401) {
+        showLogin();
+        return null;
+    }
+    if (!response.ok) {
+        throw new Error('Failed to fetch dashboard data');
+    }
+    return await response.json();
+}
+
+async function loadDashboardData(bootstrap) {
     try {
-        const courses = await fetchCourses();
-        totalCourses.textContent = courses.length;
-        
-        // Calculate total sessions and attendances
-        let sessionCount = 0;
-        let attendanceCount = 0;
-        
-        for (const course of courses) {
-            const sessions = await fetchSessions(course.id);
-            sessionCount += sessions.length;
-            
-            for (const session of sessions) {
-                attendanceCount += session.attendance_count || 0;
-            }
-        }
-        
-        totalSessions.textContent = sessionCount;
-        totalAttendances.textContent = attendanceCount;
+        const data = bootstrap || await fetchBootstrap();
+        if (!data) return;
         
+        totalCourses.textContent = data.stats.total_courses;
+        totalSessions.textContent = data.stats.total_sessions;
+        totalAttendances.textContent = data.stats.total_attendances;
+        displayRecentSessions(data.recent_sessions);
     } catch (error) {
         console.error('Failed to load dashboard data:', error);
     }
 }
 
+function displayRecentSessions(sessions) {
+    if (sessions.length === 0) {
+        recentSessionsList.innerHTML = '<div class="loading">No sessions yet</div>';
+        return;
+    }
+    
+    recentSessionsList.innerHTML = sessions.map(session => `
+        <div class="activity-item">
+            <div class="activity-icon">
+                <i class="fas ${session.is_active ? 'fa-broadcast-tower' : 'fa-calendar-check'}"></i>
+            </div>
+            <div class="activity-content">
+                <div class="activity-title">${escapeHtml(session.course_name)} - ${escapeHtml(session.session_name || 'Unnamed Session')}</div>
+                <div class="activity-time">
+                    ${session.session_date ? new Date(session.session_date).toLocaleString() : 'N/A'}
+                    · ${session.checked_in_count} in, ${session.checked_out_count} out${session.is_active ? ' · Active' : ''}
+                </div>
+            </div>
+        </div>
+    `).join('');
+}
+
 // Tab switching
-function switchTab(tabName) {
+function switchTab(tabName, bootstrap) {
     // Update sidebar active state
     document.querySelectorAll('.sidebar-menu a').forEach(link => {
         link.classList.remove('active');
@@ -194,7 +225,7 @@ function switchTab(tabName) {
         case 'dashboard':
             dashboardContent.style.display = 'block';
             dashboardTab.classList.add('active');
-            loadDashboardData();
+            loadDashboardData(bootstrap);
             break;
         case 'courses':
             coursesContent.style.display = 'block';
@@ -421,6 +452,10 @@ function displaySessions(sessions) {
                 <button class="btn btn-success btn-sm" onclick="exportCSV(${session.id})">
                     <i class="fas fa-download"></i> Export CSV
                 </button>
+                ${session.is_active ? `
+                <button class="btn btn-warning btn-sm" onclick="closeSession(${session.id})">
+                    <i class="fas fa-lock"></i> Close
+                </button>` : ''}
                 <button class="btn btn-danger btn-sm" onclick="deleteSession(${session.id})">
                     <i class="fas fa-trash"></i> Delete
                 </button>
@@ -464,6 +499,30 @@ async function createSession() {
     }
 }
 
+async function closeSession(sessionId) {
+    if (!confirm('Close this session? Late arrivals, early leavers and absent students will be recorded.')) {
+        return;
+    }
+    
+    try {
+        const response = await fetch(`/api/sessions/${sessionId}/close`, {
+            method: 'POST',
+        });
+        
+        if (response.ok) {
+            const sessions = await fetchSessions(currentCourseId);
+            displaySessions(sessions);
+            showAlert('Session closed successfully!', 'success');
+        } else {
+            const error = await response.json();
+            throw new Error(error.error || 'Failed to close session');
+        }
+    } catch (error) {
+        console.error('Error closing session:', error);
+        showAlert(error.message, 'error');
+    }
+}
+
 async function deleteSession(sessionId) {
     if (!confirm('Are you sure you want to delete this session?')) {
         return;
@@ -575,19 +634,80 @@ async function exportCSV(sessionId) {
     }
 }
 
-// User management functions (Admin only)
-async function loadUsers() {
-    if (!currentUser || currentUser.role !== 'admin') return;
+async function exportMatrixCSV() {
+    if (!currentCourseId) return;
     
     try {
-        const response = await fetch('/api/users');
+        const response = await fetch(`/api/courses/${currentCourseId}/matrix/export_csv`);
         if (response.ok) {
-            const users = await response.json();
-            displayUsers(users);
-            loadUserCoursesCounts(); // Load course counts after users are displayed
+            const blob = await response.blob();
+            const url = window.URL.createObjectURL(blob);
+            const a = document.createElement('a');
+            a.href = url;
+            a.download = `course_${currentCourseId}_attendance_matrix.csv`;
+            a.click();
+            window.URL.revokeObjectURL(url);
         } else {
-            throw new Error('Failed to fetch users');
+            throw new Error('Failed to export attendance grid');
         }
+    } catch (error) {
+        console.error('Error exporting attendance grid:', error);
+        showAlert('Failed to export attendance grid', 'error');
+    }
+}
+
+function printQRSheets() {
+    if (!currentCourseId) return;
+    // The browser's PDF viewer shows pages as they stream in and prints from there
+    window.open(`/api/courses/${currentCourseId}/qr_sheet`, '_blank');
+}
+
+async function importRosterCSV() {
+    const file = rosterFileInput.files[0];
+    rosterFileInput.value = '';
+    if (!currentCourseId || !file) return;
+    
+    const formData = new FormData();
+    formData.append('file', file);
+    try {
+        const response = await fetch(`/api/courses/${currentCourseId}/roster/import`, {
+            method: 'POST',
+            body: formData
+        });
+        const result = await response.json();
+        if (!response.ok) {
+            throw new Error(result.error || 'Failed to import roster');
+        }
+        let message = `Roster imported: ${result.added} added, ${result.skipped} already listed (${result.roster_size} students)`;
+        if (result.error_count > 0) {
+            message += `, ${result.error_count} rows skipped`;
+        }
+        showAlert(message, 'success');
+    } catch (error) {
+        console.error('Error importing roster:', error);
+        showAlert(error.message || 'Failed to import roster', 'error');
+    }
+}
+
+// User management functions (Admin only)
+async function loadUsers() {
+    if (!currentUser || currentUser.role !== 'admin') return;
+    
+    try {
+        // Follow the keyset cursor until every page has been fetched
+        const users = [];
+        let cursor = null;
+        do {
+            const url = cursor ? `/api/users?after=${cursor}` : '/api/users';
+            const response = await fetch(url);
+            if (!response.ok) {
+                throw new Error('Failed to fetch users');
+            }
+            users.push(...await response.json());
+            cursor = response.headers.get('X-Next-Cursor');
+        } while (cursor);
+        displayUsers(users);
+        loadUserCoursesCounts(); // Load course counts after users are displayed
     } catch (error) {
         console.error('Error loading users:', error);
         usersTableBody.innerHTML = '<tr><td colspan="6">Failed to load users</td></tr>';
@@ -795,10 +915,9 @@ async function bulkDeleteUser(userId) {
 
 async function getUserById(userId) {
     try {
-        const response = await fetch('/api/users');
+        const response = await fetch(`/api/users/${userId}`);
         if (response.ok) {
-            const users = await response.json();
-            return users.find(user => user.id === userId);
+            return await response.json();
         }
         return null;
     } catch (error) {
@@ -1165,6 +1284,10 @@ function setupEventListeners() {
     
     // Create session button
     createSessionBtn.addEventListener('click', createSession);
+    exportMatrixBtn.addEventListener('click', exportMatrixCSV);
+    printQrBtn.addEventListener('click', printQRSheets);
+    importRosterBtn.addEventListener('click', () => rosterFileInput.click());
+    rosterFileInput.addEventListener('change', importRosterCSV);
     
     // Modal close buttons
     document.querySelectorAll('.modal .close').forEach(closeBtn => {